@@ -0,0 +1,79 @@
+"""
+This module provides a random search calibrator that batches the evaluations sharing a platform build.
+"""
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+import numpy as np
+import simcal as sc
+
+from ParameterSpace import ParameterSpace
+
+
+class BatchedRandom:
+    """
+    Random search split along the cost of the parameters.
+
+    Node and topology parameters need a platform to be generated (and compiled for fat trees),
+    while `--cfg` parameters (e.g. `network/*-factor_i`) are passed to an already built platform.
+    The outer loop samples the platform parameters, alternating between a uniform sample and a
+    perturbation of the best platform so far; the inner loop evaluates `batch_size` samples of
+    the `--cfg` parameters concurrently on that platform, the first of them being the best
+    `--cfg` values so far so that platforms are compared on equal terms. A single build is then
+    amortized over the whole batch through `SMPISimulator.acquire_platform`.
+    """
+
+    def __init__(self, space: ParameterSpace, batch_size: int = 16, num_threads: int = 1,
+                 refine_width: float = 0.1, seed: int = None):
+        self.space = space
+        self.batch_size = max(1, batch_size)
+        self.num_threads = max(1, num_threads)
+        self.refine_width = refine_width
+        self.rng = np.random.default_rng(seed)
+
+    def calibrate(self, simulator, timelimit=None, coordinator=None):
+        names = self.space.names
+        d = len(names)
+        platform = np.array([simulator.platform_parameter(name) for name in names], dtype=bool)
+        start_time = perf_counter()
+
+        def time_left():
+            return timelimit is None or perf_counter() - start_time < timelimit
+
+        best_u, best_loss = None, None
+        rounds = 0
+
+        with ThreadPoolExecutor(max_workers=self.num_threads) as pool:
+            # at least one batch, so there is a calibration to return
+            while best_u is None or time_left():
+                base = self.rng.random(d)
+                if best_u is not None and platform.any() and rounds % 2 == 1:
+                    # refine the platform parameters around the best platform so far
+                    base[platform] = np.clip(
+                        best_u[platform] + self.rng.normal(0, self.refine_width, platform.sum()), 0, 1)
+
+                batch = []
+                for k in range(self.batch_size):
+                    if platform.all():
+                        # no --cfg parameter, every evaluation needs its own platform
+                        batch.append(self.rng.random(d))
+                        continue
+                    u = base.copy()
+                    if k == 0 and best_u is not None:
+                        u[~platform] = best_u[~platform]
+                    elif k > 0:
+                        u[~platform] = self.rng.random(int((~platform).sum()))
+                    batch.append(u)
+
+                losses = [float(loss) for loss in pool.map(
+                    lambda u: simulator.run(sc.Environment(), self.space.from_unit_search(u)), batch)]
+
+                best = int(np.argmin(losses))
+                if best_loss is None or losses[best] < best_loss:
+                    best_u, best_loss = batch[best], losses[best]
+
+                rounds += 1
+                sys.stderr.write(f"Batched random: round {rounds}, best loss {best_loss}\n")
+
+        return self.space.from_unit_search(best_u), best_loss
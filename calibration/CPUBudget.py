@@ -0,0 +1,142 @@
+"""
+This module provides the CPU slots shared by every simulation and platform compilation.
+"""
+import math
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional
+
+
+def cgroup_cpu_limit() -> Optional[float]:
+    """
+    CPU quota of the cgroup of this process (v2 cpu.max or v1 cfs quota), None if unlimited.
+    """
+    cpu_max = Path("/sys/fs/cgroup/cpu.max")
+    try:
+        if cpu_max.exists():
+            quota, period = cpu_max.read_text(encoding="utf-8").split()[:2]
+            if quota != "max":
+                return int(quota) / int(period)
+            return None
+
+        quota_file = Path("/sys/fs/cgroup/cpu/cpu.cfs_quota_us")
+        period_file = Path("/sys/fs/cgroup/cpu/cpu.cfs_period_us")
+        if quota_file.exists() and period_file.exists():
+            quota = int(quota_file.read_text(encoding="utf-8"))
+            if quota > 0:
+                return quota / int(period_file.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        pass
+
+    return None
+
+
+class CPUBudget:
+    """
+    Counting semaphore over the CPUs this process may use.
+
+    The number of slots is the size of the affinity mask, bounded by the cgroup CPU quota
+    and by a user cap. When `pin` is set, the slots handed out are actual core ids that the
+    caller pins its processes to.
+
+    Several calibrations can share a budget through `share`: each one then holds at most an
+    equal part of the slots while the others are waiting for some.
+    """
+
+    def __init__(self, cap: Optional[int] = None, pin: bool = False):
+        if hasattr(os, "sched_getaffinity"):
+            cpus = sorted(os.sched_getaffinity(0))
+        else:
+            cpus = list(range(os.cpu_count() or 1))
+
+        total = len(cpus)
+        quota = cgroup_cpu_limit()
+        if quota is not None:
+            total = min(total, max(1, math.floor(quota)))
+        if cap is not None:
+            total = min(total, max(1, cap))
+
+        self.total = total
+        self.pin = pin
+        self.available = total
+        self.free_cores: List[int] = cpus[:total]
+        self.condition = threading.Condition()
+
+        # slots held and requests waiting, per client of `share`
+        self.held: Dict[str, int] = {}
+        self.waiting: Dict[str, int] = {}
+
+    def fair(self, client: Optional[str], n: int) -> bool:
+        """
+        Whether a client may take n more slots: always when it holds none or no other client is
+        waiting, else only within an equal part of the budget. Called with the condition held.
+        """
+        if client is None or self.held.get(client, 0) == 0:
+            return True
+        if not any(count > 0 for name, count in self.waiting.items() if name != client):
+            return True
+
+        active = {name for name, count in self.held.items() if count > 0}
+        active |= {name for name, count in self.waiting.items() if count > 0}
+        return self.held[client] + n <= max(1, self.total // len(active))
+
+    @contextmanager
+    def slots(self, n: int, client: Optional[str] = None):
+        """
+        Blocks until n slots (at most the whole budget) are free and holds them.
+
+        Args:
+            n (int): Number of slots.
+            client (str): Name of the calibration requesting them, for the fair share (see `share`).
+
+        Yields:
+            tuple: (number of slots granted, list of core ids when pinning, else None).
+        """
+        n = min(max(1, n), self.total)
+
+        with self.condition:
+            if client is not None:
+                self.waiting[client] = self.waiting.get(client, 0) + 1
+            self.condition.wait_for(lambda: self.available >= n and self.fair(client, n))
+            self.available -= n
+            if client is not None:
+                self.waiting[client] -= 1
+                self.held[client] = self.held.get(client, 0) + n
+            cores = None
+            if self.pin:
+                cores, self.free_cores = self.free_cores[:n], self.free_cores[n:]
+
+        try:
+            yield n, cores
+        finally:
+            with self.condition:
+                self.available += n
+                if client is not None:
+                    self.held[client] -= n
+                if cores is not None:
+                    self.free_cores.extend(cores)
+                self.condition.notify_all()
+
+    def share(self, client: str) -> "CPUShare":
+        """
+        The part of this budget used by one of the calibrations sharing it.
+        """
+        return CPUShare(self, client)
+
+
+class CPUShare:
+    """
+    CPUBudget view handing out the slots of a shared budget to one client, used in place of a
+    CPUBudget by the simulator of each calibration of a campaign.
+    """
+
+    def __init__(self, budget: CPUBudget, client: str):
+        self.budget = budget
+        self.client = client
+        self.total = budget.total
+        self.pin = budget.pin
+
+    def slots(self, n: int):
+        return self.budget.slots(n, client=self.client)
@@ -0,0 +1,221 @@
+"""
+This module provides campaigns: a matrix of calibration configurations run as one job, sharing
+their caches, evaluation store and CPUs.
+"""
+import itertools
+import json
+import sys
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from time import perf_counter
+from typing import List, Optional
+
+from CPUBudget import CPUBudget
+from ResultWriter import ResultWriter
+from StartupCache import StartupCache
+import run_smpi_calibrator
+
+
+def matrix_arguments(flag: str, value) -> List[str]:
+    """
+    Command line arguments of a matrix value: the flag alone for true, nothing for false or
+    null, else the flag and the value (lists joined with commas).
+    """
+    if value is True:
+        return [flag]
+    if value is False or value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        return [flag, ",".join(str(item) for item in value)]
+    return [flag, str(value)]
+
+
+def expand(spec: dict) -> List[dict]:
+    """
+    Configurations of a campaign: one per combination of the values of its "matrix" that no
+    "exclude" entry matches, each with the campaign "args" followed by the arguments of its values.
+
+    Returns:
+        List[dict]: {"name", "values", "argv"} of every configuration, named by their index.
+    """
+    matrix = spec.get("matrix", {})
+    flags = list(matrix.keys())
+    excludes = spec.get("exclude", [])
+
+    configurations = []
+    for combination in itertools.product(*(matrix[flag] for flag in flags)):
+        values = dict(zip(flags, combination))
+        if any(all(values.get(flag) == value for flag, value in exclude.items()) for exclude in excludes):
+            continue
+
+        argv = [str(arg) for arg in spec.get("args", [])]
+        for flag, value in values.items():
+            argv += matrix_arguments(flag, value)
+        configurations.append({"name": f"{len(configurations):03d}", "values": values, "argv": argv})
+
+    return configurations
+
+
+class SharedResources:
+    """
+    What the calibrations of a campaign share: the startup cache (ground truth index, host
+    speed and generated platforms, each platform being built once), the ground truth of every
+    (file, benchmarks, byte sizes, node counts) selection, the host speed and the CPU budget,
+    from which each calibration gets a fair share (see `CPUBudget.share`).
+    """
+
+    def __init__(self, name: str, cache: Optional[StartupCache], cpu_budget: CPUBudget):
+        self.name = name
+        self.cache = cache
+        self.cpu_budget = cpu_budget
+        self.lock = threading.Lock()
+        self.ground_truths = {}
+        self._hostspeed = None
+
+    def ground_truth(self, ground_truth_file: Path, args):
+        key = json.dumps([str(ground_truth_file), args.benchmarks, args.byte_sizes, args.node_counts])
+        with self.lock:
+            if key not in self.ground_truths:
+                self.ground_truths[key] = run_smpi_calibrator.load_ground_truth(self.cache, ground_truth_file, args)
+            return self.ground_truths[key]
+
+    @property
+    def hostspeed(self) -> float:
+        with self.lock:
+            if self._hostspeed is None:
+                from calibrate_flops import calibrate_hostspeed
+
+                def calibrate() -> float:
+                    # the whole budget, so no configuration simulates during the measure
+                    with self.cpu_budget.slots(self.cpu_budget.total):
+                        return calibrate_hostspeed()
+
+                if self.cache is not None:
+                    self._hostspeed = self.cache.host_speed(calibrate)
+                else:
+                    self._hostspeed = calibrate()
+            return self._hostspeed
+
+
+class Campaign:
+    """
+    Runs the configurations of a campaign specification in one process, `parallel` at a time.
+
+    The specification is a JSON object:
+      - "name": name of the campaign, recorded in the config of every run (optional),
+      - "args": `run_smpi_calibrator.py` arguments common to every configuration,
+      - "matrix": the values of each varying argument, e.g. {"--topology": [...], "--simple_compute": [false, true]},
+      - "exclude": combinations to skip, as partial {argument: value} objects (optional).
+
+    Each configuration writes its result.json, journal and logs to its own directory under
+    `output_dir`, and its evaluations to the shared store under its own run id. Configurations
+    that do not set `--num_threads` get an equal part of the CPU budget. The summary ranks the
+    configurations by loss and reports the wall time of the campaign, of every configuration
+    and the platforms built and reused.
+    """
+
+    def __init__(self, spec: dict, output_dir, parallel: Optional[int] = None, max_cpus: Optional[int] = None,
+                 pin_cpus: bool = False, cache_dir: Optional[str] = None, store: str = "evaluations.db"):
+        self.spec = spec
+        self.name = spec.get("name", "campaign")
+        self.output_dir = Path(output_dir)
+        # shared by the configurations, whose output directories differ
+        self.store = str((self.output_dir / store).resolve()) if store else store
+        self.configurations = expand(spec)
+
+        self.cpu_budget = CPUBudget(max_cpus, pin_cpus)
+        self.parallel = max(1, min(parallel or self.cpu_budget.total, len(self.configurations)))
+        self.shared = SharedResources(
+            self.name, StartupCache(cache_dir) if cache_dir != "" else None, self.cpu_budget)
+        self.results = []
+
+    def parse(self, configuration: dict):
+        """
+        The `run_smpi_calibrator.py` arguments of a configuration, with the campaign-wide ones.
+        """
+        try:
+            args = run_smpi_calibrator.build_parser().parse_args(configuration["argv"])
+            run_smpi_calibrator.check_args(args)
+        except SystemExit:
+            sys.stderr.write(f"Error: invalid configuration {configuration['name']}: "
+                             f"{' '.join(configuration['argv'])}\n")
+            raise
+
+        args.output_dir = str(self.output_dir / configuration["name"])
+        args.store = self.store
+        args.cache_dir = str(self.shared.cache.directory) if self.shared.cache is not None else ""
+        args.max_cpus = self.cpu_budget.total
+        args.pin_cpus = self.cpu_budget.pin
+        if not any(arg in ("-j", "--num_threads") or arg.startswith("--num_threads=")
+                   for arg in configuration["argv"]):
+            args.num_threads = max(1, self.cpu_budget.total // self.parallel)
+
+        return args
+
+    def run_configuration(self, configuration: dict, args) -> dict:
+        entry = {"name": configuration["name"], "values": configuration["values"],
+                 "argv": configuration["argv"], "output_dir": args.output_dir}
+        start = perf_counter()
+
+        try:
+            document = run_smpi_calibrator.run(args, self.shared, client=configuration["name"])
+            results = document["results"]
+            entry.update(status="done", run_id=document["config"].get("run_id"),
+                         loss=results.get("loss", results.get("best_loss")),
+                         calibration=results.get("calibration", results.get("best_result")))
+        except (Exception, SystemExit):  # pylint: disable=broad-except
+            # platform build failures exit()
+            entry.update(status="failed", error=traceback.format_exc())
+            sys.stderr.write(f"Configuration {configuration['name']} failed:\n{entry['error']}\n")
+
+        entry["wall_time"] = perf_counter() - start
+        return entry
+
+    def run(self) -> dict:
+        """
+        Runs every configuration and writes the summary to `campaign.json` in the output directory.
+
+        Returns:
+            dict: The summary.
+        """
+        parsed = [(configuration, self.parse(configuration)) for configuration in self.configurations]
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+
+        start = perf_counter()
+        # calibrated (or read from the cache) once, before the configurations start simulating
+        hostspeed = self.shared.hostspeed
+
+        with ThreadPoolExecutor(max_workers=self.parallel) as pool:
+            self.results = list(pool.map(lambda item: self.run_configuration(*item), parsed))
+
+        summary = self.summary(perf_counter() - start, hostspeed)
+        writer = ResultWriter(self.output_dir / "campaign.json")
+        writer.snapshot(summary)
+        writer.close()
+
+        return summary
+
+    def summary(self, wall_time: float, hostspeed: float) -> dict:
+        ranked = sorted((entry for entry in self.results if entry.get("loss") is not None),
+                        key=lambda entry: entry["loss"])
+        cache = self.shared.cache
+
+        return {
+            "name": self.name,
+            "configurations": len(self.results),
+            "failed": [entry["name"] for entry in self.results if entry["status"] == "failed"],
+            "parallel": self.parallel,
+            "cpus": self.cpu_budget.total,
+            "wall_time": wall_time,
+            # wall time the configurations would take one after the other
+            "configuration_time": sum(entry["wall_time"] for entry in self.results),
+            "host_speed": hostspeed,
+            "ground_truth_selections": len(self.shared.ground_truths),
+            "platforms": dict(cache.platform_stats) if cache is not None else None,
+            "store": self.store,
+            "ranking": [{"name": entry["name"], "loss": entry["loss"], "values": entry["values"]}
+                        for entry in ranked],
+            "results": self.results
+        }
@@ -0,0 +1,108 @@
+"""
+This module provides convergence detection over the stream of evaluation losses.
+"""
+from time import perf_counter
+from typing import Optional
+
+
+class ConvergenceReached(Exception):
+    """
+    Raised by `SMPISimulator.run` once the monitor decided the calibration has converged.
+    """
+
+    def __init__(self, reason: str):
+        super().__init__(f"Calibration converged: {reason}")
+        self.reason = reason
+
+
+class ConvergenceMonitor:
+    """
+    Tracks the best loss over time and decides when a calibration should stop early.
+
+    An evaluation only counts as an improvement when it lowers the best loss by more than
+    `min_improvement` (relative to the best loss). The calibration is considered converged when:
+      - `patience` evaluations passed without improvement, or
+      - `patience_time` seconds passed without improvement, or
+      - the surrogate model predicts an improvement below `min_expected_improvement`
+        (relative, reported through `report_expected_improvement`).
+    """
+
+    def __init__(self, patience: Optional[int] = None, patience_time: Optional[float] = None,
+                 min_improvement: float = 0.0, min_expected_improvement: Optional[float] = None):
+        self.patience = patience
+        self.patience_time = patience_time
+        self.min_improvement = min_improvement
+        self.min_expected_improvement = min_expected_improvement
+
+        self.start_time = perf_counter()
+        self.evaluations = 0
+        self.best_loss = None
+        self.best_calibration = None
+        self.last_improvement = 0
+        self.last_improvement_time = 0.0
+        self.trace = []
+        self.stop_reason = None
+
+    def elapsed(self) -> float:
+        return perf_counter() - self.start_time
+
+    def update(self, calibration: dict, loss: float):
+        """
+        Records an evaluation and checks the no-improvement criteria.
+        """
+        elapsed = self.elapsed()
+        loss = float(loss)
+        self.evaluations += 1
+
+        if self.best_loss is None or loss < self.best_loss:
+            if self.best_loss is None or self.best_loss - loss > self.min_improvement * abs(self.best_loss):
+                self.last_improvement = self.evaluations
+                self.last_improvement_time = elapsed
+            self.best_loss = loss
+            self.best_calibration = calibration
+            self.trace.append([round(elapsed, 3), self.evaluations, float(loss)])
+
+        if self.stop_reason is not None:
+            return
+
+        if self.patience is not None and self.evaluations - self.last_improvement >= self.patience:
+            self.stop_reason = f"no improvement in the last {self.patience} evaluations"
+        elif self.patience_time is not None and elapsed - self.last_improvement_time >= self.patience_time:
+            self.stop_reason = f"no improvement in the last {self.patience_time} seconds"
+
+    def report_expected_improvement(self, expected_improvement: float):
+        """
+        Records the improvement over the best loss predicted by a surrogate model.
+        """
+        if self.stop_reason is not None or self.min_expected_improvement is None or self.best_loss is None:
+            return
+
+        if expected_improvement < self.min_expected_improvement * abs(self.best_loss):
+            self.stop_reason = (f"surrogate-predicted improvement {expected_improvement} below "
+                                f"{self.min_expected_improvement} of the best loss")
+
+    def summary(self) -> dict:
+        """
+        Loss-vs-wall-clock statistics for result.json.
+
+        Returns:
+            dict: stop reason, evaluation count, elapsed time, the [elapsed, evaluation, best loss]
+                  trace of improvements, and the time at which the best loss came within 10%, 5%
+                  and 1% of its final value.
+        """
+        time_to_within = {}
+        if self.best_loss is not None:
+            for fraction in (0.1, 0.05, 0.01):
+                for elapsed, _, loss in self.trace:
+                    if loss - self.best_loss <= fraction * abs(self.best_loss):
+                        time_to_within[f"{int(fraction * 100)}%"] = elapsed
+                        break
+
+        return {
+            "stop_reason": self.stop_reason if self.stop_reason is not None else "time limit",
+            "evaluations": self.evaluations,
+            "elapsed": round(self.elapsed(), 3),
+            "best_loss": self.best_loss,
+            "time_to_within": time_to_within,
+            "trace": self.trace
+        }
@@ -0,0 +1,123 @@
+"""
+This module provides the aggregation of the simulation cost statistics of a calibration.
+"""
+import json
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from ParameterSpace import numeric_prefix
+
+
+def ranks(values: List[float]) -> np.ndarray:
+    """
+    Ranks of the values, tied values sharing their average rank.
+    """
+    values = np.asarray(values, dtype=float)
+    result = np.empty(len(values))
+    result[np.argsort(values, kind="stable")] = np.arange(len(values))
+    for value in np.unique(values):
+        tied = values == value
+        result[tied] = result[tied].mean()
+    return result
+
+
+def rank_correlation(x: List[float], y: List[float]) -> Optional[float]:
+    """
+    Spearman rank correlation of x and y, None when either is constant or too short.
+    """
+    if len(x) < 3 or len(set(x)) < 2 or len(set(y)) < 2:
+        return None
+    return float(np.corrcoef(ranks(x), ranks(y))[0, 1])
+
+
+class CostReport:
+    """
+    Collects the per byte size `stats` of `wrapper_parallel --stats` (wall time of smpirun, and
+    simulated time, simulation time and application time reported by SimGrid) attached to the
+    evaluation records, and the time spent building platforms.
+
+    The summary ranks the points by cost per run, correlates the cost of an evaluation with each
+    numeric parameter, and compares the platforms (node and topology parameter values), so the
+    expensive regions of the search space can be told apart.
+    """
+
+    def __init__(self, known_points: List[tuple], platform_parameter: Callable[[str], bool]):
+        self.labels = [[f"{i[0]}/{i[1]}/{i[2]}/{byte_size}" for byte_size in i[3]] for i in known_points]
+        self.actors = [int(i[2]) for i in known_points]
+        self.platform_parameter = platform_parameter
+
+        self.points: Dict[str, dict] = {}
+        self.evaluations = []
+        self.builds = []
+
+    def update(self, record: dict):
+        """
+        Adds an evaluation record of `SMPISimulator.evaluate`. Not thread-safe, callers hold the simulator lock.
+        """
+        wall_time = 0.0
+        simulation_time = 0.0
+        for count, known_point in enumerate(record["points"]):
+            for j, point in enumerate(known_point):
+                stats = point.get("stats")
+                if stats is None:
+                    # interpolated points are not simulated
+                    continue
+                entry = self.points.setdefault(self.labels[count][j], {
+                    "actors": self.actors[count], "runs": 0, "timed_runs": 0, "wall_time": 0.0,
+                    "simulated_time": 0.0, "simulation_time": 0.0, "application_time": 0.0})
+                entry["runs"] += point["count"]
+                for key in ("timed_runs", "wall_time", "simulated_time", "simulation_time", "application_time"):
+                    entry[key] += stats[key] or 0
+                wall_time += stats["wall_time"] or 0
+                simulation_time += stats["simulation_time"] or 0
+
+        self.evaluations.append({"calibration": dict(record["calibration"]),
+                                 "wall_time": wall_time, "simulation_time": simulation_time})
+
+    def add_build(self, node: dict, topology: dict, seconds: float):
+        self.builds.append({"platform": json.dumps([node, topology], sort_keys=True), "seconds": seconds})
+
+    def summary(self) -> dict:
+        points = []
+        for label, entry in self.points.items():
+            runs = max(entry["runs"], 1)
+            timed_runs = max(entry["timed_runs"], 1)
+            points.append({
+                "point": label, "actors": entry["actors"], "runs": entry["runs"],
+                "wall_time_per_run": entry["wall_time"] / runs,
+                "simulated_time_per_run": entry["simulated_time"] / timed_runs,
+                "simulation_time_per_run": entry["simulation_time"] / timed_runs,
+                "application_time_per_run": entry["application_time"] / timed_runs
+            })
+        points.sort(key=lambda point: -point["wall_time_per_run"])
+
+        costs = [evaluation["wall_time"] for evaluation in self.evaluations]
+        names = sorted({name for evaluation in self.evaluations for name in evaluation["calibration"]})
+
+        parameters = {}
+        for name in names:
+            pairs = [(numeric_prefix(evaluation["calibration"].get(name)), evaluation["wall_time"])
+                     for evaluation in self.evaluations]
+            pairs = [pair for pair in pairs if pair[0] is not None]
+            parameters[name] = rank_correlation([p[0] for p in pairs], [p[1] for p in pairs])
+
+        platforms = {}
+        for evaluation in self.evaluations:
+            key = json.dumps({name: value for name, value in evaluation["calibration"].items()
+                              if self.platform_parameter(name)}, sort_keys=True)
+            platforms.setdefault(key, []).append(evaluation["wall_time"])
+
+        return {
+            "evaluations": len(self.evaluations),
+            "wall_time": float(sum(costs)),
+            "points": points,
+            # > 0: the simulations get slower as the parameter grows
+            "parameter_correlation": parameters,
+            "platforms": sorted(
+                [{"platform": json.loads(key), "evaluations": len(times), "mean_wall_time": float(np.mean(times))}
+                 for key, times in platforms.items()],
+                key=lambda platform: -platform["mean_wall_time"]),
+            "builds": {"count": len(self.builds), "seconds": float(sum(build["seconds"] for build in self.builds))},
+            "slowest": sorted(self.evaluations, key=lambda evaluation: -evaluation["wall_time"])[:5]
+        }
@@ -0,0 +1,367 @@
+"""
+This module provides the broker that hands evaluations out to worker processes, on this host or
+on other hosts reachable through TCP, and the worker that runs them.
+"""
+import copy
+import itertools
+import os
+import queue
+import socket
+import subprocess
+import sys
+import threading
+import traceback
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from multiprocessing.connection import Client, Listener
+from pathlib import Path
+from time import perf_counter
+from typing import Optional, Tuple
+
+from SharedGroundTruth import SharedGroundTruth
+
+
+def parse_address(address: str) -> Tuple[str, int]:
+    """
+    "host:port" (or ":port" for every interface) to a (host, port) tuple.
+    """
+    host, _, port = address.rpartition(":")
+    return host or "0.0.0.0", int(port)
+
+
+class Task:
+    def __init__(self, task_id: int, calibration: dict, interpolate: bool, iterations):
+        self.id = task_id
+        self.calibration = calibration
+        self.interpolate = interpolate
+        self.iterations = iterations
+        self.attempts = 0
+        # whether a worker is simulating it
+        self.running = False
+        self.future = Future()
+
+
+class EvaluationBroker:
+    """
+    Queue of evaluations served to the workers connected to a TCP address.
+
+    `SMPISimulator.evaluate` hands its simulations to `evaluate` when a broker is set, which
+    blocks until a worker returns the evaluation record. Each worker connection runs one
+    evaluation at a time and sends a heartbeat every few seconds while it simulates; a task whose
+    worker disconnects or misses its heartbeats for `heartbeat_timeout` seconds is queued again,
+    at most `max_attempts` times. Messages are pickled and the connections are authenticated
+    with `authkey`.
+
+    Workers receive the keyword arguments of their `SMPISimulator` and the host speed of the
+    calibrator on connection, so every host simulates the same platform. Workers on this host
+    attach to the ground truth published in shared memory instead of receiving a copy. Each
+    worker writes its simulator logs to its own directory, `log_dir/worker-<n>` for the local
+    workers and `log_dir/worker-<host>-<pid>` for the others unless they set one.
+
+    `evaluate` gives up on a task no worker started by `deadline` (the end of the calibrator's
+    time limit), and on every task once no worker has been connected for `heartbeat_timeout`
+    seconds after the last one left, or once every local worker exited before any connected.
+    """
+
+    def __init__(self, simulator_args: dict, hostspeed: float, address: str = "127.0.0.1:0",
+                 authkey: bytes = b"", heartbeat_timeout: float = 60.0, max_attempts: int = 3,
+                 log_dir: Optional[str] = None):
+        self.simulator_args = simulator_args
+        self.hostspeed = hostspeed
+        self.heartbeat_timeout = heartbeat_timeout
+        self.max_attempts = max_attempts
+        self.authkey = authkey
+        self.local_workers = []
+        # parent of the log directories of the workers, the current directory if None
+        self.log_dir = log_dir
+
+        self.listener = Listener(parse_address(address), authkey=authkey)
+        self.address = self.listener.address
+        self.tasks = queue.Queue()
+        self.ids = itertools.count()
+        self.closed = threading.Event()
+        self.lock = threading.Lock()
+        self.workers = {}
+        self.shared = None
+
+        # perf_counter() time after which tasks that did not start are abandoned, None for no limit
+        self.deadline = None
+        self.connected = 0
+        self.ever_connected = False
+        self.last_disconnect = None
+
+        ground_truth = simulator_args.get("ground_truth")
+        if ground_truth is not None and not isinstance(ground_truth, SharedGroundTruth):
+            self.shared = SharedGroundTruth.publish(ground_truth)
+
+        self.accept_thread = threading.Thread(target=self.accept, daemon=True)
+        self.accept_thread.start()
+
+    def accept(self):
+        while not self.closed.is_set():
+            try:
+                conn = self.listener.accept()
+            except Exception as error:  # pylint: disable=broad-except
+                if self.closed.is_set():
+                    return
+                # e.g. a connection with the wrong authkey
+                sys.stderr.write(f"Broker: rejected a connection ({error})\n")
+                continue
+            threading.Thread(target=self.serve, args=(conn,), daemon=True).start()
+
+    def config_for(self, hostname: str) -> dict:
+        args = dict(self.simulator_args)
+        if self.shared is not None and hostname == socket.gethostname():
+            args["ground_truth"] = self.shared
+        return {"simulator": args, "hostspeed": self.hostspeed, "log_dir": self.log_dir}
+
+    def serve(self, conn):
+        """
+        Feeds the tasks of the queue to one worker connection until it is lost or the broker closes.
+        """
+        task = None
+        registered = False
+        try:
+            _, hostname, pid = conn.recv()
+            worker = f"{hostname}:{pid}"
+            conn.send(("config", self.config_for(hostname)))
+            with self.lock:
+                self.workers[worker] = self.workers.get(worker, 0) + 1
+                self.connected += 1
+                self.ever_connected = True
+                registered = True
+            sys.stderr.write(f"Broker: worker {worker} connected\n")
+
+            while not self.closed.is_set():
+                try:
+                    task = self.tasks.get(timeout=1)
+                except queue.Empty:
+                    continue
+                if task.future.done():
+                    task = None
+                    continue
+
+                task.attempts += 1
+                task.running = True
+                conn.send(("task", task.id, task.calibration, task.interpolate, task.iterations))
+
+                while True:
+                    if not conn.poll(self.heartbeat_timeout):
+                        raise TimeoutError(f"no heartbeat from {worker} in {self.heartbeat_timeout}s")
+                    message = conn.recv()
+                    if message[0] == "heartbeat":
+                        continue
+                    if task.future.done():
+                        # abandoned by evaluate
+                        pass
+                    elif message[0] == "result":
+                        task.future.set_result(message[2])
+                    else:
+                        task.future.set_exception(RuntimeError(f"Worker {worker} failed:\n{message[2]}"))
+                    break
+                task = None
+
+            conn.send(("stop",))
+        except (EOFError, OSError, TimeoutError) as error:
+            sys.stderr.write(f"Broker: lost a worker ({error!r})\n")
+            if task is not None:
+                self.requeue(task)
+        finally:
+            conn.close()
+            if registered:
+                with self.lock:
+                    self.connected -= 1
+                    self.last_disconnect = perf_counter()
+
+    def requeue(self, task: Task):
+        task.running = False
+        if task.future.done():
+            return
+        if task.attempts >= self.max_attempts:
+            task.future.set_exception(
+                RuntimeError(f"Evaluation of {task.calibration} lost {task.attempts} times"))
+            return
+        self.tasks.put(task)
+
+    def evaluate(self, calibration: dict, interpolate: bool = False, iterations=None) -> dict:
+        """
+        Runs `SMPISimulator.simulate` for a calibration on a worker and returns its record.
+
+        Args:
+            calibration (dict): The stringified calibration.
+            interpolate (bool): Whether the worker simulates in interpolation mode.
+            iterations (list): Repetitions of every point, from the `RepetitionAllocator` of the calibrator.
+        """
+        task = Task(next(self.ids), calibration, interpolate, iterations)
+        self.tasks.put(task)
+
+        while True:
+            try:
+                return task.future.result(timeout=1)
+            except FutureTimeout:
+                pass
+
+            error = self.stalled(task)
+            if error is not None:
+                # serve skips the abandoned task, or drops its result
+                task.future.cancel()
+                raise error
+
+    def stalled(self, task: Task) -> Optional[Exception]:
+        """
+        The error evaluate raises for a task that will not be evaluated in time, None to keep waiting.
+        """
+        with self.lock:
+            connected, ever_connected, last_disconnect = self.connected, self.ever_connected, self.last_disconnect
+
+        if self.deadline is not None and perf_counter() > self.deadline and not task.running:
+            return TimeoutError("time limit reached before a worker took the evaluation")
+        if connected > 0:
+            return None
+        if ever_connected and perf_counter() - last_disconnect > self.heartbeat_timeout:
+            return RuntimeError(f"no worker connected to the broker for {self.heartbeat_timeout}s")
+        if not ever_connected and self.local_workers and all(w.poll() is not None for w in self.local_workers):
+            return RuntimeError("every local worker exited before connecting to the broker")
+        return None
+
+    def start_local_workers(self, count: int, max_cpus: Optional[int] = None):
+        """
+        Starts `count` worker processes on this host, connected through the loopback interface.
+        """
+        host, port = self.address
+        if host in ("0.0.0.0", ""):
+            host = "127.0.0.1"
+
+        command = [sys.executable, str(Path(__file__).parent / "run_smpi_worker.py"), f"{host}:{port}"]
+        if max_cpus is not None:
+            command += ["--max_cpus", str(max_cpus)]
+
+        env = dict(os.environ, SMPI_BROKER_AUTHKEY=self.authkey.decode("utf-8"))
+        # the workers would otherwise all write their logs to the same files of the current directory
+        log_dir = Path(self.log_dir or ".")
+        first = len(self.local_workers)
+        self.local_workers += [
+            subprocess.Popen(command + ["--log_dir", str(log_dir / f"worker-{n}")], env=env)
+            for n in range(first, first + count)
+        ]
+
+    def close(self):
+        """
+        Stops serving the workers (they exit after their current evaluation) and waits for the local workers.
+        """
+        self.closed.set()
+        self.listener.close()
+        for worker in self.local_workers:
+            try:
+                worker.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                worker.terminate()
+        if self.shared is not None:
+            self.shared.close()
+            self.shared = None
+
+
+class EvaluationWorker:
+    """
+    Connects `num_threads` connections to a broker and runs the evaluations it sends.
+    """
+
+    def __init__(self, address: str, authkey: bytes = b"", num_threads: int = 1,
+                 cpu_budget=None, cache=None, heartbeat_interval: float = 10.0,
+                 log_dir: Optional[str] = None):
+        self.address = parse_address(address)
+        self.authkey = authkey
+        self.num_threads = max(1, num_threads)
+        self.cpu_budget = cpu_budget
+        self.cache = cache
+        self.heartbeat_interval = heartbeat_interval
+        # directory of the simulator logs, else a worker-<host>-<pid> directory in the broker's
+        self.log_dir = log_dir
+
+        self.lock = threading.Lock()
+        self.simulator = None
+
+    def get_simulator(self, config: dict):
+        """
+        The simulator of this process, shared by its connections so they share the built platforms.
+        """
+        from SMPISimulator import SMPISimulator
+
+        with self.lock:
+            if self.simulator is None:
+                self.simulator = SMPISimulator(
+                    **config["simulator"], cpu_budget=self.cpu_budget, cache=self.cache,
+                    hostspeed=config["hostspeed"])
+
+                log_dir = self.log_dir
+                if log_dir is None:
+                    log_dir = Path(config.get("log_dir") or ".") / f"worker-{socket.gethostname()}-{os.getpid()}"
+                self.simulator.log_dir = Path(log_dir)
+                self.simulator.log_dir.mkdir(parents=True, exist_ok=True)
+            return self.simulator
+
+    def serve(self):
+        threads = [threading.Thread(target=self.serve_connection) for _ in range(self.num_threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if self.simulator is not None:
+            self.simulator.cleanup()
+
+    def serve_connection(self):
+        try:
+            conn = Client(self.address, authkey=self.authkey)
+        except (OSError, EOFError) as error:
+            sys.stderr.write(f"Worker: cannot connect to {self.address} ({error})\n")
+            return
+
+        send_lock = threading.Lock()
+
+        def send(message):
+            with send_lock:
+                conn.send(message)
+
+        try:
+            conn.send(("hello", socket.gethostname(), os.getpid()))
+            _, config = conn.recv()
+            simulator = self.get_simulator(config)
+
+            while True:
+                message = conn.recv()
+                if message[0] == "stop":
+                    return
+
+                _, task_id, calibration, interpolate, iterations = message
+
+                # each task gets its own view of the simulator (interpolation mode, repetitions)
+                task_simulator = copy.copy(simulator)
+                task_simulator.interpolate = interpolate
+                if iterations is not None and simulator.allocator is not None:
+                    task_simulator.allocator = copy.copy(simulator.allocator)
+                    task_simulator.allocator.iterations = iterations
+
+                done = threading.Event()
+
+                def heartbeat(task_id=task_id, done=done):
+                    while not done.wait(self.heartbeat_interval):
+                        send(("heartbeat", task_id))
+
+                heartbeat_thread = threading.Thread(target=heartbeat, daemon=True)
+                heartbeat_thread.start()
+                try:
+                    record = task_simulator.simulate(calibration)
+                    reply = ("result", task_id, record)
+                except (Exception, SystemExit):  # pylint: disable=broad-except
+                    # platform build failures exit()
+                    reply = ("error", task_id, traceback.format_exc())
+                finally:
+                    done.set()
+                    heartbeat_thread.join()
+                send(reply)
+        except (EOFError, OSError):
+            # the broker closed the connection
+            return
+        finally:
+            conn.close()
+
@@ -0,0 +1,248 @@
+"""
+This module provides a SQLite store of every simulator evaluation.
+
+Each evaluation is stored with its calibration parameters as numeric columns, its per-point
+results and losses, its timings and the host that ran it, so large calibration campaigns can be
+analysed without scraping `sim_stderr.txt` or the stderr "Result: {...}" lines.
+"""
+import json
+import os
+import socket
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from ParameterSpace import numeric_prefix
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    started REAL,
+    host TEXT,
+    pid INTEGER,
+    cpu_count INTEGER,
+    argv TEXT,
+    config TEXT
+);
+CREATE TABLE IF NOT EXISTS evaluations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_id TEXT,
+    timestamp REAL,
+    host TEXT,
+    pid INTEGER,
+    loss REAL,
+    time REAL,
+    calibration TEXT,
+    result TEXT,
+    losses TEXT
+);
+CREATE TABLE IF NOT EXISTS points (
+    evaluation_id INTEGER,
+    benchmark TEXT,
+    node_count INTEGER,
+    processes INTEGER,
+    bytes INTEGER,
+    simulated REAL
+);
+CREATE TABLE IF NOT EXISTS benchmark_losses (
+    evaluation_id INTEGER,
+    benchmark TEXT,
+    node_count INTEGER,
+    processes INTEGER,
+    loss REAL
+);
+CREATE INDEX IF NOT EXISTS evaluations_loss ON evaluations (loss);
+CREATE INDEX IF NOT EXISTS evaluations_run ON evaluations (run_id, loss);
+CREATE INDEX IF NOT EXISTS points_evaluation ON points (evaluation_id);
+CREATE INDEX IF NOT EXISTS points_benchmark ON points (benchmark, bytes);
+CREATE INDEX IF NOT EXISTS benchmark_losses_evaluation ON benchmark_losses (evaluation_id);
+"""
+
+
+def _column(name: str) -> str:
+    return '"param:' + name.replace('"', '""') + '"'
+
+
+class EvaluationStore:
+    """
+    SQLite store of evaluation records, shared by all the threads of a calibration.
+    """
+
+    def __init__(self, path: str, run_id: str = None, config: dict = None):
+        self.path = str(path)
+        self.run_id = run_id if run_id is not None else uuid.uuid4().hex[:12]
+        self.lock = threading.Lock()
+        self.host = socket.gethostname()
+
+        self.connection = sqlite3.connect(self.path, check_same_thread=False, timeout=60)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(_SCHEMA)
+        self.param_columns = {
+            row[1][len("param:"):] for row in self.connection.execute("PRAGMA table_info(evaluations)")
+            if row[1].startswith("param:")
+        }
+
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (self.run_id, time.time(), self.host, os.getpid(), os.cpu_count(),
+                 json.dumps(sys.argv), json.dumps(config if config is not None else {}, default=str)))
+
+    def _ensure_columns(self, names):
+        for name in names:
+            if name not in self.param_columns:
+                try:
+                    self.connection.execute(f"ALTER TABLE evaluations ADD COLUMN {_column(name)} REAL")
+                except sqlite3.OperationalError as error:
+                    # added by another run writing to the same file (e.g. a campaign)
+                    if "duplicate column" not in str(error):
+                        raise
+                self.connection.execute(
+                    f"CREATE INDEX IF NOT EXISTS {_column(name)[:1] + 'index:' + _column(name)[1:]} "
+                    f"ON evaluations ({_column(name)})")
+                self.param_columns.add(name)
+
+    def add(self, record: dict, known_points: List[tuple]) -> int:
+        """
+        Stores an evaluation record of `SMPISimulator.evaluate`.
+
+        Args:
+            record (dict): The evaluation record (calibration, result, losses, loss, time).
+            known_points (List[tuple]): The (benchmark, node_count, processes, bytes) known points.
+
+        Returns:
+            int: The id of the stored evaluation.
+        """
+        calibration = record["calibration"]
+        names = sorted(calibration.keys())
+
+        with self.lock, self.connection:
+            self._ensure_columns(names)
+            columns = ", ".join(_column(name) for name in names)
+            placeholders = ", ".join("?" for _ in names)
+            cursor = self.connection.execute(
+                "INSERT INTO evaluations (run_id, timestamp, host, pid, loss, time, calibration, result, losses"
+                + (f", {columns}) " if names else ") ")
+                + "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?" + (f", {placeholders})" if names else ")"),
+                (self.run_id, time.time(), self.host, os.getpid(), float(record["loss"]), record["time"],
+                 json.dumps(calibration), json.dumps(record["result"]), json.dumps(record["losses"]),
+                 *[numeric_prefix(calibration[name]) for name in names]))
+            evaluation_id = cursor.lastrowid
+
+            points, losses = [], []
+            offset = 0
+            for count, i in enumerate(known_points):
+                losses.append((evaluation_id, i[0], int(i[1]), int(i[2]), record["losses"][count]))
+                for byte_size, simulated in zip(i[3], record["result"][offset:offset + len(i[3])]):
+                    points.append((evaluation_id, i[0], int(i[1]), int(i[2]), int(byte_size), simulated))
+                offset += len(i[3])
+
+            self.connection.executemany("INSERT INTO points VALUES (?, ?, ?, ?, ?, ?)", points)
+            self.connection.executemany("INSERT INTO benchmark_losses VALUES (?, ?, ?, ?, ?)", losses)
+
+        return evaluation_id
+
+    def _query(self, sql: str, params=()) -> List[sqlite3.Row]:
+        with self.lock:
+            self.connection.row_factory = sqlite3.Row
+            try:
+                return self.connection.execute(sql, params).fetchall()
+            finally:
+                self.connection.row_factory = None
+
+    @staticmethod
+    def _record(row: sqlite3.Row) -> dict:
+        return {
+            "id": row["id"],
+            "run_id": row["run_id"],
+            "calibration": json.loads(row["calibration"]),
+            "loss": row["loss"],
+            "time": row["time"],
+            "losses": json.loads(row["losses"]),
+            "result": json.loads(row["result"])
+        }
+
+    def _run_filter(self, run_id: Optional[str]):
+        if run_id is None:
+            return "", ()
+        return " WHERE run_id = ?", (run_id,)
+
+    def top_k(self, k: int = 10, run_id: Optional[str] = None) -> List[dict]:
+        """
+        The k evaluations with the lowest loss.
+        """
+        where, params = self._run_filter(run_id)
+        rows = self._query(f"SELECT * FROM evaluations{where} ORDER BY loss LIMIT ?", (*params, k))
+        return [self._record(row) for row in rows]
+
+    def neighbors(self, calibration: Dict[str, str], k: int = 10, run_id: Optional[str] = None) -> List[dict]:
+        """
+        The k evaluations closest to a calibration, by euclidean distance over the parameter
+        columns normalized by their observed range. Non-numeric values are left out of the
+        distance, and evaluations missing one of the parameters come last.
+        """
+        names = [name for name in sorted(calibration.keys())
+                 if name in self.param_columns and numeric_prefix(calibration[name]) is not None]
+        if len(names) == 0:
+            return []
+
+        where, params = self._run_filter(run_id)
+        ranges = self._query(
+            "SELECT " + ", ".join(f"MIN({_column(n)}), MAX({_column(n)})" for n in names)
+            + f" FROM evaluations{where}", params)[0]
+
+        terms, term_params = [], []
+        for j, name in enumerate(names):
+            low, high = ranges[2 * j], ranges[2 * j + 1]
+            scale = (high - low) if low is not None and high is not None and high > low else 1.0
+            value = numeric_prefix(calibration[name])
+            terms.append(f"(({_column(name)} - ?) / ?) * (({_column(name)} - ?) / ?)")
+            term_params += [value, scale, value, scale]
+
+        rows = self._query(
+            f"SELECT *, ({' + '.join(terms)}) AS distance FROM evaluations{where} "
+            "ORDER BY distance IS NULL, distance LIMIT ?",
+            (*term_params, *params, k))
+
+        return [dict(self._record(row), distance=row["distance"]) for row in rows]
+
+    def loss_histogram(self, bins: int = 20, run_id: Optional[str] = None) -> dict:
+        """
+        Histogram of the losses, as {"counts": [...], "edges": [...]}.
+        """
+        where, params = self._run_filter(run_id)
+        losses = [row[0] for row in self._query(f"SELECT loss FROM evaluations{where}", params)]
+        counts, edges = np.histogram(losses, bins=bins) if losses else ([], [])
+
+        return {"counts": [int(c) for c in counts], "edges": [float(e) for e in edges]}
+
+    def pareto_front(self, run_id: Optional[str] = None) -> List[dict]:
+        """
+        The evaluations of a run (this one by default) that are not dominated on the
+        per-benchmark losses. Runs on other ground truths have other per-benchmark losses, so
+        the front is never computed across runs.
+        """
+        where, params = self._run_filter(run_id if run_id is not None else self.run_id)
+        rows = self._query(f"SELECT * FROM evaluations{where} ORDER BY loss", params)
+        records = [self._record(row) for row in rows]
+
+        front = []
+        for record in records:
+            losses = np.array(record["losses"])
+            if any(np.all(np.array(other["losses"]) <= losses) and np.any(np.array(other["losses"]) < losses)
+                   for other in front):
+                continue
+            front = [other for other in front
+                     if not (np.all(losses <= np.array(other["losses"])) and np.any(losses < np.array(other["losses"])))]
+            front.append(record)
+
+        return front
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
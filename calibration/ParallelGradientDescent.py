@@ -0,0 +1,88 @@
+"""
+This module provides a gradient descent calibrator that evaluates its probes concurrently.
+"""
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+import numpy as np
+import simcal as sc
+
+from ParameterSpace import ParameterSpace
+
+
+class ParallelGradientDescent:
+    """
+    Gradient descent over the normalized search space of a `ParameterSpace`.
+
+    Each step estimates the gradient with central differences, dispatching the 2 * d
+    perturbed evaluations to a pool of `num_threads` threads, then probes the descent direction
+    with several step lengths concurrently. The search stops when the loss is flat even across
+    perturbations of `max_delta`. Perturbations of the `--cfg` parameters (e.g. network factors)
+    reuse the platform compiled for the current point through `SMPISimulator.acquire_platform`.
+    """
+
+    def __init__(self, delta: float, step: float, space: ParameterSpace, num_threads: int = 1,
+                 max_delta: float = 0.5):
+        self.delta = delta
+        # perturbations of max_delta span the whole range of a parameter from any point
+        self.max_delta = max_delta
+        self.step = step
+        self.space = space
+        self.num_threads = max(1, num_threads)
+        self.line_search_probes = max(2, self.num_threads)
+
+    def calibrate(self, simulator, timelimit=None, coordinator=None):
+        d = len(self.space)
+        start_time = perf_counter()
+
+        def evaluate(points):
+            return [float(loss) for loss in pool.map(
+                lambda u: simulator.run(sc.Environment(), self.space.from_unit_search(u)), points)]
+
+        def time_left():
+            return timelimit is None or perf_counter() - start_time < timelimit
+
+        with ThreadPoolExecutor(max_workers=self.num_threads) as pool:
+            # the search starts at the center of the space (the previous best when warm starting)
+            x = np.full(d, 0.5)
+            f_x = evaluate([x])[0]
+            step = self.step
+            delta = self.delta
+
+            while time_left() and step >= self.delta / 100:
+                upper = np.clip(x + delta * np.eye(d), 0, 1)
+                lower = np.clip(x - delta * np.eye(d), 0, 1)
+                losses = evaluate(list(upper) + list(lower))
+
+                widths = np.diag(upper - lower)
+                gradient = np.array([
+                    (losses[j] - losses[d + j]) / widths[j] if widths[j] > 0 else 0.0
+                    for j in range(d)
+                ])
+
+                norm = np.linalg.norm(gradient)
+                if norm == 0:
+                    if delta >= self.max_delta:
+                        sys.stderr.write(f"Gradient descent: flat around the best point, loss {f_x}\n")
+                        break
+                    # widen the differences until they leave the flat region
+                    delta = min(delta * 2, self.max_delta)
+                    continue
+                direction = -gradient / norm
+
+                lengths = [step * 2.0 ** (1 - k) for k in range(self.line_search_probes)]
+                candidates = [np.clip(x + length * direction, 0, 1) for length in lengths]
+                candidate_losses = evaluate(candidates)
+
+                best = int(np.argmin(candidate_losses))
+                if candidate_losses[best] < f_x:
+                    x, f_x = candidates[best], candidate_losses[best]
+                    step = lengths[best]
+                else:
+                    step /= 2 ** self.line_search_probes
+                    delta = max(delta / 2, self.delta / 10)
+
+                sys.stderr.write(f"Gradient descent: loss {f_x}, step {step}\n")
+
+        return self.space.from_unit_search(x), f_x
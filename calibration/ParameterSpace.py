@@ -0,0 +1,326 @@
+"""
+This module provides the parameter declarations read from a params.txt file.
+
+The params.txt file is python code calling `calibrator.add_param(name, sc.parameter.Linear(...))`.
+Loading it through `ParameterSpace.from_file` records the declared bounds and formats, so the
+same file can drive both the Simcal calibrators and the sample designs of the sensitivity analysis.
+
+Besides `Linear`, a params.txt file can declare `sc.parameter.Log(start, end)` for ranges spanning
+several decades and `sc.parameter.Integer(start, end, step)` for quantized values. The optimizers
+search these in a transformed space (log10 of the value, or the unquantized value), and
+`ParameterSpace.decode` maps the values back before they reach `SMPISimulator.compile_platform`.
+Any other Simcal parameter type is passed through untouched.
+"""
+import math
+import re
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+import simcal as sc
+
+_NUMBER = re.compile(r"\s*[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?")
+
+
+def numeric_prefix(value) -> Optional[float]:
+    """
+    Leading number of a rendered parameter value (e.g. 24.56 for "24.56Gf"), None if there is none.
+    """
+    match = _NUMBER.match(str(value))
+    return float(match.group(0)) if match else None
+
+
+class Linear:
+    """
+    Declaration of a parameter sampled uniformly in [start, end].
+    """
+
+    def __init__(self, start: float, end: float):
+        self.start = float(start)
+        self.end = float(end)
+        self.fmt = None
+
+    def format(self, fmt: str):
+        self.fmt = fmt
+        return self
+
+    def from_unit(self, u: float) -> float:
+        """
+        Maps a value of the unit interval onto the declared range.
+        """
+        return self.start + u * (self.end - self.start)
+
+    def render(self, value: float) -> str:
+        """
+        Renders a value the way Simcal would pass it to the simulator.
+        """
+        if self.fmt is None:
+            return str(value)
+        return self.fmt % value
+
+    def decode(self, raw: str) -> str:
+        """
+        Maps a value chosen by the optimizer back onto the rendered parameter value.
+        """
+        try:
+            return self.render(float(raw))
+        except ValueError:
+            # already rendered by Simcal (e.g. "24.56Gf")
+            return raw
+
+    def encode(self, rendered: str) -> float:
+        """
+        Maps a rendered parameter value (e.g. "24.56Gf") back into the optimizer's space.
+        """
+        value = numeric_prefix(rendered)
+        if value is None:
+            raise ValueError(f"Cannot parse a numeric value from '{rendered}'")
+        return value
+
+    def search_bounds(self):
+        """
+        Bounds of the parameter in the optimizer's space.
+        """
+        return self.start, self.end
+
+    def narrow(self, rendered: str, width: float):
+        """
+        Returns a copy of the declaration restricted to a window around a rendered value.
+
+        The window spans `width` of the declared range (in the optimizer's space) and is
+        centred on the value, shifted as needed to stay inside the declared bounds.
+        """
+        low, high = self.search_bounds()
+        center = min(max(self.encode(rendered), low), high)
+        half = width * (high - low) / 2
+        start = min(max(center - half, low), high - 2 * half)
+        return self._with_search_bounds(start, start + 2 * half)
+
+    def _with_search_bounds(self, start: float, end: float):
+        return type(self)(start, end).format(self.fmt)
+
+    def to_simcal(self):
+        param = sc.parameter.Linear(self.start, self.end)
+        if self.fmt is not None:
+            param = param.format(self.fmt)
+        return param
+
+
+class Log(Linear):
+    """
+    Declaration of a parameter sampled uniformly in [log10(start), log10(end)].
+    """
+
+    def __init__(self, start: float, end: float):
+        super().__init__(start, end)
+        if self.start <= 0 or self.end <= 0:
+            raise ValueError(f"Log parameter bounds must be positive: ({start}, {end})")
+
+    def from_unit(self, u: float) -> float:
+        low, high = math.log10(self.start), math.log10(self.end)
+        return 10 ** (low + u * (high - low))
+
+    def decode(self, raw: str) -> str:
+        try:
+            return self.render(10 ** float(raw))
+        except ValueError:
+            # already rendered with a format (e.g. "12.50Gf")
+            return raw
+
+    def encode(self, rendered: str) -> float:
+        return math.log10(super().encode(rendered))
+
+    def search_bounds(self):
+        return math.log10(self.start), math.log10(self.end)
+
+    def _with_search_bounds(self, start: float, end: float):
+        return Log(10 ** start, 10 ** end).format(self.fmt)
+
+    def to_simcal(self):
+        return sc.parameter.Linear(math.log10(self.start), math.log10(self.end))
+
+
+class Integer(Linear):
+    """
+    Declaration of a parameter sampled in [start, end] and rounded to a multiple of step.
+    """
+
+    def __init__(self, start: float, end: float, step: float = 1):
+        super().__init__(start, end)
+        self.step = step
+        self.origin = self.start
+        self.fmt = "%d" if float(step).is_integer() else None
+
+    def quantize(self, value: float) -> float:
+        value = min(max(value, self.start), self.end)
+        return self.origin + round((value - self.origin) / self.step) * self.step
+
+    def from_unit(self, u: float) -> float:
+        return self.quantize(super().from_unit(u))
+
+    def decode(self, raw: str) -> str:
+        try:
+            return self.render(self.quantize(float(raw)))
+        except ValueError:
+            # already rendered with a format (e.g. "64MB")
+            return raw
+
+    def _with_search_bounds(self, start: float, end: float):
+        param = Integer(start, end, self.step).format(self.fmt)
+        param.origin = self.origin
+        return param
+
+    def to_simcal(self):
+        return sc.parameter.Linear(self.start, self.end)
+
+
+class _Declarations:
+    """
+    Stand-in for `sc.parameter` while executing a params.txt file.
+    """
+    Linear = Linear
+    Log = Log
+    Integer = Integer
+
+    def __getattr__(self, name):
+        return getattr(sc.parameter, name)
+
+
+_DECLARATIONS = _Declarations()
+
+
+class ParameterSpace:
+    """
+    Ordered collection of the parameter declarations of a params.txt file.
+    """
+
+    def __init__(self):
+        self.params: Dict[str, object] = {}
+
+    def add_param(self, name: str, param):
+        self.params[name] = param
+        return self
+
+    @classmethod
+    def from_file(cls, param_file: str) -> "ParameterSpace":
+        """
+        Executes a params.txt file and collects the parameters it declares.
+
+        Args:
+            param_file (str): Path to the parameter file.
+
+        Returns:
+            ParameterSpace: The declared parameters, in declaration order.
+        """
+        space = cls()
+        try:
+            with open(param_file, 'r', encoding="utf-8") as file:
+                code = file.read()
+        except FileNotFoundError as exc:
+            raise FileNotFoundError(
+                f"Error: The file '{param_file}' does not exist.") from exc
+
+        namespace = {
+            "sc": SimpleNamespace(parameter=_DECLARATIONS, parameters=_DECLARATIONS),
+            "calibrator": space
+        }
+        exec(compile(code, str(param_file), 'exec'), namespace)
+
+        return space
+
+    @property
+    def names(self) -> List[str]:
+        return list(self.params.keys())
+
+    def __len__(self):
+        return len(self.params)
+
+    def from_unit(self, point) -> Dict[str, str]:
+        """
+        Maps a point of the unit hypercube onto a rendered calibration.
+
+        Args:
+            point: Sequence of values in [0, 1], one per parameter in declaration order.
+
+        Returns:
+            Dict[str, str]: Calibration that can be passed to `SMPISimulator.evaluate`.
+        """
+        calibration = {}
+        for (name, param), u in zip(self.params.items(), point):
+            if not isinstance(param, Linear):
+                raise ValueError(f"Parameter '{name}' cannot be sampled from the unit hypercube")
+            calibration[name] = param.render(param.from_unit(float(u)))
+
+        return calibration
+
+    def from_unit_search(self, point) -> Dict[str, float]:
+        """
+        Maps a point of the unit hypercube onto the search bounds (the optimizer's space, see
+        `decode`), as the calibrators searching the unit hypercube directly return it.
+
+        Args:
+            point: Sequence of values in [0, 1], one per parameter in declaration order, or None
+                   when nothing was evaluated.
+
+        Returns:
+            Dict[str, float]: Calibration in the optimizer's space, empty for None.
+        """
+        calibration = {}
+        if point is None:
+            return calibration
+
+        for (name, param), u in zip(self.params.items(), point):
+            low, high = param.search_bounds()
+            calibration[name] = low + u * (high - low)
+
+        return calibration
+
+    def decode(self, calibration: Dict[str, str]) -> Dict[str, str]:
+        """
+        Maps a calibration chosen by an optimizer onto the values passed to the simulator.
+
+        Args:
+            calibration (Dict[str, str]): Stringified calibration, in the optimizer's space.
+
+        Returns:
+            Dict[str, str]: Calibration with the Log/Integer transforms applied.
+        """
+        return {
+            name: self.params[name].decode(value) if isinstance(self.params.get(name), Linear) else value
+            for name, value in calibration.items()
+        }
+
+    def encode(self, calibration: Dict[str, str]) -> List[float]:
+        """
+        Maps a rendered calibration into the optimizer's space.
+
+        Args:
+            calibration (Dict[str, str]): Calibration as passed to the simulator (e.g. from result.json).
+
+        Returns:
+            List[float]: One value per parameter, in declaration order.
+        """
+        return [param.encode(calibration[name]) for name, param in self.params.items()]
+
+    def narrow(self, calibration: Dict[str, str], width: float) -> "ParameterSpace":
+        """
+        Returns a copy of the space restricted to a window around a rendered calibration.
+
+        Parameters missing from the calibration, or not declared with Linear/Log/Integer,
+        keep their declared range.
+        """
+        space = ParameterSpace()
+        for name, param in self.params.items():
+            if isinstance(param, Linear) and name in calibration:
+                param = param.narrow(calibration[name], width)
+            space.add_param(name, param)
+
+        return space
+
+    def apply(self, calibrator):
+        """
+        Adds every declared parameter to a Simcal calibrator.
+        """
+        for name, param in self.params.items():
+            if isinstance(param, Linear):
+                param = param.to_simcal()
+            calibrator.add_param(name, param)
@@ -0,0 +1,120 @@
+"""
+This module provides the allocation of a fixed budget of simulation repetitions across the
+(benchmark, byte size) points of the ground truth.
+"""
+import math
+from typing import List
+
+import numpy as np
+
+
+class RepetitionAllocator:
+    """
+    Spreads `total` repetitions per evaluation over the simulated points so that the noise of
+    the simulated means disturbs the loss as little as possible.
+
+    The explained variance loss of a point is sqrt((x - mean)^2 + std^2) / std, where mean and
+    std are those of its ground truth, so an error on the simulated mean x moves the loss by at
+    most 1 / std, divided by the number of sizes of its known point and by the number of known
+    points (mean aggregation). With sigma the standard deviation of one simulated repetition,
+    the variance of the loss is minimized for a fixed total by giving each point a number of
+    repetitions proportional to sigma / (std * sizes * points) (Neyman allocation).
+
+    sigma is not known before simulating: it starts as the ground truth mean (every point as
+    noisy, relatively) and is replaced by the standard deviation of the samples observed by the
+    evaluations, so deterministic points fall back to `min_iters` repetitions.
+    """
+
+    def __init__(self, ground_truth, total: int, min_iters: int = 1, max_iters: int = 50, smoothing: float = 0.2):
+        self.known_points = ground_truth[0]
+        self.min_iters = min_iters
+        self.max_iters = max_iters
+        self.smoothing = smoothing
+
+        # (known point, byte index) of every simulated point, in ground truth order
+        self.points = [(count, j) for count, i in enumerate(self.known_points) for j in range(len(i[3]))]
+        self.total = max(total, len(self.points) * min_iters)
+
+        self.gt_mean = np.array([max(float(np.mean(data)), 0.0) for data in ground_truth[1]])
+        gt_std = np.array([float(np.std(data)) for data in ground_truth[1]])
+        # the loss functions use a denominator of 1 when the ground truth has no spread
+        self.gt_std = np.where(gt_std > 0, gt_std, 1.0)
+
+        self.weights = np.array([
+            1.0 / (self.gt_std[k] * len(self.known_points[count][3]) * len(self.known_points))
+            for k, (count, _) in enumerate(self.points)
+        ])
+        self.sigma = self.gt_mean.copy()
+        self.observed = np.zeros(len(self.points), dtype=bool)
+
+        self.iterations = self.allocate()
+
+    def allocate(self) -> List[int]:
+        """
+        Repetitions of every point, in ground truth order, summing to at most `total`.
+        """
+        need = self.weights * self.sigma
+        counts = np.full(len(self.points), float(self.min_iters))
+        room = self.max_iters - self.min_iters
+
+        # every point gets min_iters, the rest of the budget is shared by need with
+        # water-filling: points reaching max_iters give their share back to the others
+        budget = self.total - self.min_iters * len(self.points)
+        free = need > 0
+        while free.any() and budget > 0:
+            share = budget * need[free] / need[free].sum()
+            capped = share >= room
+            if not capped.any():
+                counts[free] += share
+                break
+            indices = np.flatnonzero(free)[capped]
+            counts[indices] = self.max_iters
+            budget -= room * len(indices)
+            free[indices] = False
+
+        # largest remainders get the repetitions lost to rounding
+        rounded = np.floor(counts)
+        left = int(round(min(counts.sum(), self.total) - rounded.sum()))
+        for k in np.argsort(-(counts - rounded))[:max(left, 0)]:
+            rounded[k] += 1
+
+        return [int(c) for c in rounded]
+
+    def update(self, points: List[List[dict]]):
+        """
+        Refines the per-repetition noise with the samples of an evaluation record (`points`)
+        and recomputes the allocation. Not thread-safe, callers hold the simulator lock.
+        """
+        k = 0
+        for known_point in points:
+            for point in known_point:
+                samples = point.get("samples", [])
+                if len(samples) >= 2:
+                    sigma = float(np.std(samples, ddof=1))
+                    if not math.isfinite(sigma):
+                        sigma = self.sigma[k]
+                    if self.observed[k]:
+                        self.sigma[k] += self.smoothing * (sigma - self.sigma[k])
+                    else:
+                        self.sigma[k] = sigma
+                        self.observed[k] = True
+                k += 1
+
+        self.iterations = self.allocate()
+
+    def repetitions(self, count: int) -> List[int]:
+        """
+        Repetitions of the byte sizes of a known point.
+        """
+        start = sum(len(i[3]) for i in self.known_points[:count])
+        return self.iterations[start:start + len(self.known_points[count][3])]
+
+    def summary(self) -> List[list]:
+        """
+        [label, repetitions, estimated per-repetition noise] of every point, for result.json.
+        """
+        return [
+            [f"{self.known_points[count][0]}/{self.known_points[count][1]}/{self.known_points[count][2]}/"
+             f"{self.known_points[count][3][j]}", self.iterations[k], float(self.sigma[k])]
+            for k, (count, j) in enumerate(self.points)
+        ]
@@ -0,0 +1,80 @@
+"""
+This module provides bounded in-memory tracking of the best evaluations of a calibration.
+"""
+import heapq
+import itertools
+from typing import List
+
+
+class ResultTracker:
+    """
+    Keeps the k evaluations with the lowest loss and the set of evaluations that are not
+    dominated on their per-benchmark losses.
+
+    The top-k list is a max-heap on the loss, so each update costs O(log k). The Pareto front
+    is updated incrementally and bounded to `max_front` members, dropping the member with the
+    highest aggregated loss when it overflows.
+    """
+
+    def __init__(self, k: int = 20, labels: List[str] = None, max_front: int = 100):
+        self.k = k
+        self.labels = labels if labels is not None else []
+        self.max_front = max_front
+        self.heap = []
+        self.front = []
+        # tie breaker, so that records are never compared by the heap
+        self.counter = itertools.count()
+
+    @staticmethod
+    def dominates(a: List[float], b: List[float]) -> bool:
+        return all(x <= y for x, y in zip(a, b)) and any(x < y for x, y in zip(a, b))
+
+    def update(self, record: dict):
+        """
+        Records an evaluation record of `SMPISimulator.evaluate`. Not thread-safe, callers hold the simulator lock.
+        """
+        loss = float(record["loss"])
+        entry = (-loss, next(self.counter), record)
+
+        if len(self.heap) < self.k:
+            heapq.heappush(self.heap, entry)
+        elif self.heap and loss < -self.heap[0][0]:
+            heapq.heapreplace(self.heap, entry)
+
+        losses = record["losses"]
+        if any(self.dominates(other["losses"], losses) or other["losses"] == losses for other in self.front):
+            return
+
+        self.front = [other for other in self.front if not self.dominates(losses, other["losses"])]
+        self.front.append(record)
+
+        if len(self.front) > self.max_front:
+            self.front.remove(max(self.front, key=lambda other: float(other["loss"])))
+
+    @staticmethod
+    def interpolated(record: dict) -> bool:
+        """
+        Whether some byte sizes of the record were interpolated instead of simulated (`--interpolate`).
+        """
+        return any(point.get("interpolated", False) for points in record.get("points", []) for point in points)
+
+    def entry(self, record: dict) -> dict:
+        return {
+            "calibration": record["calibration"],
+            "loss": float(record["loss"]),
+            "losses": dict(zip(self.labels, record["losses"])) if self.labels else record["losses"],
+            "result": record["result"],
+            "interpolated": self.interpolated(record)
+        }
+
+    def top_k(self) -> List[dict]:
+        """
+        The tracked evaluations, by increasing loss.
+        """
+        return [self.entry(record) for _, _, record in sorted(self.heap, key=lambda e: (-e[0], e[1]))]
+
+    def pareto_front(self) -> List[dict]:
+        """
+        The non-dominated evaluations, by increasing loss.
+        """
+        return [self.entry(record) for record in sorted(self.front, key=lambda r: float(r["loss"]))]
@@ -0,0 +1,158 @@
+"""
+This module provides the writer of `result.json` and of its evaluation journal.
+"""
+import json
+import math
+import os
+import threading
+from pathlib import Path
+from time import perf_counter
+from typing import Optional
+
+
+class ResultWriter:
+    """
+    Writes the `result.json` summary and appends every evaluation to a JSON-lines journal.
+
+    The journal is truncated when the writer is created, so it only holds the evaluations of
+    the current run. NaN and infinite losses and results are written as null, as JSON has no such numbers.
+
+    The summary keeps the indented layout of the previous encoder (objects one key per line,
+    lists on a single line) but is encoded in a single pass, and every snapshot is written to a
+    temporary file then renamed, so readers never see a partial file. Journal lines are
+    appended with a single write each, so progress costs the same regardless of the run length.
+    While the calibration runs, `results.progress` in the summary is refreshed when the best
+    loss improves, at most once every `snapshot_interval` seconds.
+    """
+
+    def __init__(self, path="result.json", journal_path: Optional[str] = None, snapshot_interval: float = 30.0):
+        self.path = Path(path)
+        self.journal_path = Path(journal_path) if journal_path else None
+        self.snapshot_interval = snapshot_interval
+        self.lock = threading.Lock()
+
+        self.document = {"config": {}, "results": {}}
+        self.evaluations = 0
+        self.best = None
+        self.last_snapshot = None
+
+        self.journal = None
+        if self.journal_path is not None:
+            self.journal = open(self.journal_path, "w", encoding="utf-8")
+
+    @staticmethod
+    def scalar(o):
+        # numpy scalars and arrays
+        if hasattr(o, "tolist"):
+            return o.tolist()
+        return str(o)
+
+    def finite(self, o):
+        """
+        Copy of o where the NaN and infinite floats, which are not valid JSON, are None.
+        """
+        if isinstance(o, float):
+            return o if math.isfinite(o) else None
+        if isinstance(o, dict):
+            return {key: self.finite(value) for key, value in o.items()}
+        if isinstance(o, (list, tuple)):
+            return [self.finite(item) for item in o]
+        if hasattr(o, "tolist"):
+            return self.finite(o.tolist())
+        return o
+
+    def encode(self, o) -> str:
+        """
+        Encodes o with one object key per line, indented by 4 spaces per level, and lists inline.
+        """
+        parts = []
+
+        def encode_value(value, level):
+            if isinstance(value, dict):
+                if len(value) == 0:
+                    parts.append("{}")
+                    return
+                parts.append("{\n")
+                for count, (key, item) in enumerate(value.items()):
+                    if count:
+                        parts.append(",\n")
+                    parts.append("    " * (level + 1) + json.dumps(str(key)) + ": ")
+                    encode_value(item, level + 1)
+                parts.append("\n" + "    " * level + "}")
+            elif isinstance(value, (list, tuple)) and not any(isinstance(item, (dict, list, tuple)) for item in value):
+                # flat lists (e.g. per-point results) are encoded at once
+                parts.append(json.dumps(self.finite(value), default=self.scalar))
+            elif isinstance(value, float) and not math.isfinite(value):
+                parts.append("null")
+            elif isinstance(value, (list, tuple)):
+                parts.append("[")
+                for count, item in enumerate(value):
+                    if count:
+                        parts.append(", ")
+                    encode_value(item, level + 1)
+                parts.append("]")
+            elif value is None or isinstance(value, (bool, int, float, str)):
+                parts.append(json.dumps(value))
+            else:
+                encode_value(self.scalar(value), level)
+
+        encode_value(o, 0)
+
+        return "".join(parts)
+
+    def snapshot(self, document: Optional[dict] = None):
+        """
+        Atomically rewrites the summary, replacing the current document when one is given.
+        """
+        with self.lock:
+            if document is not None:
+                self.document = document
+            content = self.encode(self.document)
+
+            tmp_path = self.path.with_name(f".{self.path.name}.{os.getpid()}.tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(content)
+            os.replace(tmp_path, self.path)
+
+            self.last_snapshot = perf_counter()
+
+    def append(self, record: dict):
+        """
+        Appends an evaluation record of `SMPISimulator.evaluate` to the journal.
+        """
+        entry = {
+            "calibration": record["calibration"],
+            "loss": float(record["loss"]),
+            "losses": record["losses"],
+            "time": record["time"],
+            "result": record["result"]
+        }
+        line = json.dumps(self.finite(entry), default=self.scalar) + "\n"
+
+        with self.lock:
+            if self.journal is not None:
+                self.journal.write(line)
+                self.journal.flush()
+
+            self.evaluations += 1
+            improved = self.best is None or entry["loss"] < self.best["loss"]
+            if improved:
+                self.best = entry
+
+            due = self.last_snapshot is None or perf_counter() - self.last_snapshot >= self.snapshot_interval
+            if not (improved and due):
+                return
+
+            self.document["results"]["progress"] = {
+                "evaluations": self.evaluations,
+                "best_loss": self.best["loss"],
+                "best_calibration": self.best["calibration"]
+            }
+
+        self.snapshot()
+
+    def close(self):
+        with self.lock:
+            if self.journal is not None:
+                self.journal.close()
+                self.journal = None
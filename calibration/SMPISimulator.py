@@ -3,21 +3,29 @@
 import sys
 import ast
 import argparse
-import os
+import contextlib
+import copy
 import json
-import glob
+import math
+import random
 import re
 import shutil
 import threading
+from concurrent.futures import ThreadPoolExecutor
 from time import perf_counter
 from typing import Any
 from pathlib import Path
 
 import simcal as sc
 import numpy as np
-from mpi_groundtruth import MPIGroundTruth
 from Utils import average_explained_variance_error, max_explained_variance_error
 from calibrate_flops import calibrate_hostspeed
+from ConvergenceMonitor import ConvergenceReached
+from ResultTracker import ResultTracker
+from CPUBudget import CPUBudget
+from RepetitionAllocator import RepetitionAllocator
+from SharedGroundTruth import SharedGroundTruth
+from CostReport import CostReport
 
 file_abs_path = Path(__file__).parent.absolute()
 
@@ -35,13 +43,18 @@ class SMPISimulator(sc.Simulator):
     def __init__(
         self, ground_truth, benchmark_parent, hostfile, threshold=0.0, time=0,
         keep_tmp=False, byte_split=None, topology_template="config/fattree-complex.json",
-        simple=False, loss_aggregator="mean", loss_function="average"
+        simple=False, loss_aggregator="mean", loss_function="average", top_k=20,
+        cpu_budget=None, cache=None, hostspeed=None, repetitions=None, interpolate=False,
+        stats=False, launcher=False, check_routes=True
     ):
         super().__init__()
         self.hostfile = hostfile
         self.benchmark_parent = benchmark_parent
         self.threshold = threshold
         self.time = time
+        # worker processes attach to the ground truth published by the main process
+        if isinstance(ground_truth, SharedGroundTruth):
+            ground_truth = ground_truth.ground_truth()
         self.ground_truth = ground_truth
         if byte_split is None:
             byte_split = []
@@ -58,8 +71,8 @@ class SMPISimulator(sc.Simulator):
         else:
             raise ValueError(f"Unknown loss aggregator '{loss_aggregator}'")
         # self.hostspeed = 6103515625
-        self.hostspeed = calibrate_hostspeed()
-        self.smpi_args = []
+        # calibrated (or read from the cache) at the end of the constructor when not given
+        self._hostspeed = hostspeed
         self.best_loss = None
         self.best_result = None
         self.keep_tmp = keep_tmp
@@ -67,15 +80,105 @@ class SMPISimulator(sc.Simulator):
         self.simple = simple  # whether or not to use simple compute node
         self.lock = threading.Lock()
 
+        # StartupCache for the host speed and the generated platforms, None to disable caching
+        self.cache = cache
+
+        # total simulation repetitions per evaluation spread over the points by variance,
+        # None for up to 10 repetitions of every point
+        self.allocator = RepetitionAllocator(ground_truth, repetitions) if repetitions else None
+
+        # CPU slots every simulation and platform compilation must hold
+        self.cpu_budget = cpu_budget if cpu_budget is not None else CPUBudget()
+
+        # memoized evaluation records, keyed by the stringified calibration
+        self.memo = {}
+        self.memo_locks = {}
+
+        # top-k evaluations and Pareto front over the per-benchmark losses
+        self.tracker = ResultTracker(
+            top_k, labels=[f"{i[0]}/{i[1]}/{i[2]}" for i in ground_truth[0]])
+
+        # compiled platforms, keyed by their node and topology values (least recently used first)
+        self.platform_cache = {}
+        self.platform_locks = {}
+        self.platform_cache_size = 8
+
+        # hostfiles generated for the (node count, processes) scales of the ground truth
+        self.scale_hostfiles = {}
+        self.hostfile_env = None
+
+        # EvaluationStore every new evaluation is written to
+        self.store = None
+
+        # ResultWriter every new evaluation is appended to
+        self.journal = None
+
+        # EvaluationBroker running the simulations on worker processes, None to simulate here
+        self.broker = None
+
+        # ConvergenceMonitor fed with every evaluation requested by the calibrators
+        self.monitor = None
+
+        # ParameterSpace used to decode Log/Integer parameters chosen by the calibrators
+        self.param_space = None
+
+        # rendered values of the parameters the calibrators do not search (see segment)
+        self.fixed = {}
+
         # array to store byte split for network/latency-factor and network/bandwidth-factor
         self.byte_split = byte_split
 
-        # Initialize the file to be empty
-        with open("sim_stderr.txt", "w", encoding="utf-8") as sim_stderr:
-            sim_stderr.write("")
-
-        with open("compile_stderr.txt", "w", encoding="utf-8") as compile_stderr:
-            compile_stderr.write("")
+        # whether to simulate a subset of the byte sizes and interpolate the others (see simulated_sizes)
+        self.interpolate = interpolate
+
+        # whether to collect the SimGrid timing of every smpirun run (see CostReport)
+        self.stats = stats
+        self.cost_report = CostReport(ground_truth[0], self.platform_parameter) if stats else None
+
+        # whether wrapper_parallel spawns smpimain directly after the first smpirun of each byte size
+        self.launcher = launcher
+
+        # whether trimmed topologies are compared with the untrimmed ones on sample routes (see routes_match)
+        self.check_routes = check_routes
+        self.route_checks = {}
+
+        # log files are emptied on their first write, so merely constructing a simulator
+        # (e.g. for a dry run) leaves the logs of the previous run alone
+        self.log_lock = threading.Lock()
+        self.started_logs = set()
+
+        # directory of the compile_stderr.txt and sim_stderr.txt logs
+        self.log_dir = Path(".")
+
+        # before any simulation or platform compilation can start
+        if self._hostspeed is None:
+            if self.cache is not None:
+                self._hostspeed = self.cache.host_speed(self.calibrate_hostspeed)
+            else:
+                self._hostspeed = self.calibrate_hostspeed()
+
+    @property
+    def hostspeed(self):
+        """
+        Host speed (flops) given to smpirun.
+        """
+        return self._hostspeed
+
+    def calibrate_hostspeed(self) -> float:
+        """
+        Measures the host speed holding the whole CPU budget, so no simulation or compilation
+        sharing the budget skews the measure.
+        """
+        with self.cpu_budget.slots(self.cpu_budget.total):
+            return calibrate_hostspeed()
+
+    def write_log(self, filename: str, text: str):
+        with self.log_lock:
+            mode = "a" if filename in self.started_logs else "w"
+            self.started_logs.add(filename)
+
+            with open(self.log_dir / filename, mode, encoding="utf-8") as log_file:
+                log_file.write(text)
 
     def need_more_benchs(self, count, iterations, relstderr):
         # setting a minimum iteration of 10
@@ -90,14 +193,13 @@ class SMPISimulator(sc.Simulator):
 
         return res
 
-    def compile_platform(self, env: sc.Environment, calibration: dict[str, sc.parameters.Value]):
-        tmp_dir = env.tmp_dir()
-
-        print(f"Creating temporary directory: {tmp_dir}", file=sys.stderr)
-
-        # copy summit folder into tmpdir
-        shutil.copytree(summit, tmp_dir / "Summit")
+    def sort_calibration(self, calibration: dict[str, str]):
+        """
+        Sorts the calibration arguments into the node config, the topology and the smpi arguments.
 
+        Returns:
+            tuple: (node, topology, smpi_args). Only node and topology require compiling a platform.
+        """
         template_node = summit / "config/node_config.json"
         template_topology = summit / self.topology_template
 
@@ -113,103 +215,155 @@ class SMPISimulator(sc.Simulator):
             node = json.load(node_f)
             topology = json.load(topology_f)
 
-            node_keys = node.keys()
-            topology_keys = topology.keys()
-            latency_split = {}
-            latency_factor = {}
-            bandwidth_split = {}
-            bandwidth_factor = {}
-
-            if self.simple:
-                topology["node_generator_cb"] = "simple_node"
-
-            for key, value in calibration.items():
-                if "/" in key:
-                    pattern = r"network/(latency|bandwidth)-factor(-split)?"
-
-                    match = re.match(pattern, key)
-
-                    if match:
-                        is_split = bool(match.group(2))
-                        index = int(key.split("_")[-1])
-
-                        if is_split:
-                            if match.group(1) == "latency":
-                                latency_split[index] = value
-                            elif match.group(1) == "bandwidth":
-                                bandwidth_split[index] = value
-                        else:
-                            if match.group(1) == "latency":
-                                latency_factor[index] = value
-                            elif match.group(1) == "bandwidth":
-                                bandwidth_factor[index] = value
+        node_keys = node.keys()
+        topology_keys = topology.keys()
+        byte_split = self.byte_split
+        latency_split = {}
+        latency_factor = {}
+        bandwidth_split = {}
+        bandwidth_factor = {}
+
+        if self.simple:
+            topology["node_generator_cb"] = "simple_node"
+
+        for key, value in calibration.items():
+            if not self.platform_parameter(key):
+                pattern = r"network/(latency|bandwidth)-factor(-split)?"
+
+                match = re.match(pattern, key)
+
+                if match:
+                    is_split = bool(match.group(2))
+                    index = int(key.split("_")[-1])
+
+                    if is_split:
+                        if match.group(1) == "latency":
+                            latency_split[index] = value
+                        elif match.group(1) == "bandwidth":
+                            bandwidth_split[index] = value
                     else:
-                        smpi_args.append(f"--cfg={key}:{value}")
-                elif key in node_keys:
-                    node[key] = value
-                elif key in topology_keys:
-                    topology[key] = value
+                        if match.group(1) == "latency":
+                            latency_factor[index] = value
+                        elif match.group(1) == "bandwidth":
+                            bandwidth_factor[index] = value
                 else:
-                    print(
-                        f"Error: Calibration parameter with Key ({key}) is not valid")
-                    exit()
-
-            if len(latency_factor) > 0:
-                if len(latency_split) > 0:
-                    assert len(latency_split) == len(
-                        latency_factor), "Byte split and latency factor must be the same length"
-                    self.byte_split = [latency_split[i]
-                                       for i in sorted(latency_split.keys())]
-                else:
-                    assert len(self.byte_split) == len(
-                        latency_factor), "Byte split and latency factor must be the same length"
-
-                latency_factor = [
-                    f"{self.byte_split[i]}:{latency_factor[i]}" for i in range(len(latency_factor))]
-                latency_factor = ";".join(latency_factor)
-                smpi_args.append(
-                    f"--cfg=network/latency-factor:\"{latency_factor}\"")
-
-            if len(bandwidth_factor) > 0:
-                if len(bandwidth_split) > 0:
-                    assert len(bandwidth_split) == len(
-                        bandwidth_factor), "Byte split and bandwidth factor must be the same length"
-                    self.byte_split = [bandwidth_split[i]
-                                       for i in sorted(bandwidth_split.keys())]
-                else:
-                    assert len(self.byte_split) == len(
-                        bandwidth_factor), "Byte split and bandwidth factor must be the same length"
+                    smpi_args.append(f"--cfg={key}:{value}")
+            elif key in node_keys:
+                node[key] = value
+            elif key in topology_keys:
+                topology[key] = value
+            else:
+                print(
+                    f"Error: Calibration parameter with Key ({key}) is not valid")
+                exit()
+
+        if len(latency_factor) > 0:
+            if len(latency_split) > 0:
+                assert len(latency_split) == len(
+                    latency_factor), "Byte split and latency factor must be the same length"
+                byte_split = [latency_split[i]
+                              for i in sorted(latency_split.keys())]
+            else:
+                assert len(byte_split) == len(
+                    latency_factor), "Byte split and latency factor must be the same length"
+
+            latency_factor = [
+                f"{byte_split[i]}:{latency_factor[i]}" for i in range(len(latency_factor))]
+            latency_factor = ";".join(latency_factor)
+            smpi_args.append(
+                f"--cfg=network/latency-factor:\"{latency_factor}\"")
+
+        if len(bandwidth_factor) > 0:
+            if len(bandwidth_split) > 0:
+                assert len(bandwidth_split) == len(
+                    bandwidth_factor), "Byte split and bandwidth factor must be the same length"
+                byte_split = [bandwidth_split[i]
+                              for i in sorted(bandwidth_split.keys())]
+            else:
+                assert len(byte_split) == len(
+                    bandwidth_factor), "Byte split and bandwidth factor must be the same length"
+
+            bandwidth_factor = [f"{byte_split[i]}:{bandwidth_factor[i]}" for i in range(
+                len(bandwidth_factor))]
+            bandwidth_factor = ";".join(bandwidth_factor)
+            smpi_args.append(
+                f"--cfg=network/bandwidth-factor:\"{bandwidth_factor}\"")
+
+        topology["name"] = "summit_temp"
+
+        return node, topology, smpi_args
+
+    @staticmethod
+    def platform_parameter(key: str) -> bool:
+        """
+        Whether a calibration parameter is a node or topology value, which needs a new platform
+        to be generated, rather than an smpi argument passed to an already built platform.
+        """
+        return "/" not in key
+
+    @staticmethod
+    def xml_platform(topology: dict) -> bool:
+        """
+        Whether the generator can emit the topology as an XML platform instead of compiling it.
+        Star/backbone topologies only create hosts, links and routes; fat trees need the C++ API.
+        """
+        return "Fat-Tree_parameters" not in topology
+
+    @staticmethod
+    def platform_file(tmp_dir: Path) -> Path:
+        """
+        The platform built in tmp_dir: the XML description if one was generated, else the compiled library.
+        """
+        xml_file = tmp_dir / "summit_temp.xml"
+        return xml_file if xml_file.exists() else tmp_dir / "summit_temp.so"
+
+    def build_platform(self, env: sc.Environment, node: dict, topology: dict):
+        # the simulators sharing a cache (see run_smpi_campaign.py) build each platform once
+        lock = self.cache.platform_lock(node, topology) if self.cache is not None else contextlib.nullcontext()
+        with lock:
+            return self.generate_platform(env, node, topology)
+
+    def generate_platform(self, env: sc.Environment, node: dict, topology: dict):
+        tmp_dir = env.tmp_dir()
+        xml = self.xml_platform(topology)
 
-                bandwidth_factor = [f"{self.byte_split[i]}:{bandwidth_factor[i]}" for i in range(
-                    len(bandwidth_factor))]
-                bandwidth_factor = ";".join(bandwidth_factor)
-                smpi_args.append(
-                    f"--cfg=network/bandwidth-factor:\"{bandwidth_factor}\"")
+        print(f"Creating temporary directory: {tmp_dir}", file=sys.stderr)
+
+        # platforms generated by a previous run for the same node and topology values
+        if self.cache is not None and self.cache.load_platform(node, topology, tmp_dir) is not None:
+            return tmp_dir
 
-            # writing out the new node_config parameters
-            with open(tmp_dir / "node_config.json", "w", encoding="utf-8") as node_config_f:
-                json.dump(node, node_config_f, indent=4)
+        # the compiled platform builds the summit sources in place, copy them into tmpdir
+        if not xml:
+            shutil.copytree(summit, tmp_dir / "Summit")
 
-            # writing out the new topology parameters
-            topology["name"] = "summit_temp"
-            with open(tmp_dir / "topology.json", "w", encoding="utf-8") as topology_f:
-                json.dump(topology, topology_f, indent=4)
+        # writing out the new node_config parameters
+        with open(tmp_dir / "node_config.json", "w", encoding="utf-8") as node_config_f:
+            json.dump(node, node_config_f, indent=4)
 
-            self.smpi_args = smpi_args
+        # writing out the new topology parameters
+        with open(tmp_dir / "topology.json", "w", encoding="utf-8") as topology_f:
+            json.dump(topology, topology_f, indent=4)
 
         # Calling the summit platform generator
         platform_args = (
-            [tmp_dir / "Summit/summit_generator.py"]
+            [summit / "summit_generator.py" if xml else tmp_dir / "Summit/summit_generator.py"]
             + [tmp_dir / "node_config.json"]
             + [tmp_dir / "topology.json"]
+            + (["--xml"] if xml else [])
         )
 
-        _, std_err, exit_code = env.bash("python3", platform_args)
+        with self.cpu_budget.slots(1):
+            build_start = perf_counter()
+            _, std_err, exit_code = env.bash("python3", platform_args)
+            build_time = perf_counter() - build_start
+
+        if self.cost_report is not None:
+            with self.lock:
+                self.cost_report.add_build(node, topology, build_time)
 
-        with open("compile_stderr.txt", "a", encoding="utf-8") as compile_stderr:
-            compile_stderr.write(f"Std_err: {std_err}\n")
-            compile_stderr.write(f"Exit Code: {exit_code}\n")
-            compile_stderr.write("----------------\n")
+        self.write_log("compile_stderr.txt",
+                       f"Std_err: {std_err}\nExit Code: {exit_code}\n----------------\n")
 
         if exit_code:
             sys.stderr.write(
@@ -218,8 +372,289 @@ class SMPISimulator(sc.Simulator):
             )
             exit(1)
 
+        if self.cache is not None:
+            self.cache.store_platform(node, topology, self.platform_file(tmp_dir))
+
         return tmp_dir
 
+    def compile_platform(self, env: sc.Environment, calibration: dict[str, sc.parameters.Value]):
+        node, topology, smpi_args = self.sort_calibration(calibration)
+
+        return self.build_platform(env, node, topology), smpi_args
+
+    def acquire_platform(self, calibration: dict[str, str], nb_nodes: int = None):
+        """
+        Returns a compiled platform for the calibration, reusing a cached build when another
+        calibration with the same node and topology values was already compiled.
+
+        Args:
+            calibration (dict[str, str]): The calibration.
+            nb_nodes (int): Number of nodes the topology must provide, if known.
+
+        Returns:
+            tuple: (key, tmp_dir, smpi_args). The platform must be handed back with `release_platform(key)`.
+        """
+        node, topology, smpi_args = self.sort_calibration(calibration)
+        if nb_nodes is not None:
+            untrimmed = self.size_topology(topology, nb_nodes, trim=False)
+            topology = self.size_topology(topology, nb_nodes)
+            if self.check_routes and topology != untrimmed and not self.routes_match(node, untrimmed, topology, nb_nodes):
+                topology = untrimmed
+        key = json.dumps([node, topology], sort_keys=True)
+
+        with self.lock:
+            key_lock = self.platform_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            # the entry is looked up and claimed at once, so release_platform cannot evict it in between
+            entry = self.use_platform(key)
+            if entry is None:
+                env = sc.Environment()
+                built = {"env": env, "tmp_dir": self.build_platform(env, node, topology), "users": 0}
+
+                with self.lock:
+                    # a key lock pruned by an eviction may have let another thread build it too
+                    entry = self.platform_cache.setdefault(key, built)
+                    entry["users"] += 1
+                if entry is not built and not self.keep_tmp:
+                    env.cleanup()
+
+        return key, entry["tmp_dir"], smpi_args
+
+    def use_platform(self, key: str):
+        """
+        Claims the cached platform of a key, None if it is not cached.
+        """
+        with self.lock:
+            entry = self.platform_cache.pop(key, None)
+            if entry is not None:
+                # re-inserting moves the entry to the most recently used position
+                self.platform_cache[key] = entry
+                entry["users"] += 1
+            return entry
+
+    def release_platform(self, key: str):
+        with self.lock:
+            self.platform_cache[key]["users"] -= 1
+
+            # evict the least recently used platforms that are not in use
+            for old_key in list(self.platform_cache.keys()):
+                if len(self.platform_cache) <= self.platform_cache_size:
+                    break
+                if self.platform_cache[old_key]["users"] == 0:
+                    entry = self.platform_cache.pop(old_key)
+                    self.platform_locks.pop(old_key, None)
+                    if not self.keep_tmp:
+                        entry["env"].cleanup()
+
+    def hostfile_for(self, node_count: int, processes: int):
+        """
+        Returns the hostfile for a scale of the ground truth.
+
+        Every (node count, processes) scale gets its own hostfile, with the first `node_count`
+        hosts of the user hostfile (then node-<n>-cpu-0 when it lists fewer) and
+        ceil(processes / node_count) slots per host, so the ranks are spread over the nodes of
+        the scale as in the benchmark.
+        """
+        with self.lock:
+            if (node_count, processes) in self.scale_hostfiles:
+                return self.scale_hostfiles[(node_count, processes)]
+
+            with open(self.hostfile, "r", encoding="utf-8") as f:
+                # the slots of the user hostfile are replaced, a host listed twice is one node
+                hosts = list(dict.fromkeys(line.strip().split(":")[0] for line in f if line.strip()))
+
+            listed = len(hosts)
+            hosts = hosts[:node_count] + [f"node-{n}-cpu-0" for n in range(listed, node_count)]
+            slots = max(1, math.ceil(processes / node_count))
+
+            if self.hostfile_env is None:
+                self.hostfile_env = sc.Environment()
+
+            hostfile = self.hostfile_env.tmp_dir() / f"hostfile_{node_count}_{processes}.txt"
+            with open(hostfile, "w", encoding="utf-8") as f:
+                f.write("\n".join(f"{host}:{slots}" for host in hosts))
+
+            if listed < node_count:
+                sys.stderr.write(
+                    f"Hostfile {self.hostfile} lists {listed} hosts, "
+                    f"added node-{listed}-cpu-0 to node-{node_count - 1}-cpu-0 for {node_count} nodes\n")
+
+            self.scale_hostfiles[(node_count, processes)] = hostfile
+
+        return hostfile
+
+    @staticmethod
+    def hostfile_nodes(hostfile) -> int:
+        """
+        Number of nodes a platform must provide to host every node-<n> entry of a hostfile.
+        """
+        with open(hostfile, "r", encoding="utf-8") as f:
+            ids = [int(m.group(1)) for m in re.finditer(r"node-(\d+)", f.read())]
+
+        return max(ids) + 1 if ids else 0
+
+    @staticmethod
+    def fat_tree_counts(topology: dict) -> list[int]:
+        """
+        Number of children of the switches of each level of a fat tree, from the leaves up.
+        """
+        # the generator passes up_links as SimGrid's per-level down link counts
+        return [int(c) for c in topology["Fat-Tree_parameters"]["up_links"].strip("{} ").split(",")]
+
+    @staticmethod
+    def size_topology(topology: dict, nb_nodes: int, trim: bool = True) -> dict:
+        """
+        Sizes the topology to the nb_nodes nodes a hostfile needs.
+
+        Star/backbone topologies get nb_nodes nodes. Fat trees keep their lower levels and get
+        just enough top-level switch children; nodes are numbered from the lowest level up, so
+        the nodes below nb_nodes keep their switches and routes. The leaves from nb_nodes on are
+        kept for the numbering but recorded as `used_nodes`, and the generator gives them an
+        empty placeholder zone instead of a full node.
+
+        With trim=False the topology is only grown, never reduced.
+        """
+        topology = json.loads(json.dumps(topology))
+        trim = trim and nb_nodes > 0
+
+        for star in (topology, topology.get("Star-Zone_parameters", {})):
+            if "nb_nodes" in star and (trim or star["nb_nodes"] < nb_nodes):
+                star["nb_nodes"] = max(nb_nodes, 1)
+        if "Fat-Tree_parameters" in topology:
+            params = topology["Fat-Tree_parameters"]
+            counts = SMPISimulator.fat_tree_counts(topology)
+            lower = math.prod(counts[:-1])
+            top = max(1, math.ceil(nb_nodes / lower))
+            if trim or top > counts[-1]:
+                counts[-1] = top
+                params["up_links"] = "{" + ", ".join(str(c) for c in counts) + "}"
+            if trim and nb_nodes < math.prod(counts):
+                params["used_nodes"] = nb_nodes
+
+        return topology
+
+    @staticmethod
+    def route_pairs(topology: dict, nb_nodes: int) -> list[tuple[str, str]]:
+        """
+        Pairs of hosts whose routes are compared by `routes_match`: the first and last nodes, the
+        nodes on both sides of every switch boundary of a fat tree and a few random nodes, in
+        both directions, plus the two CPUs of the first node.
+        """
+        ids = {0, nb_nodes - 1}
+        if "Fat-Tree_parameters" in topology:
+            group = 1
+            for count in SMPISimulator.fat_tree_counts(topology)[:-1]:
+                group *= count
+                ids.update(i for i in (group - 1, group) if i < nb_nodes)
+        rng = random.Random(0)
+        ids.update(rng.randrange(nb_nodes) for _ in range(min(8, nb_nodes)))
+
+        pairs = [(f"node-{a}-cpu-0", f"node-{b}-cpu-0") for a in sorted(ids) for b in sorted(ids) if a != b]
+        if topology.get("node_generator_cb") != "simple_node":
+            pairs.append(("node-0-cpu-0", "node-0-cpu-1"))
+
+        return pairs
+
+    def platform_routes(self, node: dict, topology: dict, pairs_file: Path):
+        """
+        Builds the platform in a scratch environment and returns the routes `route_dump`
+        reports for the pairs of pairs_file, None if they could not be obtained.
+        """
+        env = sc.Environment()
+        try:
+            tmp_dir = self.build_platform(env, node, topology)
+            std_out, std_err, exit_code = env.bash(
+                str(MPI_EXEC / "route_dump"), [self.platform_file(tmp_dir), pairs_file])
+            if exit_code:
+                sys.stderr.write(f"route_dump failed with exit code {exit_code}:\n{std_err}\n")
+                return None
+            return [json.loads(line) for line in std_out.splitlines() if line.startswith("{")]
+        finally:
+            if not self.keep_tmp:
+                env.cleanup()
+
+    def routes_match(self, node: dict, full: dict, trimmed: dict, nb_nodes: int) -> bool:
+        """
+        Whether the trimmed topology gives the hosts of the hostfile the same routes (link
+        bandwidths, latencies and sharing policies, in order) as the full one.
+
+        Both platforms are built once per topology structure and node count: the link values
+        being calibrated do not change the routes. The outcome is kept in the `StartupCache`,
+        so later runs on the same structure skip the check.
+        """
+        structure = []
+        for topology in (full, trimmed):
+            star = dict(topology, **topology.get("Star-Zone_parameters", {}))
+            structure.append({name: star.get(name) for name in (
+                "name", "nb_nodes", "node_generator_cb", "limiter_cb", "Fat-Tree_parameters")})
+        key = "routes:" + json.dumps([structure, nb_nodes], sort_keys=True)
+
+        with self.lock:
+            key_lock = self.platform_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            with self.lock:
+                if key in self.route_checks:
+                    return self.route_checks[key]
+
+            match = self.cache.route_check(key) if self.cache is not None else None
+            if match is not None:
+                with self.lock:
+                    self.route_checks[key] = match
+                return match
+
+            pairs = self.route_pairs(trimmed, nb_nodes)
+            env = sc.Environment()
+            try:
+                pairs_file = env.tmp_dir() / "route_pairs.txt"
+                with open(pairs_file, "w", encoding="utf-8") as f:
+                    f.write("\n".join(f"{src} {dst}" for src, dst in pairs) + "\n")
+
+                full_routes = self.platform_routes(node, full, pairs_file)
+                trimmed_routes = self.platform_routes(node, trimmed, pairs_file)
+            finally:
+                env.cleanup()
+
+            if any(routes is None or len(routes) != len(pairs) for routes in (full_routes, trimmed_routes)):
+                sys.stderr.write("Could not compare the routes of the trimmed platform, using the full one\n")
+                match = False
+            else:
+                mismatches = [(a, b) for a, b in zip(full_routes, trimmed_routes)
+                              if "error" in a or "error" in b or a["links"] != b["links"]
+                              or not math.isclose(a["latency"], b["latency"], rel_tol=1e-9)]
+                match = not mismatches
+                if mismatches:
+                    a, b = mismatches[0]
+                    sys.stderr.write(
+                        f"{len(mismatches)}/{len(pairs)} routes of the trimmed platform differ, using the full one "
+                        f"(e.g. {a['src']} -> {a['dst']}: {a} instead of {b})\n")
+                else:
+                    sys.stderr.write(f"Trimmed platform: {len(pairs)} routes match the full one\n")
+                # a failure to obtain the routes may not last, only a comparison is kept for later runs
+                if self.cache is not None:
+                    self.cache.store_route_check(key, match)
+
+            with self.lock:
+                self.route_checks[key] = match
+
+        return match
+
+    def cleanup(self):
+        """
+        Removes every cached platform and generated hostfile.
+        """
+        with self.lock:
+            for entry in self.platform_cache.values():
+                if not self.keep_tmp:
+                    entry["env"].cleanup()
+            self.platform_cache.clear()
+
+            if self.hostfile_env is not None:
+                self.hostfile_env.cleanup()
+                self.hostfile_env = None
+            self.scale_hostfiles.clear()
+
     def split_list(self, lst, num_parts):
         avg = len(lst) // num_parts
         remainder = len(lst) % num_parts
@@ -233,13 +668,23 @@ class SMPISimulator(sc.Simulator):
 
         return result
 
-    def run_single_simulation(self, tmp_dir, benchmark, iterations, byte_size, thresholds=None):
+    def run_single_simulation(self, env, tmp_dir, smpi_args, benchmark, iterations, byte_size, thresholds=None,
+                              hostfile=None, run_dir=None):
         executable = MPI_EXEC / self.benchmark_parent
 
+        if hostfile is None:
+            hostfile = self.hostfile
+        # the wrapper runs in run_dir, relative paths would not resolve there
+        hostfile = Path(hostfile).resolve()
+
+        # the wrapper writes its p2p_*.log and launch_* files into its working directory
+        if run_dir is None:
+            run_dir = env.tmp_dir()
+
         if thresholds is None:
             thresholds = []
 
-        platform_file = tmp_dir / "summit_temp.so"
+        platform_file = self.platform_file(tmp_dir)
 
         if not platform_file.exists():
             sys.stderr.write("Platform file does not exist!\n")
@@ -252,28 +697,42 @@ class SMPISimulator(sc.Simulator):
             benchmark = "Stencil3D"
 
         cmd_args = [
+            "--jsonl",
+            *(["--stats"] if self.stats else []),
+            *(["--launcher"] if self.launcher else []),
             platform_file,
-            self.hostfile,
+            hostfile,
             str(executable),
             benchmark,
             ','.join(thresholds),
-            iterations,
+            # a single maximum for every byte size, or one per byte size
+            ','.join(map(str, iterations)) if isinstance(iterations, (list, tuple)) else iterations,
             ','.join(map(str, byte_size)),
             "--log=root.threshold:error",
             f"--cfg=smpi/host-speed:{self.hostspeed}f",
             "--cfg=smpi/coll-selector:\"ompi\"",
-            *self.smpi_args
+            *smpi_args
         ]
 
-        error_file = open("sim_stderr.txt", "a", encoding="utf-8")
-        print_cmd_args = [str(i) for i in cmd_args]
-        error_file.write(
-            f"Command: wrapper_parallel {' '.join(print_cmd_args)}\n")
-        error_file.flush()
+        # the wrapper runs one smpirun per byte size, OMP_THREAD_LIMIT keeps it within its slots
+        with self.cpu_budget.slots(len(byte_size)) as (slots, cores):
+            launcher = [f"OMP_THREAD_LIMIT={slots}"]
+            if cores is not None:
+                launcher += ["taskset", "-c", ",".join(map(str, cores))]
 
-        std_out, std_err, exit_code = sc.bash(
-            "wrapper_parallel", cmd_args, std_in=None
-        )
+            # concurrent simulations each run inside their own run_dir
+            std_out, std_err, exit_code = env.bash(
+                "env", [f"--chdir={run_dir}"] + launcher + ["wrapper_parallel"] + cmd_args)
+
+        for log in list(run_dir.glob("p2p_*.log")) + list(run_dir.glob("p2p_*.err")):
+            try:
+                log.unlink()
+            except OSError as e:
+                print(f"Error: {log} : {e.strerror}")
+
+        print_cmd_args = [str(i) for i in cmd_args]
+        self.write_log("sim_stderr.txt",
+                       f"Command: wrapper_parallel {' '.join(print_cmd_args)}\nStd_err: \n{std_err}\n")
 
         if exit_code:
             sys.stderr.write(
@@ -281,72 +740,136 @@ class SMPISimulator(sc.Simulator):
             )
             exit(1)
 
-        print(f"Std_err: \n{std_err}", file=error_file)
+        return self.parse_wrapper_output(std_out)
 
-        final_results = [float(x)
-                         for x in std_out.strip().split(" ") if x != ""]
+    @staticmethod
+    def parse_wrapper_output(std_out: str) -> list[dict]:
+        """
+        Parses the per byte size statistics printed by `wrapper_parallel --jsonl`.
 
-        return final_results
+        Returns:
+            list[dict]: By byte size, the full-precision mean (MB/s), the iteration count, the
+                        relative standard error, the per-iteration samples and whether every
+                        sample was identical (deterministic simulation).
+        """
+        points = []
+        for line in std_out.splitlines():
+            line = line.strip()
+            if not line.startswith("{"):
+                continue
 
-    def run(
-        self, env: sc.Environment, calibration: dict[str, sc.parameters.Value]
-    ) -> Any:
-        calibration = {k: str(v) for k, v in calibration.items()}
-        res = []
-        my_env = sc.Environment()
+            point = json.loads(line)
+            point["mean"] = float(point["mean"]) if point["mean"] is not None else math.nan
+            point["deterministic"] = len(point["samples"]) > 1 and len(set(point["samples"])) == 1
+            points.append(point)
 
-        start_time = perf_counter()
-        tmp_dir = self.compile_platform(my_env, calibration)
+        return sorted(points, key=lambda point: point["index"])
 
-        count = 0
+    def get_thresholds(self, count, byte_len):
+        # Look at the standard deviation of the ground truth data to determine threshold
+        thresholds = []
+        for byte_index in range(byte_len):
+            data = self.ground_truth[1][count * byte_len + byte_index]
+            std = np.std(data)
+            mean = np.mean(data)
 
-        losses = []
+            threshold = round(std / mean, 2)
 
-        split_arr = self.split_list(
-            self.ground_truth[1], len(self.ground_truth[0]))
+            if mean == 0 or threshold < 0.05:
+                threshold = 0.05
 
-        for i in self.ground_truth[0]:
-            # i[0] is the benchmark name
-            # i[1] is the number of nodes
-            # i[2] is the byte size
-            # i[3] is the data
+            thresholds.append(str(threshold))
 
-            # Look at the standard deviation of the ground truth data to determine threshold
-            thresholds = []
-            byte_len = len(i[3])
-            for byte_index in range(byte_len):
-                data = self.ground_truth[1][count * byte_len + byte_index]
-                std = np.std(data)
-                mean = np.mean(data)
+        return thresholds
 
-                threshold = round(std / mean, 2)
+    def evaluate(self, calibration: dict[str, Any]) -> dict:
+        """
+        Runs every known point for a calibration and returns the evaluation record.
 
-                if mean == 0 or threshold < 0.05:
-                    threshold = 0.05
+        Records are memoized on the stringified calibration, so evaluating the same
+        calibration twice (e.g. from a sensitivity design) only simulates it once.
 
-                threshold = str(threshold)
+        Returns:
+            dict: calibration, flat per-point result, per-known-point losses,
+                  aggregated loss, wall time of the evaluation and the per byte size
+                  statistics of the wrapper (`points`).
+        """
+        calibration = {k: str(v) for k, v in calibration.items()}
+        # interpolated and full-fidelity evaluations of a calibration are memoized separately
+        key = (self.interpolate, tuple(sorted(calibration.items())))
+
+        with self.lock:
+            if key in self.memo:
+                return self.memo[key]
+            key_lock = self.memo_locks.setdefault(key, threading.Lock())
+
+        # concurrent requests for the same calibration wait for a single simulation
+        with key_lock:
+            with self.lock:
+                if key in self.memo:
+                    return self.memo[key]
+
+            if self.broker is not None:
+                iterations = self.allocator.iterations if self.allocator is not None else None
+                record = self.broker.evaluate(calibration, self.interpolate, iterations)
+            else:
+                record = self.simulate(calibration)
+
+            with self.lock:
+                self.memo[key] = record
+                self.memo_locks.pop(key, None)
+                self.tracker.update(record)
+                if self.allocator is not None:
+                    self.allocator.update(record["points"])
+                if self.cost_report is not None:
+                    self.cost_report.update(record)
+                if self.best_loss is None or record["loss"] < self.best_loss:
+                    self.best_loss = record["loss"]
+                    self.best_result = record["result"]
+
+        if self.store is not None:
+            self.store.add(record, self.ground_truth[0])
+
+        if self.journal is not None:
+            self.journal.append(record)
+
+        return record
+
+    def simulate(self, calibration: dict[str, str]) -> dict:
+        """
+        Simulates every known point for a calibration, without memoization.
+
+        Known points are grouped by scale (node count, processes); every scale runs on its own
+        hostfile and sized platform, and the scales are simulated concurrently.
+        """
+        start_time = perf_counter()
 
-                thresholds.append(threshold)
-            # print(thresholds)
+        scales = {}
+        for count, i in enumerate(self.ground_truth[0]):
+            # i[0] is the benchmark name
+            # i[1] is the number of nodes
+            # i[2] is the number of processes
+            # i[3] is the byte sizes
+            scales.setdefault((i[1], i[2]), []).append(count)
 
-            temp = self.run_single_simulation(
-                tmp_dir, i[0], 10, i[3], thresholds)
-            res.extend(temp)
+        results = {}
+        with ThreadPoolExecutor(max_workers=len(scales)) as pool:
+            for scale_results in pool.map(
+                    lambda item: self.simulate_scale(calibration, item[0], item[1]), scales.items()):
+                results.update(scale_results)
 
-            files = glob.glob('p2p_*.log')
+        split_arr = self.split_list(
+            self.ground_truth[1], len(self.ground_truth[0]))
 
-            # Loop through and remove each file
-            for file in files:
-                try:
-                    os.remove(file)
-                except OSError as e:
-                    print(f"Error: {file} : {e.strerror}")
+        res = []
+        losses = []
+        for count in range(len(self.ground_truth[0])):
+            means = [point["mean"] for point in results[count]]
+            res.extend(means)
 
-            loss = self.loss_function(temp, split_arr[count])
-            losses.append(loss)
+            loss = self.loss_function(means, split_arr[count])
+            losses.append(float(loss))
 
-            count += 1
-            # print(f"Result for {i[0]}: {temp}")
         time_taken = perf_counter() - start_time
 
         loss_val = self.loss_aggregator(losses)
@@ -357,14 +880,209 @@ class SMPISimulator(sc.Simulator):
         print(f"Result: {log_output}", file=sys.stderr)
         print("----------------", file=sys.stderr)
 
-        if not self.keep_tmp:
-            my_env.cleanup()
+        return dict(log_output, losses=losses, points=[results[count] for count in range(len(self.ground_truth[0]))])
+
+    def simulate_scale(self, calibration: dict[str, str], scale: tuple, counts: list) -> dict:
+        """
+        Simulates the known points of one (node count, processes) scale.
+
+        Returns:
+            dict: The per byte size statistics of `parse_wrapper_output`, keyed by the index of the known point.
+        """
+        hostfile = self.hostfile_for(*scale)
+        my_env = sc.Environment()
+        # working directory of the wrapper, private to this scale of this evaluation
+        run_dir = my_env.tmp_dir()
+        platform_key, tmp_dir, smpi_args = self.acquire_platform(
+            calibration, self.hostfile_nodes(hostfile))
+
+        # byte sizes where the network factors change, from --split or from the calibration
+        splits = list(self.byte_split) + [
+            float(value) for key, value in calibration.items() if re.match(r"network/.*-factor-split", key)]
 
+        results = {}
+        try:
+            for count in counts:
+                i = self.ground_truth[0][count]
+                thresholds = self.get_thresholds(count, len(i[3]))
+
+                iterations = 10
+                if self.allocator is not None:
+                    with self.lock:
+                        iterations = self.allocator.repetitions(count)
+
+                keep = self.simulated_sizes(i[3], splits)
+                if isinstance(iterations, list):
+                    iterations = [iterations[j] for j in keep]
+
+                points = self.run_single_simulation(
+                    my_env, tmp_dir, smpi_args, i[0], iterations, [i[3][j] for j in keep],
+                    [thresholds[j] for j in keep], hostfile=hostfile, run_dir=run_dir)
+                for point in points:
+                    if "stats" in point:
+                        point["stats"]["actors"] = i[2]
+                results[count] = self.interpolate_points(i[3], keep, points)
+        finally:
+            self.release_platform(platform_key)
+
+            if not self.keep_tmp:
+                my_env.cleanup()
+
+        return results
+
+    def simulated_sizes(self, byte_sizes: list, splits: list) -> list[int]:
+        """
+        Indices of the byte sizes to simulate: all of them, or in interpolation mode the
+        endpoints, every other size and the sizes on both sides of each split.
+        """
+        if not self.interpolate or len(byte_sizes) <= 3:
+            return list(range(len(byte_sizes)))
+
+        keep = {0, len(byte_sizes) - 1}
+        keep.update(range(0, len(byte_sizes), 2))
+        for split in splits:
+            # SimGrid switches to the factor of a split for the sizes strictly above it
+            above = [j for j, size in enumerate(byte_sizes) if size > split]
+            if above and 0 < above[0]:
+                keep.update((above[0] - 1, above[0]))
+
+        return sorted(keep)
+
+    @staticmethod
+    def interpolate_points(byte_sizes: list, keep: list[int], points: list[dict]) -> list[dict]:
+        """
+        Completes the statistics of the simulated sizes with the other sizes, interpolated
+        piecewise linearly in log-log space (linearly when a mean is not positive).
+        """
+        if len(keep) == len(byte_sizes):
+            return points
+
+        simulated = {}
+        for j, point in zip(keep, points):
+            simulated[j] = dict(point, index=j, interpolated=False)
+
+        completed = []
+        for j, size in enumerate(byte_sizes):
+            if j in simulated:
+                completed.append(simulated[j])
+                continue
+
+            low = max(k for k in keep if k < j)
+            high = min(k for k in keep if k > j)
+            x0, x1, x = math.log(byte_sizes[low]), math.log(byte_sizes[high]), math.log(size)
+            y0, y1 = simulated[low]["mean"], simulated[high]["mean"]
+            t = (x - x0) / (x1 - x0)
+
+            if y0 > 0 and y1 > 0:
+                mean = math.exp(math.log(y0) + t * (math.log(y1) - math.log(y0)))
+            else:
+                mean = y0 + t * (y1 - y0)
+
+            completed.append({"index": j, "bytes": size, "mean": mean, "count": 0, "relstderr": None,
+                              "samples": [], "deterministic": False, "interpolated": True})
+
+        return completed
+
+    def finalize(self, k: int = 5, num_threads: int = 1) -> list[dict]:
+        """
+        Evaluates the k best calibrations found in interpolation mode at full fidelity.
+
+        The top-k and Pareto front are then rebuilt from these records only, so they never
+        compare interpolated losses with full-fidelity ones.
+
+        Returns:
+            list[dict]: The full-fidelity evaluation records, by increasing loss.
+        """
+        candidates = [entry["calibration"] for entry in self.tracker.top_k()[:k]]
+        self.interpolate = False
+
+        with ThreadPoolExecutor(max_workers=max(1, num_threads)) as pool:
+            records = list(pool.map(self.evaluate, candidates))
+
+        tracker = ResultTracker(self.tracker.k, labels=self.tracker.labels, max_front=self.tracker.max_front)
+        for record in records:
+            tracker.update(record)
         with self.lock:
-            if self.best_loss is None or loss_val < self.best_loss:
-                self.best_loss = loss_val
-                self.best_result = res
-        return loss_val
+            self.tracker = tracker
+
+        return sorted(records, key=lambda record: float(record["loss"]))
+
+    def segment(self, low: float, high: float, fixed: dict[str, str]) -> "SMPISimulator":
+        """
+        Simulator restricted to the ground truth byte sizes in (low, high], e.g. the range of a
+        `--split` segment whose `network/*-factor_i` values only affect these sizes (SimGrid uses
+        the factor of a split for the sizes above it, up to the next split included).
+
+        The segment shares the platforms, hostfiles, CPU budget and host speed of this simulator,
+        but memoizes and tracks its own evaluations, and is not written to the store or journal.
+
+        Args:
+            low (float): Byte size the segment starts above.
+            high (float): Largest byte size of the segment.
+            fixed (dict[str, str]): Rendered values of the parameters not searched by the segment.
+
+        Returns:
+            SMPISimulator: The segment simulator, None if no ground truth size falls in the range.
+        """
+        known_points, data = [], []
+        offset = 0
+        for point in self.ground_truth[0]:
+            indices = [j for j, byte_size in enumerate(point[3]) if low < byte_size <= high]
+            if indices:
+                known_points.append((*point[:3], [point[3][j] for j in indices]))
+                data.extend(self.ground_truth[1][offset + j] for j in indices)
+            offset += len(point[3])
+
+        if len(known_points) == 0:
+            return None
+
+        segment = copy.copy(self)
+        segment.ground_truth = (known_points, data)
+        segment.fixed = dict(fixed)
+        segment.memo = {}
+        segment.memo_locks = {}
+        segment.tracker = ResultTracker(self.tracker.k, labels=[f"{i[0]}/{i[1]}/{i[2]}" for i in known_points])
+        segment.allocator = None
+        segment.best_loss = None
+        segment.best_result = None
+        segment.store = None
+        segment.journal = None
+        segment.monitor = None
+        segment.param_space = None
+        # the workers of a broker simulate the whole ground truth
+        segment.broker = None
+        segment.cost_report = None
+
+        return segment
+
+    def run(
+        self, env: sc.Environment, calibration: dict[str, sc.parameters.Value]
+    ) -> Any:
+        calibration = {k: str(v) for k, v in calibration.items()}
+        if self.param_space is not None:
+            calibration = self.param_space.decode(calibration)
+        calibration = dict(self.fixed, **calibration)
+
+        if self.monitor is not None and self.monitor.stop_reason is not None:
+            raise ConvergenceReached(self.monitor.stop_reason)
+
+        try:
+            record = self.evaluate(calibration)
+        except TimeoutError as error:
+            # the broker reached the time limit before a worker took the evaluation: stop like
+            # the time limit would, unless nothing was evaluated at all
+            with self.lock:
+                if self.monitor is None or self.monitor.best_calibration is None:
+                    raise
+                if self.monitor.stop_reason is None:
+                    self.monitor.stop_reason = f"time limit ({error})"
+            raise ConvergenceReached(self.monitor.stop_reason) from error
+
+        if self.monitor is not None:
+            with self.lock:
+                self.monitor.update(record["calibration"], record["loss"])
+
+        return record["loss"]
 
 
 if __name__ == "__main__":
@@ -424,6 +1142,8 @@ if __name__ == "__main__":
 
     ground_truth_file = Path(args.ground_truth_file).resolve()
 
+    from mpi_groundtruth import MPIGroundTruth
+
     summit_ground_truth = MPIGroundTruth(ground_truth_file)
     summit_ground_truth.set_benchmark_parent("P2P")
     ground_truth_data = summit_ground_truth.get_ground_truth(
@@ -454,5 +1174,6 @@ if __name__ == "__main__":
         print("INFO: no calibration file provided, using default values")
 
     results = smpi_sim.run(temp_env, my_calibration)
+    smpi_sim.cleanup()
 
     temp_env.cleanup()
@@ -5,21 +5,66 @@ from datetime import timedelta
 
 import simcal as sc
 import SMPISimulator
+from ParameterSpace import ParameterSpace
+from WarmStart import WarmStartedSkopt, load_history
+from ParallelGradientDescent import ParallelGradientDescent
+from BatchedRandom import BatchedRandom
+from ConvergenceMonitor import ConvergenceMonitor, ConvergenceReached
 
 
 class SMPISimulatorCalibrator:
-    def __init__(self, algorithm: str, simulator: SMPISimulator, param_file: str):
+    def __init__(self, algorithm: str, simulator: SMPISimulator, param_file: str,
+                 warm_start: str = None, warm_start_width: float = 0.25,
+                 monitor: ConvergenceMonitor = None, batch_size: int = 16,
+                 space: ParameterSpace = None, seed_surrogate: bool = True):
         self.algorithm = algorithm
         self.simulator = simulator
         self.param_file = param_file
+        self.warm_start = warm_start
+        self.warm_start_width = warm_start_width
+        self.monitor = monitor if monitor is not None else ConvergenceMonitor()
+        self.batch_size = batch_size
+        # searched parameters, read from param_file when not given
+        self.space = space
+        # whether the skopt algorithms seed their surrogate with the warm start losses
+        self.seed_surrogate = seed_surrogate
+
+    def load_params(self) -> ParameterSpace:
+        # Adding platform params by reading in a txt file that should contain python code
+        try:
+            with open(self.param_file, 'r', encoding="utf-8") as file:
+                print(f"{file.read()}")
+                print("-----------------------------------------------------")
+            return ParameterSpace.from_file(self.param_file)
+        except FileNotFoundError as exc:
+            raise FileNotFoundError(
+                f"Error: The file '{self.param_file}' does not exist.") from exc
+        except Exception as e:
+            print(f"An error occurred while executing the file: {e}")
+            return ParameterSpace()
 
     def compute_calibration(self, time_limit: float, num_threads: int):
+        space = self.space if self.space is not None else self.load_params()
+        history = None
+
+        if self.warm_start is not None:
+            history = load_history(self.warm_start)
+            sys.stderr.write(
+                f"Warm start: {len(history)} previous evaluations, best loss {history[0][1]}\n")
+            if self.algorithm in ("random", "gradient", "gradient.linesearch", "batched"):
+                # sample around, and start the descent from, the previous best calibration
+                space = space.narrow(history[0][0], self.warm_start_width)
+
         if self.algorithm == "grid":
             calibrator = sc.calibrators.Grid()
         elif self.algorithm == "random":
             calibrator = sc.calibrators.Random()
         elif self.algorithm == "gradient":
             calibrator = sc.calibrators.GradientDescent(0.01, 1)
+        elif self.algorithm == "gradient.linesearch":
+            calibrator = ParallelGradientDescent(0.01, 0.1, space, num_threads)
+        elif self.algorithm == "batched":
+            calibrator = BatchedRandom(space, self.batch_size, num_threads)
         elif self.algorithm == "skopt.gp":
             calibrator = sc.calibrators.ScikitOptimizer(10, "GP", 0)
         elif self.algorithm == "skopt.et":
@@ -31,31 +76,49 @@ class SMPISimulatorCalibrator:
         else:
             raise ValueError(f"Unknown calibration algorithm {self.algorithm}")
 
-        # Adding platform params by reading in a txt file that should contain python code
-        try:
-            with open(self.param_file, 'r', encoding="utf-8") as file:
-                code = file.read()
-                print(f"{code}")
-                print("-----------------------------------------------------")
-                # Execute the code in the current interpreter's context
-                compile(code, self.param_file, 'exec')
-                exec(code, globals(), locals())
-        except FileNotFoundError as exc:
-            raise FileNotFoundError(
-                f"Error: The file '{self.param_file}' does not exist.") from exc
-        except Exception as e:
-            print(f"An error occurred while executing the file: {e}")
+        seeds = history if history is not None and self.seed_surrogate else None
+        if self.algorithm.startswith("skopt.") and (
+                seeds is not None or self.monitor.min_expected_improvement is not None):
+            # Simcal's ScikitOptimizer hides its surrogate, which the warm start seeds and the
+            # expected improvement check queries
+            calibrator = WarmStartedSkopt(
+                10, self.algorithm.split(".")[1].upper(), 0, space, seeds or [], num_threads)
+
+        # the local calibrators search the ParameterSpace directly
+        if not isinstance(calibrator, (WarmStartedSkopt, ParallelGradientDescent, BatchedRandom)):
+            space.apply(calibrator)
+
+        # Log/Integer parameters are searched in a transformed space,
+        # the simulator maps them back before compiling the platform
+        self.simulator.param_space = space
+        self.simulator.monitor = self.monitor
 
         coordinator = None
+        if self.algorithm == "gradient" and num_threads > 1:
+            # Simcal's descent submits the probes of a step together, the pool runs them concurrently
+            coordinator = sc.coordinators.ThreadPool(pool_size=num_threads)
 
         try:
             start_time = perf_counter()
+            self.monitor.start_time = start_time
             calibration, loss = calibrator.calibrate(
                 self.simulator, timelimit=time_limit, coordinator=coordinator)
+            calibration = space.decode({k: str(v) for k, v in calibration.items()})
             elapsed = int(perf_counter() - start_time)
+            if self.monitor.stop_reason is None and elapsed < time_limit:
+                self.monitor.stop_reason = "calibrator finished"
             sys.stderr.write(
                 f"Actually ran in {timedelta(seconds=elapsed)}\n----------------\n")
         except Exception as error:
+            if isinstance(getattr(error, 'exception', error), ConvergenceReached):
+                # the monitor kept track of the best (already decoded) calibration
+                calibration, loss = self.monitor.best_calibration, self.monitor.best_loss
+                elapsed = int(perf_counter() - start_time)
+                sys.stderr.write(
+                    f"Stopped early ({self.monitor.stop_reason}) after {timedelta(seconds=elapsed)}\n"
+                    "----------------\n")
+                return calibration, loss
+
             sys.stderr.write(f"Error while running experiments: {error}\n")
             if hasattr(error, 'exception'):
                 sys.stderr.write("\n---------------\n")
@@ -63,5 +126,8 @@ class SMPISimulatorCalibrator:
                 e = error.exception
                 traceback.print_exception(type(e), e, e.__traceback__)
                 sys.exit(1)
+            # e.g. the broker lost its workers, there is no calibration to return
+            traceback.print_exception(type(error), error, error.__traceback__)
+            sys.exit(1)
 
         return calibration, loss
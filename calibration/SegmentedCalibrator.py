@@ -0,0 +1,181 @@
+"""
+This module provides the decomposed calibration of the `--split` network factors, one segment at a time.
+"""
+import math
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+
+from ParameterSpace import ParameterSpace, Linear
+from ConvergenceMonitor import ConvergenceMonitor
+from WarmStart import load_history
+from SMPISimulatorCalibrator import SMPISimulatorCalibrator
+
+SEGMENT_PARAM = re.compile(r"network/(latency|bandwidth)-factor_(\d+)$")
+
+
+class SegmentedCalibrator:
+    """
+    Calibrates the `network/latency-factor_i` and `network/bandwidth-factor_i` parameters of
+    each `--split` segment separately.
+
+    SimGrid applies the factor of split_i to the sizes above split_i up to split_i+1 included
+    (sizes up to the first split keep the default factor), so each segment is searched against
+    the ground truth sizes in (split_i, split_i+1] only (see `SMPISimulator.segment`),
+    and the segments are searched concurrently with the configured algorithm. Meanwhile the
+    other parameters keep the previous best values when warm starting, else the middle of their
+    range. The per-segment factors are then stitched together and, when there are other
+    parameters, these are searched on every size with the stitched factors fixed, in the
+    remaining half of the time limit. The best of this pass is the reported calibration.
+    """
+
+    def __init__(self, algorithm: str, simulator, param_file: str,
+                 warm_start: str = None, warm_start_width: float = 0.25,
+                 monitor_factory: Callable[[], ConvergenceMonitor] = ConvergenceMonitor,
+                 batch_size: int = 16):
+        self.algorithm = algorithm
+        self.simulator = simulator
+        self.param_file = param_file
+        self.warm_start = warm_start
+        self.warm_start_width = warm_start_width
+        self.monitor_factory = monitor_factory
+        self.batch_size = batch_size
+        self.segments = []
+        self.shared = None
+
+    def split_space(self, space: ParameterSpace):
+        """
+        Sorts the declared parameters by segment.
+
+        Returns:
+            tuple: (one ParameterSpace per segment, names of the parameters shared by every segment).
+        """
+        if any(re.match(r"network/.*-factor-split", name) for name in space.names):
+            raise ValueError("Decomposed calibration needs fixed --split values, "
+                             "network/*-factor-split parameters cannot be calibrated")
+
+        segments = [ParameterSpace() for _ in self.simulator.byte_split]
+        shared = []
+        for name, param in space.params.items():
+            match = SEGMENT_PARAM.match(name)
+            if match is None:
+                shared.append(name)
+                continue
+            index = int(match.group(2))
+            if index >= len(segments):
+                raise ValueError(f"Parameter '{name}' has no --split segment")
+            segments[index].add_param(name, param)
+
+        return segments, shared
+
+    def initial_values(self, space: ParameterSpace) -> Dict[str, str]:
+        """
+        Rendered value of every parameter: the previous best calibration when warm starting,
+        else the middle of the declared range.
+        """
+        values = {}
+        if self.warm_start is not None:
+            values = dict(load_history(self.warm_start)[0][0])
+
+        for name, param in space.params.items():
+            if name not in values and isinstance(param, Linear):
+                values[name] = param.render(param.from_unit(0.5))
+
+        return values
+
+    def calibrate_segment(self, index: int, space: ParameterSpace, fixed: Dict[str, str],
+                          time_limit: float, num_threads: int) -> dict:
+        splits = sorted(float(value) for value in self.simulator.byte_split)
+        low = splits[index]
+        high = splits[index + 1] if index + 1 < len(splits) else math.inf
+        byte_range = [low, high if high != math.inf else None]
+
+        segment = self.simulator.segment(low, high, fixed)
+        if segment is None:
+            sys.stderr.write(f"Segment {index}: no ground truth size in ({low}, {high}], keeping {fixed}\n")
+            return {"segment": index, "bytes": byte_range, "sizes": 0,
+                    "calibration": {name: fixed[name] for name in space.names}, "loss": None}
+
+        # the previous losses were measured on every size, they would mislead a segment's surrogate
+        calibrator = SMPISimulatorCalibrator(
+            self.algorithm, segment, self.param_file,
+            warm_start=self.warm_start, warm_start_width=self.warm_start_width,
+            monitor=self.monitor_factory(), batch_size=self.batch_size, space=space,
+            seed_surrogate=False
+        )
+        calibration, loss = calibrator.compute_calibration(time_limit, num_threads)
+        sys.stderr.write(f"Segment {index}: loss {loss} with {calibration}\n")
+
+        return {"segment": index, "bytes": byte_range,
+                "sizes": sum(len(i[3]) for i in segment.ground_truth[0]),
+                "calibration": {name: str(calibration[name]) for name in space.names},
+                "loss": loss, "convergence": calibrator.monitor.summary()}
+
+    def calibrate_shared(self, space: ParameterSpace, fixed: Dict[str, str],
+                         time_limit: float, num_threads: int) -> dict:
+        """
+        Searches the parameters shared by every segment on every size, the stitched factors fixed.
+        """
+        self.simulator.fixed = dict(fixed)
+        try:
+            calibrator = SMPISimulatorCalibrator(
+                self.algorithm, self.simulator, self.param_file,
+                warm_start=self.warm_start, warm_start_width=self.warm_start_width,
+                monitor=self.monitor_factory(), batch_size=self.batch_size, space=space
+            )
+            calibration, loss = calibrator.compute_calibration(time_limit, num_threads)
+        finally:
+            self.simulator.fixed = {}
+        calibration = {name: str(calibration[name]) for name in space.names}
+        sys.stderr.write(f"Shared parameters: loss {loss} with {calibration}\n")
+
+        return {"shared": space.names, "calibration": calibration,
+                "loss": loss, "convergence": calibrator.monitor.summary()}
+
+    def compute_calibration(self, time_limit: float, num_threads: int):
+        space = ParameterSpace.from_file(self.param_file)
+        segment_spaces, shared = self.split_space(space)
+        values = self.initial_values(space)
+
+        active = [index for index, segment_space in enumerate(segment_spaces) if len(segment_space) > 0]
+        if len(active) == 0:
+            raise ValueError("Decomposed calibration needs network/latency-factor_i or "
+                             "network/bandwidth-factor_i parameters")
+        threads = max(1, num_threads // len(active))
+
+        shared_space = ParameterSpace()
+        for name in shared:
+            shared_space.add_param(name, space.params[name])
+        # the segments and the pass over the shared parameters split the time limit
+        segment_time = time_limit / 2 if len(shared_space) > 0 else time_limit
+
+        def calibrate(index):
+            segment_space = segment_spaces[index]
+            # the factors of the other segments do not affect the simulated sizes
+            fixed = {name: value for name, value in values.items() if name not in segment_space.params}
+            return self.calibrate_segment(index, segment_space, fixed, segment_time, threads)
+
+        with ThreadPoolExecutor(max_workers=len(active)) as pool:
+            self.segments = list(pool.map(calibrate, active))
+
+        calibration = {name: values[name] for name in shared if name in values}
+        for segment in self.segments:
+            calibration.update(segment["calibration"])
+
+        if len(shared_space) > 0:
+            factors = {name: value for name, value in calibration.items() if name not in shared_space.params}
+            self.shared = self.calibrate_shared(shared_space, factors, time_limit - segment_time, num_threads)
+            calibration.update(self.shared["calibration"])
+
+        # the stitched calibration, evaluated on every size
+        record = self.simulator.evaluate(calibration)
+
+        return dict(record["calibration"]), record["loss"]
+
+    def summary(self) -> List[dict]:
+        """
+        Byte range, number of ground truth sizes, best factors, loss and convergence of every
+        segment, then the best values, loss and convergence of the shared parameters, if any.
+        """
+        return self.segments + ([self.shared] if self.shared is not None else [])
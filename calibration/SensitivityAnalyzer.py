@@ -0,0 +1,175 @@
+"""
+This module provides a global sensitivity analysis of the simulator parameters.
+"""
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+import numpy as np
+
+from ParameterSpace import ParameterSpace
+
+
+class SensitivityAnalyzer:
+    """
+    Morris (elementary effects) and Sobol (Saltelli design, Jansen estimators) analysis
+    of the parameters of a `ParameterSpace`, evaluated through `SMPISimulator.evaluate`.
+
+    Indices are reported for the aggregated loss, for the loss of each known point and
+    for the simulated value of every (benchmark, byte size) pair.
+    """
+
+    def __init__(self, simulator, space: ParameterSpace, method: str = "morris",
+                 samples: int = 16, num_threads: int = 1, levels: int = 4, seed: int = 0):
+        if method not in ("morris", "sobol"):
+            raise ValueError(f"Unknown sensitivity analysis method '{method}'")
+        if len(space) == 0:
+            raise ValueError("No parameters declared for the sensitivity analysis")
+
+        self.simulator = simulator
+        self.space = space
+        self.method = method
+        self.samples = samples
+        self.num_threads = max(1, num_threads)
+        self.levels = levels
+        self.rng = np.random.default_rng(seed)
+
+    def morris_design(self) -> np.ndarray:
+        """
+        Builds `samples` one-at-a-time trajectories of d + 1 points on a p-level grid.
+        """
+        d = len(self.space)
+        p = self.levels
+        delta = p / (2 * (p - 1))
+        grid = np.arange(p // 2) / (p - 1)
+
+        trajectories = []
+        for _ in range(self.samples):
+            point = self.rng.choice(grid, size=d)
+            trajectory = [point.copy()]
+            for j in self.rng.permutation(d):
+                point[j] += delta
+                trajectory.append(point.copy())
+            trajectories.append(trajectory)
+
+        return np.array(trajectories).reshape(-1, d)
+
+    def sobol_design(self) -> np.ndarray:
+        """
+        Builds the A, B and A_B^i matrices of the Saltelli design, stacked row-wise.
+        """
+        d = len(self.space)
+        a = self.rng.random((self.samples, d))
+        b = self.rng.random((self.samples, d))
+
+        blocks = [a, b]
+        for j in range(d):
+            ab = a.copy()
+            ab[:, j] = b[:, j]
+            blocks.append(ab)
+
+        return np.vstack(blocks)
+
+    def evaluate_design(self, design: np.ndarray) -> List[dict]:
+        """
+        Evaluates every point of the design, `num_threads` at a time.
+        """
+        calibrations = [self.space.from_unit(point) for point in design]
+
+        with ThreadPoolExecutor(max_workers=self.num_threads) as pool:
+            records = list(pool.map(self.simulator.evaluate, calibrations))
+
+        return records
+
+    def output_labels(self) -> List[tuple]:
+        """
+        Labels of the outputs of an evaluation record, in the order of `outputs`.
+        """
+        labels = [("loss",)]
+        for i in self.simulator.ground_truth[0]:
+            point = f"{i[0]}/{i[1]}/{i[2]}"
+            labels.append((point, "loss"))
+            labels.extend((point, str(byte_size)) for byte_size in i[3])
+        return labels
+
+    def outputs(self, record: dict) -> List[float]:
+        values = [float(record["loss"])]
+        offset = 0
+        for count, i in enumerate(self.simulator.ground_truth[0]):
+            values.append(record["losses"][count])
+            values.extend(record["result"][offset:offset + len(i[3])])
+            offset += len(i[3])
+        return values
+
+    def morris_indices(self, design: np.ndarray, y: np.ndarray) -> Dict[str, Dict[str, float]]:
+        d = len(self.space)
+        effects = np.zeros((self.samples, d))
+
+        for t in range(self.samples):
+            rows = slice(t * (d + 1), (t + 1) * (d + 1))
+            x_t, y_t = design[rows], y[rows]
+            for k in range(d):
+                j = int(np.argmax(x_t[k + 1] != x_t[k]))
+                effects[t, j] = (y_t[k + 1] - y_t[k]) / (x_t[k + 1, j] - x_t[k, j])
+
+        return {
+            name: {
+                "mu": float(np.mean(effects[:, j])),
+                "mu_star": float(np.mean(np.abs(effects[:, j]))),
+                "sigma": float(np.std(effects[:, j]))
+            }
+            for j, name in enumerate(self.space.names)
+        }
+
+    def sobol_indices(self, y: np.ndarray) -> Dict[str, Dict[str, float]]:
+        n = self.samples
+        f_a, f_b = y[:n], y[n:2 * n]
+        variance = np.var(np.concatenate([f_a, f_b]))
+        if variance == 0:
+            variance = 1
+
+        indices = {}
+        for j, name in enumerate(self.space.names):
+            f_ab = y[(2 + j) * n:(3 + j) * n]
+            indices[name] = {
+                "first_order": float(np.mean(f_b * (f_ab - f_a)) / variance),
+                "total": float(0.5 * np.mean((f_a - f_ab) ** 2) / variance)
+            }
+
+        return indices
+
+    def analyze(self) -> dict:
+        """
+        Generates the design, evaluates it and computes the indices of every output.
+
+        Returns:
+            dict: The method, the number of evaluations, and the indices nested as
+                  {"loss": {param: ...}, "<benchmark>/<nodes>/<procs>": {"loss" | "<bytes>": {param: ...}}}.
+        """
+        design = self.morris_design() if self.method == "morris" else self.sobol_design()
+
+        sys.stderr.write(
+            f"Sensitivity analysis ({self.method}): {len(design)} evaluations "
+            f"of {len(self.space)} parameters\n")
+
+        records = self.evaluate_design(design)
+        y = np.array([self.outputs(record) for record in records])
+
+        indices = {}
+        for column, label in enumerate(self.output_labels()):
+            if self.method == "morris":
+                value = self.morris_indices(design, y[:, column])
+            else:
+                value = self.sobol_indices(y[:, column])
+
+            if len(label) == 1:
+                indices[label[0]] = value
+            else:
+                indices.setdefault(label[0], {})[label[1]] = value
+
+        return {
+            "method": self.method,
+            "parameters": self.space.names,
+            "evaluations": len(design),
+            "indices": indices
+        }
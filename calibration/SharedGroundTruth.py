@@ -0,0 +1,133 @@
+"""
+This module provides the ground truth published in shared memory, for worker processes.
+"""
+import json
+from multiprocessing import shared_memory, resource_tracker
+from typing import List, Tuple
+
+import numpy as np
+
+
+class SharedGroundTruth:
+    """
+    Ground truth of `MPIGroundTruth.get_ground_truth` packed into a single shared memory block.
+
+    The block holds, one after the other:
+      - samples (float64): the Mbytes/sec values of every point, concatenated,
+      - offsets (int64): start of the samples of every point, plus the total,
+      - summaries (float64): mean and standard deviation of every point,
+      - the known points (benchmark, node count, processes, byte sizes) as UTF-8 JSON.
+
+    The process that publishes the ground truth owns the block and unlinks it on `close`.
+    Pickling a SharedGroundTruth only sends the name and sizes of the block, and workers
+    attach to it without copying: `data` returns views on the shared samples, so the start up
+    cost and memory of a worker do not grow with the ground truth.
+    """
+
+    def __init__(self, shm: shared_memory.SharedMemory, samples: int, points: int, metadata: int,
+                 owner: bool = False):
+        self.shm = shm
+        self.owner = owner
+        self.sizes = (samples, points, metadata)
+
+        buffer = shm.buf
+        offset = 0
+        self.samples = np.ndarray((samples,), dtype=np.float64, buffer=buffer, offset=offset)
+        offset += samples * 8
+        self.offsets = np.ndarray((points + 1,), dtype=np.int64, buffer=buffer, offset=offset)
+        offset += (points + 1) * 8
+        self.summaries = np.ndarray((points, 2), dtype=np.float64, buffer=buffer, offset=offset)
+        offset += points * 16
+        self.metadata_range = (offset, offset + metadata)
+
+    @classmethod
+    def publish(cls, ground_truth: Tuple[list, List[List[float]]]) -> "SharedGroundTruth":
+        """
+        Copies a ground truth into a new shared memory block.
+
+        Args:
+            ground_truth (tuple): (known_points, data) as returned by `MPIGroundTruth.get_ground_truth`.
+
+        Returns:
+            SharedGroundTruth: The owner of the block.
+        """
+        known_points, data = ground_truth
+        metadata = json.dumps([[i[0], int(i[1]), int(i[2]), [int(b) for b in i[3]]] for i in known_points])
+        metadata = metadata.encode("utf-8")
+        samples = sum(len(values) for values in data)
+        points = len(data)
+
+        size = samples * 8 + (points + 1) * 8 + points * 16 + len(metadata)
+        shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        shared = cls(shm, samples, points, len(metadata), owner=True)
+
+        shared.offsets[0] = 0
+        for count, values in enumerate(data):
+            start = shared.offsets[count]
+            shared.offsets[count + 1] = start + len(values)
+            shared.samples[start:start + len(values)] = values
+            shared.summaries[count] = (np.mean(values), np.std(values)) if len(values) else (np.nan, np.nan)
+        shm.buf[shared.metadata_range[0]:shared.metadata_range[1]] = metadata
+
+        return shared
+
+    @classmethod
+    def attach(cls, name: str, samples: int, points: int, metadata: int) -> "SharedGroundTruth":
+        """
+        Attaches to a block published by another process.
+        """
+        try:
+            shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            # before Python 3.13, attaching registers the block with the resource tracker, which
+            # unlinks it when this process exits although the publisher still uses it
+            register = resource_tracker.register
+            resource_tracker.register = lambda *args: None
+            try:
+                shm = shared_memory.SharedMemory(name=name)
+            finally:
+                resource_tracker.register = register
+        return cls(shm, samples, points, metadata)
+
+    def __reduce__(self):
+        return SharedGroundTruth.attach, (self.shm.name, *self.sizes)
+
+    @property
+    def known_points(self) -> List[Tuple[str, int, int, List[int]]]:
+        start, end = self.metadata_range
+        return [tuple(i) for i in json.loads(bytes(self.shm.buf[start:end]).decode("utf-8"))]
+
+    @property
+    def data(self) -> List[np.ndarray]:
+        """
+        Samples of every point, as read-only views on the shared block.
+        """
+        views = []
+        for count in range(len(self.summaries)):
+            view = self.samples[self.offsets[count]:self.offsets[count + 1]]
+            view.flags.writeable = False
+            views.append(view)
+        return views
+
+    def ground_truth(self) -> Tuple[list, List[np.ndarray]]:
+        """
+        (known_points, data) in the layout of `MPIGroundTruth.get_ground_truth`, without copying the samples.
+        """
+        return self.known_points, self.data
+
+    def close(self):
+        """
+        Detaches from the block, and unlinks it when this process published it.
+        """
+        # the numpy views must be released before the buffer can be closed
+        self.samples = self.offsets = self.summaries = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+            self.owner = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
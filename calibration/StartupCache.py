@@ -0,0 +1,289 @@
+"""
+This module provides the on-disk caches that keep the startup of a calibration short:
+an index of the ground truth, the calibrated host speed, the generated platforms and the
+route checks of trimmed platforms.
+
+Nothing heavier than the standard library is imported here, pandas is only loaded when a
+ground truth index has to be (re)built.
+"""
+import hashlib
+import json
+import os
+import shutil
+import socket
+import threading
+from pathlib import Path
+from typing import Callable, List, Optional, Tuple
+
+file_abs_path = Path(__file__).parent.absolute()
+
+# Sources of the Summit platform generator, a change to any of them invalidates the cached platforms
+summit = Path(file_abs_path / "../simulator/Summit_platform_src").resolve()
+
+
+def default_cache_dir() -> Path:
+    """
+    $SMPI_CALIBRATION_CACHE, else $XDG_CACHE_HOME/smpi-calibration (~/.cache/smpi-calibration).
+    """
+    if os.environ.get("SMPI_CALIBRATION_CACHE"):
+        return Path(os.environ["SMPI_CALIBRATION_CACHE"])
+
+    return Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / "smpi-calibration"
+
+
+def file_signature(path) -> List:
+    """
+    [resolved path, size, mtime] of a file, [path] if it does not exist.
+    """
+    path = Path(path).resolve()
+    if not path.exists():
+        return [str(path)]
+
+    stat = path.stat()
+    return [str(path), stat.st_size, stat.st_mtime_ns]
+
+
+def simgrid_signature() -> List:
+    """
+    Signature of the SimGrid installation (smpirun and libsimgrid), used as a proxy for its version.
+    """
+    smpirun = shutil.which("smpirun")
+    if smpirun is None:
+        return []
+
+    lib_dir = Path(smpirun).resolve().parent.parent / "lib"
+    return [file_signature(smpirun)] + [file_signature(lib) for lib in sorted(lib_dir.glob("libsimgrid.so*"))]
+
+
+def write_json(path: Path, data):
+    """
+    Writes a JSON file atomically, so concurrent runs never read a partial cache entry.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def read_json(path: Path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class StartupCache:
+    """
+    On-disk caches shared by every calibration run of this user.
+
+    The calibrations of a campaign share one instance, which also keeps the ground truth
+    indexes it read in memory and builds each platform once (see `platform_lock`).
+    """
+
+    def __init__(self, directory=None):
+        self.directory = Path(directory) if directory else default_cache_dir()
+        self.lock = threading.Lock()
+        self.sources_digest = None
+        self.indexes = {}
+        self.platform_locks = {}
+
+        # platforms copied from the cache and platforms added to it by this process
+        self.platform_stats = {"loaded": 0, "stored": 0}
+
+    def ground_truth(
+        self,
+        filename,
+        benchmark_parent: str,
+        benchmarks: List[str] = None,
+        byte_sizes: List[int] = None,
+        node_counts: List[int] = None
+    ) -> Tuple[List[Tuple[str, int, int, List[int]]], List[List[float]]]:
+        """
+        Same ground truth as `MPIGroundTruth.get_ground_truth`, read from an index of the CSV
+        file. The index holds the Mbytes/sec values of every (benchmark parent, benchmark,
+        node count, processes, bytes) point and is rebuilt when the CSV file changes.
+        """
+        signature = file_signature(filename)
+        key = hashlib.sha1(signature[0].encode("utf-8")).hexdigest()
+        index_file = self.directory / "ground_truth" / f"{key}.json"
+
+        with self.lock:
+            index = self.indexes.get(key)
+        if index is None or index["signature"] != signature:
+            index = read_json(index_file)
+            if index is None or index["signature"] != signature:
+                index = {"signature": signature, "rows": self.build_index(filename)}
+                write_json(index_file, index)
+            with self.lock:
+                self.indexes[key] = index
+
+        return self.query_index(index["rows"], benchmark_parent, benchmarks, byte_sizes, node_counts)
+
+    @staticmethod
+    def build_index(filename) -> List[list]:
+        """
+        Groups the rows of a ground truth CSV file (without remark) by point.
+
+        Returns:
+            List[list]: [benchmark_parent, benchmark, node_count, processes, bytes, [Mbytes/sec, ...]] rows.
+        """
+        import pandas as pd
+
+        df = pd.read_csv(filename)
+        df = df[pd.isnull(df["remark"])]
+
+        grouped = (
+            df.groupby(["benchmark_parent", "benchmark", "node_count", "processes", "bytes"])["Mbytes/sec"]
+            .agg(list)
+            .reset_index()
+        )
+
+        return [
+            [row["benchmark_parent"], row["benchmark"], int(row["node_count"]), int(row["processes"]),
+             int(row["bytes"]), [float(value) for value in row["Mbytes/sec"]]]
+            for _, row in grouped.iterrows()
+        ]
+
+    @staticmethod
+    def query_index(
+        rows: List[list],
+        benchmark_parent: str,
+        benchmarks: List[str] = None,
+        byte_sizes: List[int] = None,
+        node_counts: List[int] = None
+    ) -> Tuple[List[Tuple[str, int, int, List[int]]], List[List[float]]]:
+        """
+        Applies the filters of `MPIGroundTruth.set_benchmark_parent` and `get_filtered_df` to
+        the rows of an index, returning (known_points, data) in the same order.
+        """
+        prefixes = tuple(benchmarks) if benchmarks else ()
+
+        points = {}
+        for parent, benchmark, node_count, processes, byte_size, values in rows:
+            if benchmark_parent != "all" and parent != benchmark_parent:
+                continue
+            if prefixes and not benchmark.startswith(prefixes):
+                continue
+            if byte_sizes and byte_size not in byte_sizes:
+                continue
+            if node_counts and node_count not in node_counts:
+                continue
+            points.setdefault((benchmark, node_count, processes, byte_size), []).extend(values)
+
+        known_points = {}
+        data = []
+        for point in sorted(points.keys()):
+            known_points.setdefault(point[:3], []).append(point[3])
+            data.append(points[point])
+
+        return [(*scenario, byte_list) for scenario, byte_list in known_points.items()], data
+
+    def host_speed(self, calibrate: Callable[[], float]) -> float:
+        """
+        Host speed calibrated on this host with this SimGrid installation, calibrating it on first use.
+        """
+        cache_file = self.directory / "host_speed.json"
+        key = json.dumps([socket.gethostname(), simgrid_signature()])
+
+        with self.lock:
+            speeds = read_json(cache_file) or {}
+            if key not in speeds:
+                speeds[key] = calibrate()
+                # another run may have calibrated other hosts in the meantime
+                speeds = dict(read_json(cache_file) or {}, **{key: speeds[key]})
+                write_json(cache_file, speeds)
+
+        return speeds[key]
+
+    def generator_digest(self) -> str:
+        """
+        Digest of the platform generator sources, computed once.
+        """
+        with self.lock:
+            if self.sources_digest is None:
+                digest = hashlib.sha1()
+                for path in sorted(summit.rglob("*")):
+                    # node_config.hpp is rewritten by the generator from the node values
+                    if path.is_file() and path.suffix in (".py", ".cpp", ".hpp") and path.name != "node_config.hpp":
+                        digest.update(path.relative_to(summit).as_posix().encode("utf-8"))
+                        digest.update(path.read_bytes())
+                self.sources_digest = digest.hexdigest()
+            return self.sources_digest
+
+    def platform_key(self, node: dict, topology: dict) -> str:
+        """
+        Key of a generated platform: its node and topology values, the generator sources and SimGrid.
+        """
+        description = json.dumps([node, topology, self.generator_digest(), simgrid_signature()], sort_keys=True)
+        return hashlib.sha1(description.encode("utf-8")).hexdigest()
+
+    def route_check_key(self, key: str) -> str:
+        """
+        Key of a route check: the checked topology structure, the generator sources and SimGrid.
+        """
+        description = json.dumps([key, self.generator_digest(), simgrid_signature()])
+        return hashlib.sha1(description.encode("utf-8")).hexdigest()
+
+    def route_check(self, key: str) -> Optional[bool]:
+        """
+        Outcome of a previous `SMPISimulator.routes_match` check of a topology structure with
+        these generator sources and SimGrid, None if it was never checked.
+        """
+        checks = read_json(self.directory / "route_checks.json") or {}
+        return checks.get(self.route_check_key(key))
+
+    def store_route_check(self, key: str, match: bool):
+        """
+        Keeps the outcome of a route check for later runs.
+        """
+        cache_file = self.directory / "route_checks.json"
+        check_key = self.route_check_key(key)
+        with self.lock:
+            # another run may have checked other topologies in the meantime
+            checks = dict(read_json(cache_file) or {})
+            checks[check_key] = match
+            write_json(cache_file, checks)
+
+    def platform_lock(self, node: dict, topology: dict) -> threading.Lock:
+        """
+        Lock held while a platform is looked up and built, so the simulators sharing this cache
+        build it once and the others copy it.
+        """
+        key = json.dumps([node, topology], sort_keys=True)
+        with self.lock:
+            return self.platform_locks.setdefault(key, threading.Lock())
+
+    def load_platform(self, node: dict, topology: dict, tmp_dir: Path) -> Optional[Path]:
+        """
+        Copies a previously generated platform into tmp_dir.
+
+        Returns:
+            Optional[Path]: The copied platform file, None if the platform is not cached.
+        """
+        platform_dir = self.directory / "platforms" / self.platform_key(node, topology)
+        if not platform_dir.is_dir():
+            return None
+
+        for platform_file in sorted(platform_dir.iterdir()):
+            if not platform_file.name.endswith(".tmp"):
+                shutil.copy2(platform_file, tmp_dir / platform_file.name)
+                with self.lock:
+                    self.platform_stats["loaded"] += 1
+                return tmp_dir / platform_file.name
+
+        return None
+
+    def store_platform(self, node: dict, topology: dict, platform_file: Path):
+        """
+        Keeps a copy of a generated platform file for later runs.
+        """
+        platform_dir = self.directory / "platforms" / self.platform_key(node, topology)
+        platform_dir.mkdir(parents=True, exist_ok=True)
+
+        tmp_path = platform_dir / f"{platform_file.name}.{os.getpid()}.{threading.get_ident()}.tmp"
+        shutil.copy2(platform_file, tmp_path)
+        os.replace(tmp_path, platform_dir / platform_file.name)
+        with self.lock:
+            self.platform_stats["stored"] += 1
@@ -0,0 +1,157 @@
+"""
+This module provides warm starting of a calibration from the results of a previous one.
+
+A warm start source is either a `result.json` written by `run_smpi_calibrator.py`, or a
+journal with one evaluation per line: JSON objects with "calibration" and "loss" keys, or the
+"Result: {...}" lines that `SMPISimulator` prints to stderr.
+"""
+import ast
+import json
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from time import perf_counter
+from typing import Dict, List, Tuple
+
+import numpy as np
+import simcal as sc
+import skopt
+
+from ParameterSpace import ParameterSpace
+
+
+def _parse_journal_line(line: str):
+    line = line.strip()
+    if line.startswith("Result: "):
+        # numpy scalars are printed as e.g. np.float64(0.5) by recent numpy versions
+        line = re.sub(r"np\.\w+\(([^()]*)\)", r"\1", line[len("Result: "):])
+        return ast.literal_eval(line)
+    if line.startswith("{"):
+        return json.loads(line)
+    return None
+
+
+def load_history(path: str) -> List[Tuple[Dict[str, str], float]]:
+    """
+    Loads the (calibration, loss) pairs of a previous calibration.
+
+    Args:
+        path (str): Path to a result.json file or to a journal.
+
+    Returns:
+        List[Tuple[Dict[str, str], float]]: The evaluations, sorted by increasing loss.
+    """
+    path = Path(path)
+    if not path.exists():
+        raise FileNotFoundError(f"Error: The warm start file '{path}' does not exist.")
+
+    history = []
+
+    if path.suffix == ".json":
+        with open(path, "r", encoding="utf-8") as f:
+            content = f.read()
+        try:
+            results = json.loads(content).get("results", {})
+        except ValueError:
+            # result.json files of older versions wrote booleans and None the python way
+            results = ast.literal_eval(content).get("results", {})
+        if results.get("calibration"):
+            history.append((results["calibration"], float(results["loss"])))
+    else:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = _parse_journal_line(line)
+                except (ValueError, SyntaxError):
+                    continue
+                # journals write the loss of failed evaluations as null
+                if isinstance(record, dict) and "calibration" in record and record.get("loss") is not None:
+                    history.append(
+                        ({k: str(v) for k, v in record["calibration"].items()}, float(record["loss"])))
+
+    if len(history) == 0:
+        raise ValueError(f"Error: No previous evaluation found in '{path}'")
+
+    history.sort(key=lambda item: item[1])
+
+    return history
+
+
+class WarmStartedSkopt:
+    """
+    Scikit-optimize calibrator whose surrogate is seeded with previous evaluations, if any.
+
+    Simcal's ScikitOptimizer does not expose its optimizer, so this drives `skopt.Optimizer`
+    directly with the same settings and evaluates `num_threads` candidates per ask/tell step.
+    It also reports the improvement its surrogate predicts to the simulator's ConvergenceMonitor,
+    so it replaces ScikitOptimizer whenever `--min_expected_improvement` is set.
+    """
+
+    def __init__(self, starts: int, base_estimator: str, seed: int,
+                 space: ParameterSpace, history: List[Tuple[Dict[str, str], float]], num_threads: int = 1):
+        self.starts = starts
+        self.base_estimator = base_estimator
+        self.seed = seed
+        self.space = space
+        self.history = history
+        self.num_threads = max(1, num_threads)
+
+    def seed_points(self, bounds):
+        x0, y0 = [], []
+        for calibration, loss in self.history:
+            try:
+                point = self.space.encode(calibration)
+            except (KeyError, ValueError):
+                continue
+            x0.append([min(max(x, low), high) for x, (low, high) in zip(point, bounds)])
+            y0.append(loss)
+        return x0, y0
+
+    def report_expected_improvement(self, optimizer, simulator, best_loss, samples=1000):
+        """
+        Reports the improvement predicted by the surrogate to the simulator's ConvergenceMonitor.
+        """
+        monitor = getattr(simulator, "monitor", None)
+        if monitor is None or len(optimizer.models) == 0:
+            return
+
+        points = optimizer.space.rvs(n_samples=samples, random_state=self.seed)
+        predicted = optimizer.models[-1].predict(optimizer.space.transform(points))
+        monitor.report_expected_improvement(max(best_loss - float(np.min(predicted)), 0.0))
+
+    def calibrate(self, simulator, timelimit=None, coordinator=None):
+        names = self.space.names
+        bounds = [param.search_bounds() for param in self.space.params.values()]
+
+        optimizer = skopt.Optimizer(bounds, base_estimator=self.base_estimator,
+                                    n_initial_points=self.starts, random_state=self.seed)
+        x0, y0 = self.seed_points(bounds)
+        if len(x0) > 0:
+            optimizer.tell(x0, y0)
+        if len(self.history) > 0:
+            sys.stderr.write(f"Warm start: seeded surrogate with {len(x0)} previous evaluations\n")
+
+        # the previous losses only guide the surrogate: they may come from another template or
+        # ground truth, so the best calibration is chosen among the evaluations of this run,
+        # starting with the previous best
+        best_x, best_loss = None, None
+        seeds = x0[:1]
+        start_time = perf_counter()
+
+        with ThreadPoolExecutor(max_workers=self.num_threads) as pool:
+            while best_x is None or timelimit is None or perf_counter() - start_time < timelimit:
+                points = seeds + (optimizer.ask(n_points=self.num_threads - len(seeds))
+                                  if self.num_threads > len(seeds) else [])
+                seeds = []
+                losses = list(pool.map(
+                    lambda x: float(simulator.run(sc.Environment(), dict(zip(names, x)))), points))
+                optimizer.tell(points, losses)
+
+                for x, loss in zip(points, losses):
+                    if best_loss is None or loss < best_loss:
+                        best_x, best_loss = x, loss
+
+                self.report_expected_improvement(optimizer, simulator, best_loss)
+
+        return dict(zip(names, best_x)), best_loss
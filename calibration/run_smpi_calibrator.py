@@ -1,56 +1,25 @@
 #!/usr/bin/env python3
 
+import os
 import sys
 import json
+import secrets
 import argparse
 from pathlib import Path
+from time import perf_counter
 
 import pytimeparse
-from SMPISimulator import SMPISimulator
-from SMPISimulatorCalibrator import SMPISimulatorCalibrator
-from mpi_groundtruth import MPIGroundTruth
-
-
-class CustomJSONEncoder(json.JSONEncoder):
-    def __init__(self, *args, **kwargs):
-        self.indentation_level = 0  # Initialize the indentation level
-        super().__init__(*args, **kwargs)
-
-    def encode(self, o):
-        """Override encode method to track indentation level."""
-        if isinstance(o, list):
-            # Increase indentation for arrays
-            self.indentation_level += 1
-            result = '[' + ', '.join(self.encode(el) for el in o) + ']'
-            self.indentation_level -= 1
-            return result
-        elif isinstance(o, dict):
-            result = '{}'
-
-            if len(o) != 0:
-                # Increase indentation for objects
-                self.indentation_level += 1
-                items = [
-                    f'{json.dumps(k)}: {self.encode(v)}' for k, v in o.items()]
-                result = '{\n' + ',\n'.join('    ' *
-                                            self.indentation_level + item for item in items)
-                self.indentation_level -= 1
-                result += '\n' + '    ' * self.indentation_level + '}'
-
-            return result
-        elif isinstance(o, bool):
-            return str(o)
-        elif o is None:
-            return 'None'
-        else:
-            # Default encoding for other types
-            return super().encode(o)
+from StartupCache import StartupCache
+from ResultWriter import ResultWriter
+
+# simcal, numpy and pandas take most of the startup time, so the simulator, calibrator and
+# ground truth modules are only imported once the arguments are validated (see run)
 
 
 file_abs_path = Path(__file__).parent.absolute()
 
 
-def main():
+def build_parser() -> argparse.ArgumentParser:
     # Create the parser
     parser = argparse.ArgumentParser(
         description="Script to run the SMPI calibrator")
@@ -75,6 +44,10 @@ def main():
                         type=lambda s: [int(item) for item in s.split(",")],
                         help="Comma separated list of splits to use for latency/bandwidth factor")
 
+    parser.add_argument("--decompose", action="store_true",
+                        help="Calibrate the network factors of each --split segment separately, "
+                             "on the byte sizes of the segment only")
+
     parser.add_argument("-lf", "--loss_function", default="average", choices=[
                         "max", "average"], type=str,
                         help="The explained variance loss function to use (average, max)")
@@ -96,12 +69,109 @@ def main():
 
     # CALIBRATOR PARAMETERS
     parser.add_argument("-a", "--algorithm", type=str, default="random", choices=[
-                        "grid", "random", "gradient", "skopt.gp", "skopt.et", "skopt.rf", "skopt.gbrt"],
+                        "grid", "random", "gradient", "gradient.linesearch", "batched",
+                        "skopt.gp", "skopt.et", "skopt.rf", "skopt.gbrt"],
                         help="Algorithms to use for calibration (Default: random)")
 
+    parser.add_argument("--batch_size", type=int, default=16,
+                        help="Evaluations sharing a platform build per round of the batched algorithm (Default: 16)")
+
     parser.add_argument("-t", "--time_limit", type=str, default="3h",
                         help="Time limit for calibration (Default: 3h)")
 
+    parser.add_argument("-ws", "--warm_start", type=str, default=None,
+                        help="Previous result.json or journal to warm start the calibration from")
+
+    parser.add_argument("--warm_start_width", type=float, default=0.25,
+                        help="Fraction of each parameter range searched around the previous best "
+                             "by the random, gradient, gradient.linesearch and batched algorithms when warm starting (Default: 0.25)")
+
+    # EARLY TERMINATION PARAMETERS
+    parser.add_argument("--patience", type=int, default=None,
+                        help="Stop after this many evaluations without improvement of the best loss")
+
+    parser.add_argument("--patience_time", type=str, default=None,
+                        help="Stop after this much time without improvement of the best loss (ex. 30m)")
+
+    parser.add_argument("--min_improvement", type=float, default=0.0,
+                        help="Relative decrease of the best loss that counts as an improvement (Default: 0.0)")
+
+    parser.add_argument("--min_expected_improvement", type=float, default=None,
+                        help="Stop when the surrogate-predicted relative improvement falls below this value "
+                             "(skopt algorithms only)")
+
+    parser.add_argument("-k", "--top_k", type=int, default=20,
+                        help="Number of best calibrations written to result.json (Default: 20)")
+
+    parser.add_argument("--store", type=str, default="evaluations.db",
+                        help="SQLite file every evaluation is written to, relative to --output_dir, empty to disable "
+                             "(Default: evaluations.db)")
+
+    parser.add_argument("-r", "--repetitions", type=int, default=None,
+                        help="Total simulation repetitions per evaluation, spread over the points by "
+                             "their ground truth variance (Default: up to 10 per point)")
+
+    parser.add_argument("--interpolate", action="store_true",
+                        help="Simulate a subset of the byte sizes and interpolate the others, "
+                             "the finalists are re-evaluated on every size")
+
+    parser.add_argument("--finalists", type=int, default=5,
+                        help="Number of best calibrations re-evaluated on every size with --interpolate (Default: 5)")
+
+    parser.add_argument("--stats", action="store_true",
+                        help="Collect the SimGrid timing of every simulation and write a cost report "
+                             "under results.cost in result.json")
+
+    parser.add_argument("--no_check_routes", action="store_true",
+                        help="Use the topologies trimmed to the hostfile without comparing their routes with the "
+                             "untrimmed ones on sample host pairs")
+
+    parser.add_argument("--launcher", action="store_true",
+                        help="Go through smpirun once per byte size and start the simulator directly "
+                             "for the other repetitions")
+
+    parser.add_argument("--journal", type=str, default="result.jsonl",
+                        help="JSON-lines file every evaluation of this run is written to, empty to disable (Default: result.jsonl)")
+
+    parser.add_argument("-o", "--output_dir", type=str, default=".",
+                        help="Directory of result.json, of the journal (when relative) and of the "
+                             "simulator logs (Default: current directory)")
+
+    parser.add_argument("--max_cpus", type=int, default=None,
+                        help="Maximum number of CPUs used by concurrent simulations "
+                             "(Default: affinity mask and cgroup quota)")
+
+    parser.add_argument("--pin_cpus", action="store_true",
+                        help="Pin every simulation to the CPUs it was granted")
+
+    parser.add_argument("-j", "--num_threads", type=int, default=1,
+                        help="Number of simulations to evaluate concurrently (Default: 1)")
+
+    parser.add_argument("--broker", type=str, default=None,
+                        help="host:port to serve the evaluations to run_smpi_worker.py workers on, "
+                             "e.g. :5555 for every interface (Default: simulate in this process)")
+
+    parser.add_argument("--local_workers", type=int, default=0,
+                        help="Number of workers started on this host with --broker (Default: 0)")
+
+    parser.add_argument("--heartbeat_timeout", type=float, default=60.0,
+                        help="Seconds without heartbeat after which the evaluation of a worker is "
+                             "queued again (Default: 60)")
+
+    # SENSITIVITY ANALYSIS PARAMETERS
+    parser.add_argument("-sa", "--sensitivity", type=str, default=None, choices=["morris", "sobol"],
+                        help="Run a sensitivity analysis of the parameters instead of a calibration")
+
+    parser.add_argument("--samples", type=int, default=16,
+                        help="Number of trajectories (morris) or base samples (sobol) (Default: 16)")
+
+    parser.add_argument("--cache_dir", type=str, default=None,
+                        help="Directory of the ground truth index, host speed and platform caches, "
+                             "empty to disable (Default: ~/.cache/smpi-calibration)")
+
+    parser.add_argument("--dry_run", action="store_true",
+                        help="Validate the arguments and print the known points without simulating")
+
     parser.add_argument("-d", "--debug", action='store_true',
                         help="Enable debug messages")
 
@@ -114,9 +184,16 @@ def main():
     parser.add_argument("byte_sizes", nargs='?', default=byte_sizes, type=lambda s: [int(
         item) for item in s.split(",")], help="List of byte sizes to calibrate")
 
-    # Parse the arguments
-    args = parser.parse_args()
+    return parser
+
 
+def check_args(args) -> dict:
+    """
+    Validates the parsed arguments, exiting with an error message on the first invalid one.
+
+    Returns:
+        dict: The resolved hostfile and ground truth paths, time limit and patience time (seconds).
+    """
     hostfile = Path(args.hostfile).resolve()
 
     ground_truth_file = Path(args.ground_truth_file).resolve()
@@ -125,15 +202,120 @@ def main():
         print("Error: Hostfile does not exist", file=sys.stderr)
         exit(-1)
 
+    if not ground_truth_file.exists():
+        print("Error: Ground truth file does not exist", file=sys.stderr)
+        exit(-1)
+
+    if not Path(args.param_file).exists():
+        print("Error: Parameter file does not exist", file=sys.stderr)
+        exit(-1)
+
+    if args.warm_start is not None and not Path(args.warm_start).exists():
+        print("Error: Warm start file does not exist", file=sys.stderr)
+        exit(-1)
+
+    if args.warm_start is not None and args.journal and \
+            Path(args.warm_start).resolve() == (Path(args.output_dir) / args.journal).resolve():
+        print("Error: The journal is truncated on each run, warm start from a copy of it "
+              "or give this run another --journal", file=sys.stderr)
+        exit(-1)
+
+    if args.local_workers and args.broker is None:
+        print("Error: --local_workers requires --broker", file=sys.stderr)
+        exit(-1)
+
+    if args.decompose and not args.split:
+        print("Error: --decompose requires --split", file=sys.stderr)
+        exit(-1)
+
+    if args.decompose:
+        # only decomposed calibrations load the parameter file before the arguments are validated
+        from ParameterSpace import ParameterSpace
+        from SegmentedCalibrator import SEGMENT_PARAM
+
+        if not any(SEGMENT_PARAM.match(name) for name in ParameterSpace.from_file(args.param_file).names):
+            print("Error: --decompose requires network/latency-factor_i or network/bandwidth-factor_i "
+                  "parameters in the parameter file", file=sys.stderr)
+            exit(-1)
+
+    if args.min_expected_improvement is not None and (
+            args.sensitivity is not None or not args.algorithm.startswith("skopt.")):
+        print("Error: --min_expected_improvement requires a skopt.* algorithm, "
+              "whose surrogate predicts the improvement", file=sys.stderr)
+        exit(-1)
+
+    if args.top_k < 1:
+        print("Error: --top_k must be at least 1", file=sys.stderr)
+        exit(-1)
+
     time_limit = pytimeparse.parse(args.time_limit)
+    if time_limit is None:
+        print(f"Error: Invalid time limit '{args.time_limit}'", file=sys.stderr)
+        exit(-1)
+
+    patience_time = None
+    if args.patience_time is not None:
+        patience_time = pytimeparse.parse(args.patience_time)
+        if patience_time is None:
+            print(f"Error: Invalid patience time '{args.patience_time}'", file=sys.stderr)
+            exit(-1)
+
+    return {"hostfile": hostfile, "ground_truth_file": ground_truth_file,
+            "time_limit": time_limit, "patience_time": patience_time}
+
+
+def load_ground_truth(cache: StartupCache, ground_truth_file: Path, args):
+    """
+    The (known_points, data) ground truth of the selected benchmarks, byte sizes and node counts.
+    """
+    if cache is not None:
+        return cache.ground_truth(
+            ground_truth_file, "P2P", benchmarks=args.benchmarks, byte_sizes=args.byte_sizes,
+            node_counts=args.node_counts)
+
+    from mpi_groundtruth import MPIGroundTruth
 
     summit_df = MPIGroundTruth(ground_truth_file)
 
     summit_df.set_benchmark_parent("P2P")
 
-    ground_truth_data = summit_df.get_ground_truth(
+    return summit_df.get_ground_truth(
         benchmarks=args.benchmarks, byte_sizes=args.byte_sizes, node_counts=args.node_counts)
 
+
+def run(args, shared=None, client: str = None) -> dict:
+    """
+    Runs the calibration or sensitivity analysis of parsed arguments.
+
+    Args:
+        args (argparse.Namespace): The arguments of `build_parser`.
+        shared (SharedResources): Cache, ground truth, host speed and CPU budget shared with
+            the other calibrations of a campaign, None for those of this run only.
+        client (str): Name of the calibration in the CPU budget shared by the campaign.
+
+    Returns:
+        dict: The document written to result.json, None for a dry run.
+    """
+    checked = check_args(args)
+    hostfile = checked["hostfile"]
+    ground_truth_file = checked["ground_truth_file"]
+    time_limit = checked["time_limit"]
+    patience_time = checked["patience_time"]
+
+    output_dir = Path(args.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    if shared is not None:
+        cache = shared.cache
+        ground_truth_data = shared.ground_truth(ground_truth_file, args)
+    else:
+        cache = StartupCache(args.cache_dir) if args.cache_dir != "" else None
+        ground_truth_data = load_ground_truth(cache, ground_truth_file, args)
+
+    if len(ground_truth_data[0]) == 0:
+        print("Error: No ground truth for the selected benchmarks, byte sizes and node counts", file=sys.stderr)
+        exit(-1)
+
     json_obj = {"config": {}, "results": {}}
 
     config_json = {
@@ -143,14 +325,60 @@ def main():
         "byte_sizes": args.byte_sizes,
         "node_count": args.node_counts,
         "algorithm": args.algorithm,
+        "batch_size": args.batch_size,
+        "decompose": args.decompose,
+        "broker": args.broker,
+        "local_workers": args.local_workers,
         "param_file": str(args.param_file),
         "split": args.split,
         "topology": args.topology,
         "simple_compute": args.simple_compute,
         "loss_function": args.loss_function,
-        "loss_aggregator": args.loss_aggregator
+        "loss_aggregator": args.loss_aggregator,
+        "num_threads": args.num_threads,
+        "warm_start": args.warm_start,
+        "patience": args.patience,
+        "patience_time": patience_time,
+        "min_improvement": args.min_improvement,
+        "min_expected_improvement": args.min_expected_improvement,
+        "sensitivity": args.sensitivity,
+        "store": args.store,
+        "journal": args.journal,
+        "output_dir": args.output_dir,
+        "campaign": shared.name if shared is not None else None,
+        "stats": args.stats,
+        "launcher": args.launcher,
+        "check_routes": not args.no_check_routes,
+        "repetitions": args.repetitions,
+        "interpolate": args.interpolate,
+        "finalists": args.finalists,
+        "top_k": args.top_k,
+        "max_cpus": args.max_cpus,
+        "pin_cpus": args.pin_cpus,
+        "cache_dir": str(cache.directory) if cache is not None else None
     }
 
+    if args.dry_run:
+        print(json.dumps(config_json, indent=4, default=str))
+        print(f"Known Points: {ground_truth_data[0]}")
+        return None
+
+    from SMPISimulator import SMPISimulator
+    from SMPISimulatorCalibrator import SMPISimulatorCalibrator
+    from SegmentedCalibrator import SegmentedCalibrator
+    from SensitivityAnalyzer import SensitivityAnalyzer
+    from ParameterSpace import ParameterSpace
+    from ConvergenceMonitor import ConvergenceMonitor
+    from EvaluationStore import EvaluationStore
+    from CPUBudget import CPUBudget
+    from EvaluationBroker import EvaluationBroker
+
+    store = None
+    if args.store:
+        # a relative store is written next to result.json
+        store = EvaluationStore(str(output_dir / args.store), config=config_json)
+        config_json["run_id"] = store.run_id
+
     print("-----------------------------------------------------")
     print(f"Known Points: {ground_truth_data[0]}")
     print(f"GroundTruth: {ground_truth_data[1][0:10]}")
@@ -161,37 +389,142 @@ def main():
 
     json_obj["config"] = config_json
 
-    with open("result.json", "w", encoding="utf-8") as f:
-        f.write(json.dumps(json_obj, cls=CustomJSONEncoder, indent=4))
-
-    smpi_sim = SMPISimulator(
-        ground_truth_data, "IMB-P2P", hostfile, 0.05, keep_tmp=False,
-        byte_split=args.split, topology_template=args.topology, simple=args.simple_compute,
-        loss_aggregator=args.loss_aggregator, loss_function=args.loss_function
+    # a relative journal is written next to result.json
+    journal = str(output_dir / args.journal) if args.journal else args.journal
+    writer = ResultWriter(str(output_dir / "result.json"), journal)
+    writer.snapshot(json_obj)
+
+    # also sent to the workers of the broker, which use their own CPU budget and cache
+    simulator_args = dict(
+        ground_truth=ground_truth_data, benchmark_parent="IMB-P2P", hostfile=hostfile, threshold=0.05,
+        keep_tmp=False, byte_split=args.split, topology_template=args.topology, simple=args.simple_compute,
+        loss_aggregator=args.loss_aggregator, loss_function=args.loss_function,
+        top_k=args.top_k, repetitions=args.repetitions, stats=args.stats,
+        launcher=args.launcher, check_routes=not args.no_check_routes
     )
-
-    calibrator = SMPISimulatorCalibrator(
-        args.algorithm, smpi_sim, args.param_file
+    if shared is not None:
+        cpu_budget = shared.cpu_budget.share(client)
+        hostspeed = shared.hostspeed
+    else:
+        cpu_budget = CPUBudget(args.max_cpus, args.pin_cpus)
+        hostspeed = None
+    smpi_sim = SMPISimulator(
+        **simulator_args, cpu_budget=cpu_budget, cache=cache, hostspeed=hostspeed,
+        interpolate=args.interpolate
     )
-
-    calibration, loss = calibrator.compute_calibration(time_limit, 1)
+    smpi_sim.store = store
+    smpi_sim.journal = writer
+    smpi_sim.log_dir = output_dir
+
+    broker = None
+    if args.broker is not None:
+        authkey = os.environ.get("SMPI_BROKER_AUTHKEY") or secrets.token_hex(16)
+        broker = EvaluationBroker(simulator_args, smpi_sim.hostspeed, args.broker, authkey.encode("utf-8"),
+                                  heartbeat_timeout=args.heartbeat_timeout, log_dir=str(output_dir.resolve()))
+        smpi_sim.broker = broker
+        print(f"Broker listening on {broker.address[0]}:{broker.address[1]}, start workers with:")
+        print(f"  SMPI_BROKER_AUTHKEY={authkey} {file_abs_path / 'run_smpi_worker.py'} "
+              f"<this host>:{broker.address[1]} -j <num_threads>")
+        broker.start_local_workers(args.local_workers, args.max_cpus)
+
+    if args.sensitivity is not None:
+        analyzer = SensitivityAnalyzer(
+            smpi_sim, ParameterSpace.from_file(args.param_file), method=args.sensitivity,
+            samples=args.samples, num_threads=args.num_threads
+        )
+
+        sensitivity = analyzer.analyze()
+        smpi_sim.cleanup()
+        if broker is not None:
+            broker.close()
+
+        json_obj["results"] = {"sensitivity": sensitivity,
+                               "best_loss": smpi_sim.best_loss, "best_result": smpi_sim.best_result,
+                               "top_k": smpi_sim.tracker.top_k(),
+                               "pareto_front": smpi_sim.tracker.pareto_front()}
+        if smpi_sim.cost_report is not None:
+            json_obj["results"]["cost"] = smpi_sim.cost_report.summary()
+
+        writer.snapshot(json_obj)
+        writer.close()
+        if store is not None:
+            store.close()
+        return json_obj
+
+    def monitor_factory():
+        return ConvergenceMonitor(args.patience, patience_time, args.min_improvement,
+                                  args.min_expected_improvement)
+
+    if args.decompose:
+        calibrator = SegmentedCalibrator(
+            args.algorithm, smpi_sim, args.param_file,
+            warm_start=args.warm_start, warm_start_width=args.warm_start_width,
+            monitor_factory=monitor_factory, batch_size=args.batch_size
+        )
+    else:
+        calibrator = SMPISimulatorCalibrator(
+            args.algorithm, smpi_sim, args.param_file,
+            warm_start=args.warm_start, warm_start_width=args.warm_start_width,
+            monitor=monitor_factory(), batch_size=args.batch_size
+        )
+
+    if broker is not None:
+        # evaluations no worker started by the end of the time limit are abandoned
+        broker.deadline = perf_counter() + time_limit
+    calibration, loss = calibrator.compute_calibration(time_limit, args.num_threads)
+    if broker is not None:
+        broker.deadline = None
+
+    finalists = None
+    if args.interpolate:
+        # the search compared interpolated losses, the finalists are ranked on every size
+        finalists = smpi_sim.finalize(args.finalists, args.num_threads)
+        if finalists:
+            calibration, loss = dict(finalists[0]["calibration"]), finalists[0]["loss"]
+            smpi_sim.best_result = finalists[0]["result"]
+    smpi_sim.cleanup()
+    if broker is not None:
+        broker.close()
 
     for i in calibration:
         calibration[i] = str(calibration[i])
 
     result_json = {"calibration": calibration,
-                   "loss": loss, "best_result": smpi_sim.best_result}
+                   "loss": loss, "best_result": smpi_sim.best_result,
+                   "convergence": calibrator.summary() if args.decompose else calibrator.monitor.summary(),
+                   "top_k": smpi_sim.tracker.top_k(),
+                   "pareto_front": smpi_sim.tracker.pareto_front()}
+
+    if smpi_sim.allocator is not None:
+        result_json["repetitions"] = smpi_sim.allocator.summary()
+    if broker is not None:
+        result_json["workers"] = broker.workers
+    if smpi_sim.cost_report is not None:
+        result_json["cost"] = smpi_sim.cost_report.summary()
+    if finalists is not None:
+        result_json["finalists"] = [
+            {"calibration": {k: str(v) for k, v in record["calibration"].items()}, "loss": record["loss"]}
+            for record in finalists
+        ]
 
     json_obj["results"] = result_json
 
-    with open("result.json", "w", encoding="utf-8") as f:
-        print("Calibrated Args: ")
-        print(calibration)
-        print(f"Loss: {loss}")
-        print(f"Best Loss (Sim): {smpi_sim.best_loss}")
-        print(f"Best Result: {smpi_sim.best_result}")
-        print("-----------------------------------------------------")
-        f.write(json.dumps(json_obj, cls=CustomJSONEncoder, indent=4))
+    print("Calibrated Args: ")
+    print(calibration)
+    print(f"Loss: {loss}")
+    print(f"Best Loss (Sim): {smpi_sim.best_loss}")
+    print(f"Best Result: {smpi_sim.best_result}")
+    print("-----------------------------------------------------")
+    writer.snapshot(json_obj)
+    writer.close()
+    if store is not None:
+        store.close()
+
+    return json_obj
+
+
+def main():
+    run(build_parser().parse_args())
 
 
 if __name__ == "__main__":
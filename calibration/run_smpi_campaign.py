@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+
+import sys
+import json
+import argparse
+from pathlib import Path
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Script to run a campaign of SMPI calibrations sharing their caches, store and CPUs")
+
+    parser.add_argument("campaign", type=str,
+                        help="JSON file with the common arguments and the matrix of configurations")
+
+    parser.add_argument("-o", "--output_dir", type=str, default="campaign",
+                        help="Directory of the campaign summary and of one result directory per "
+                             "configuration (Default: campaign)")
+
+    parser.add_argument("--parallel", type=int, default=None,
+                        help="Number of configurations run at the same time (Default: one per CPU)")
+
+    parser.add_argument("--max_cpus", type=int, default=None,
+                        help="Maximum number of CPUs used by the simulations of all configurations "
+                             "(Default: affinity mask and cgroup quota)")
+
+    parser.add_argument("--pin_cpus", action="store_true",
+                        help="Pin every simulation to the CPUs it was granted")
+
+    parser.add_argument("--cache_dir", type=str, default=None,
+                        help="Directory of the ground truth index, host speed and platform caches, "
+                             "empty to disable (Default: ~/.cache/smpi-calibration)")
+
+    parser.add_argument("--store", type=str, default="evaluations.db",
+                        help="SQLite file the evaluations of every configuration are written to, "
+                             "relative to --output_dir, empty to disable (Default: evaluations.db)")
+
+    parser.add_argument("--dry_run", action="store_true",
+                        help="Validate the configurations and print their arguments without running them")
+
+    args = parser.parse_args()
+
+    if not Path(args.campaign).exists():
+        print("Error: Campaign file does not exist", file=sys.stderr)
+        exit(-1)
+
+    with open(args.campaign, "r", encoding="utf-8") as f:
+        spec = json.load(f)
+
+    from Campaign import Campaign
+
+    campaign = Campaign(spec, args.output_dir, parallel=args.parallel, max_cpus=args.max_cpus,
+                        pin_cpus=args.pin_cpus, cache_dir=args.cache_dir, store=args.store)
+
+    if len(campaign.configurations) == 0:
+        print("Error: The campaign has no configuration", file=sys.stderr)
+        exit(-1)
+
+    if args.dry_run:
+        for configuration in campaign.configurations:
+            campaign.parse(configuration)
+            print(f"{configuration['name']}: {' '.join(configuration['argv'])}")
+        return
+
+    summary = campaign.run()
+
+    print("-----------------------------------------------------")
+    print(f"Campaign: {summary['name']} ({summary['configurations']} configurations, "
+          f"{summary['parallel']} at a time on {summary['cpus']} CPUs)")
+    print(f"Wall time: {summary['wall_time']:.1f}s (configurations: {summary['configuration_time']:.1f}s)")
+    for entry in summary["ranking"]:
+        print(f"  {entry['name']}  loss {entry['loss']}  {entry['values']}")
+    if summary["failed"]:
+        print(f"Failed: {', '.join(summary['failed'])}")
+    print("-----------------------------------------------------")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import argparse
+
+from StartupCache import StartupCache
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Script to run the evaluations of a run_smpi_calibrator.py broker")
+
+    parser.add_argument("address", type=str,
+                        help="host:port of the broker (see --broker of run_smpi_calibrator.py)")
+
+    parser.add_argument("-j", "--num_threads", type=int, default=1,
+                        help="Number of evaluations to run concurrently (Default: 1)")
+
+    parser.add_argument("--max_cpus", type=int, default=None,
+                        help="Maximum number of CPUs used by the simulations (Default: affinity mask and cgroup quota)")
+
+    parser.add_argument("--pin_cpus", action="store_true",
+                        help="Pin each simulation to the cores it was granted")
+
+    parser.add_argument("--cache_dir", type=str, default=None,
+                        help="Directory of the platform cache, empty to disable "
+                             "(Default: $SMPI_CALIBRATION_CACHE or ~/.cache/smpi-calibration)")
+
+    parser.add_argument("--log_dir", type=str, default=None,
+                        help="Directory of the simulator logs, created if needed "
+                             "(Default: worker-<host>-<pid> in the --output_dir of the calibrator)")
+
+    parser.add_argument("--heartbeat", type=float, default=10.0,
+                        help="Seconds between two heartbeats sent while simulating (Default: 10)")
+
+    args = parser.parse_args()
+
+    authkey = os.environ.get("SMPI_BROKER_AUTHKEY")
+    if not authkey:
+        print("Error: SMPI_BROKER_AUTHKEY is not set", file=sys.stderr)
+        exit(-1)
+
+    from CPUBudget import CPUBudget
+    from EvaluationBroker import EvaluationWorker
+
+    worker = EvaluationWorker(
+        args.address, authkey.encode("utf-8"), args.num_threads,
+        cpu_budget=CPUBudget(args.max_cpus, args.pin_cpus),
+        cache=StartupCache(args.cache_dir) if args.cache_dir != "" else None,
+        heartbeat_interval=args.heartbeat, log_dir=args.log_dir
+    )
+    worker.serve()
+
+
+if __name__ == "__main__":
+    main()
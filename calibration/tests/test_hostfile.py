@@ -0,0 +1,56 @@
+import threading
+from pathlib import Path
+
+from SMPISimulator import SMPISimulator
+
+defaults = Path(__file__).resolve().parent.parent / "defaults"
+
+
+def simulator(hostfile) -> SMPISimulator:
+    # hostfile_for only needs the hostfile and its per-scale cache
+    sim = object.__new__(SMPISimulator)
+    sim.hostfile = hostfile
+    sim.lock = threading.Lock()
+    sim.scale_hostfiles = {}
+    sim.hostfile_env = None
+    sim.platform_cache = {}
+    sim.keep_tmp = False
+    return sim
+
+
+def read_hosts(hostfile):
+    with open(hostfile, "r", encoding="utf-8") as f:
+        return [line.strip().split(":") for line in f if line.strip()]
+
+
+def test_two_node_scale_uses_two_hosts():
+    sim = simulator(defaults / "hostfile.txt")
+    try:
+        hosts = read_hosts(sim.hostfile_for(2, 2))
+        assert [host for host, _ in hosts] == ["node-0-cpu-0", "node-1-cpu-0"]
+        assert sum(int(slots) for _, slots in hosts) == 2
+    finally:
+        sim.cleanup()
+
+
+def test_one_hostfile_per_scale():
+    sim = simulator(defaults / "hostfile.txt")
+    try:
+        assert sim.hostfile_for(16, 64) == sim.hostfile_for(16, 64)
+        assert sim.hostfile_for(16, 64) != sim.hostfile_for(16, 16)
+        hosts = read_hosts(sim.hostfile_for(16, 64))
+        assert len(hosts) == 16 and all(slots == "4" for _, slots in hosts)
+    finally:
+        sim.cleanup()
+
+
+def test_scale_larger_than_user_hostfile(tmp_path):
+    hostfile = tmp_path / "hostfile.txt"
+    hostfile.write_text("node-0-cpu-0:6\nnode-1-cpu-0:6\n")
+    sim = simulator(hostfile)
+    try:
+        hosts = read_hosts(sim.hostfile_for(4, 8))
+        assert [host for host, _ in hosts] == [f"node-{n}-cpu-0" for n in range(4)]
+        assert all(slots == "2" for _, slots in hosts)
+    finally:
+        sim.cleanup()
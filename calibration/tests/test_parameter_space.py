@@ -0,0 +1,16 @@
+import pytest
+
+from ParameterSpace import Integer, Linear, Log
+
+
+@pytest.mark.parametrize("param, value", [
+    (Linear(1, 100).format("%.2fGf"), 12.5),
+    (Log(1e-9, 1e-3).format("%.3eus"), 2.5e-6),
+    (Integer(1, 128, 1).format("%dMB"), 64),
+])
+def test_decode_round_trip(param, value):
+    rendered = param.render(value)
+
+    # a value chosen by the optimizer, then the same value already rendered (e.g. a warm start)
+    assert param.decode(str(param.encode(rendered))) == rendered
+    assert param.decode(rendered) == rendered
@@ -101,6 +101,18 @@ sg4::NetZone* create_simple_node(const sg4::NetZone* parent_zone, unsigned long
   return node_zone;
 }
 
+sg4::NetZone* create_placeholder_node(const sg4::NetZone* parent_zone, unsigned long id)
+{
+  /* a leaf no rank runs on: keeps the numbering (and so the routes) of the other leaves of a
+   * fat tree without the hosts, links and routes of a full node */
+  auto* node_zone = sg4::create_full_zone("node-" + std::to_string(id))->set_parent(parent_zone);
+  auto* nic       = node_zone->create_router(node_zone->get_name() + "-nic");
+  node_zone->set_gateway(nic);
+  node_zone->seal();
+
+  return node_zone;
+}
+
 sg4::NetZone* simple_node(const sg4::NetZone* parent_zone, const std::vector<unsigned long>& /*coord*/, unsigned long id)
 {
   return create_simple_node(parent_zone, id);
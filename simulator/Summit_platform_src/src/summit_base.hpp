@@ -11,6 +11,9 @@ create_node(const sg4::NetZone* parent_zone, unsigned long id, bool with_gpus, b
 sg4::NetZone*
 create_simple_node(const sg4::NetZone* parent_zone, unsigned long id);
 
+sg4::NetZone*
+create_placeholder_node(const sg4::NetZone* parent_zone, unsigned long id);
+
 sg4::NetZone*
 simple_node(const sg4::NetZone* parent_zone, const std::vector<unsigned long>& /*coord*/, unsigned long id);
 
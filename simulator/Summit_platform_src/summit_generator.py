@@ -12,6 +12,97 @@ SIMGRID_INSTALL_PATH = "/usr/local" #NOTE: change this accordingly
 f_node = open(sys.argv[1])
 node = json.load(f_node)
 
+f_topo = open(sys.argv[2])
+topo = json.load(f_topo)
+
+# star topologies may nest their parameters under "Star-Zone_parameters"
+star = dict(topo, **topo.get("Star-Zone_parameters", {}))
+
+
+def xml_value(value, unit):
+      # bare numbers of the JSON configs are in SimGrid's base units (Bps, s)
+      return f"{value}{unit}" if isinstance(value, (int, float)) else value
+
+
+def xml_link(link_id, bandwidth, latency, sharing_policy):
+      policy = f' sharing_policy="{sharing_policy}"' if sharing_policy != "SHARED" else ""
+      return (f'  <link id="{link_id}" bandwidth="{xml_value(bandwidth, "Bps")}" '
+              f'latency="{xml_value(latency, "s")}"{policy}/>\n')
+
+
+def xml_link_ctn(link_id, split_duplex):
+      direction = ' direction="UP"' if split_duplex else ""
+      return f'<link_ctn id="{link_id}"{direction}/>'
+
+
+def star_platform_xml():
+      """
+      XML platform equivalent to the star zone of the C++ branch below: every node zone
+      reaches a center zone through its host link then the backbone, so no compilation is needed.
+      """
+      full_node = star["node_generator_cb"] == "no_gpu_no_nvme"
+      backbone_split = star["sharing_policy"] == "SPLITDUPLEX"
+      host_split = star["host_sharing_policy"] == "SPLITDUPLEX"
+      center = star["name"] + "-center"
+
+      xml = ["<?xml version='1.0'?>\n",
+             '<!DOCTYPE platform SYSTEM "https://simgrid.org/simgrid.dtd">\n',
+             '<platform version="4.1">\n',
+             f'<zone id="{star["name"]}" routing="DijkstraCache">\n',
+             f'  <zone id="{center}" routing="None">\n',
+             f'    <router id="{center}-router"/>\n',
+             '  </zone>\n',
+             xml_link("backbone", star["bandwidth"], star["latency"], star["sharing_policy"])]
+
+      routes = []
+      for i in range(star["nb_nodes"]):
+            name = f"node-{i}"
+            host = f'    <host id="{name}-cpu-{{}}" speed="{node["cpu_speed"]}" core="{node["cpu_core_count"]}"/>\n'
+
+            xml.append(f'  <zone id="{name}" routing="Full">\n')
+            if full_node:
+                  # create_node: two CPUs linked by the X-bus, each reaching the NIC over PCIe
+                  xml.extend(host.format(c) for c in range(2))
+                  xml.append(f'    <router id="{name}-nic"/>\n')
+                  for c in range(2):
+                        xml.append("  " + xml_link(f"pcie-link-{name}-cpu-{c}", node["pcie_bw"], node["pcie_lat"], "SHARED"))
+                  xml.append("  " + xml_link(f"bus-{name}", node["xbus_bw"], node["xbus_lat"], "SHARED"))
+                  for c in range(2):
+                        xml.append(f'    <route src="{name}-cpu-{c}" dst="{name}-nic">'
+                                   f'{xml_link_ctn(f"pcie-link-{name}-cpu-{c}", False)}</route>\n')
+                  xml.append(f'    <route src="{name}-cpu-0" dst="{name}-cpu-1">{xml_link_ctn(f"bus-{name}", False)}</route>\n')
+                  gateway = f"{name}-nic"
+            else:
+                  # create_simple_node: a single CPU
+                  xml.append(host.format(0))
+                  gateway = f"{name}-cpu-0"
+            xml.append("  </zone>\n")
+
+            # like the C++ branch, non split-duplex host links keep the default sharing policy
+            xml.append(xml_link(f"host_link_{i}", star["host_bandwidth"], star["host_latency"],
+                                "SPLITDUPLEX" if host_split else "SHARED"))
+
+            routes.append(f'  <zoneRoute src="{name}" dst="{center}" gw_src="{gateway}" gw_dst="{center}-router">'
+                          f'{xml_link_ctn(f"host_link_{i}", host_split)}{xml_link_ctn("backbone", backbone_split)}'
+                          '</zoneRoute>\n')
+
+      xml.extend(routes)
+      xml.append("</zone>\n")
+      xml.append("</platform>\n")
+
+      return "".join(xml)
+
+
+# --xml: write <name>.xml for star topologies instead of compiling <name>.so
+if len(sys.argv) > 3 and sys.argv[3] == "--xml":
+      if "Fat-Tree_parameters" in topo:
+            sys.stderr.write("XML platforms are only generated for star topologies\n")
+            sys.exit(1)
+
+      with open(topo["name"] + ".xml", 'w') as f:
+            f.write(star_platform_xml())
+      sys.exit(0)
+
 # get path of this file
 path = Path(__file__).parent.absolute()
 
@@ -37,19 +128,28 @@ with open(path / 'src/node_config.hpp', 'w') as f:
       f.write("constexpr const char* nvme_write_bw = \"" + node["nvme_write_bw"] + "\";\n\n")
       f.write("constexpr const char* limiter_bw = \"" + node["limiter_bw"] + "\";\n")
 
-f_topo = open(sys.argv[2])
-topo = json.load(f_topo)
-
 if "Fat-Tree_parameters" in topo:
+      # leaves from used_nodes on (sized to the hostfile by SMPISimulator.size_topology) get placeholder zones
+      used_nodes = topo["Fat-Tree_parameters"].get("used_nodes")
+      node_cb = topo["node_generator_cb"] if used_nodes is None else "used_node"
+
       with open('tmp.cpp', 'w') as f:
             f.write("#include \"summit_base.hpp\"\n")
             f.write("extern \"C\" void load_platform(const sg4::Engine& e);\n")
+            if used_nodes is not None:
+                  f.write("static sg4::NetZone* used_node(const sg4::NetZone* parent_zone, "
+                          "const std::vector<unsigned long>& coord, unsigned long id)\n")
+                  f.write("{\n")
+                  f.write(f"  if (id >= {int(used_nodes)})\n")
+                  f.write("    return create_placeholder_node(parent_zone, id);\n")
+                  f.write(f"  return {topo['node_generator_cb']}(parent_zone, coord, id);\n")
+                  f.write("}\n")
             f.write("void load_platform(const sg4::Engine&)\n")
             f.write("{\n")
             f.write("sg4::create_fatTree_zone(\"" + topo["name"] +"\", nullptr, {" +
                   str(topo["Fat-Tree_parameters"]["levels"]) + ", " + topo["Fat-Tree_parameters"]["up_links"] + ", " +
                   topo["Fat-Tree_parameters"]["down_links"] + ", " + topo["Fat-Tree_parameters"]["links_number"] +
-                  "}, {" + topo["node_generator_cb"] + ", {}, " + topo["limiter_cb"] + "}, " +
+                  "}, {" + node_cb + ", {}, " + topo["limiter_cb"] + "}, " +
                   str(topo["bandwidth"]) + ", " + str(topo["latency"]) +
                   ", sg4::Link::SharingPolicy::" + topo["sharing_policy"] +")->seal();\n")
             f.write("}\n")
@@ -59,6 +159,7 @@ else:
             f.write("extern \"C\" void load_platform(const sg4::Engine& e);\n")
             f.write("void load_platform(const sg4::Engine&)\n")
             f.write("{\n")
+            topo = star
             f.write(f"""auto* cluster = sg4::create_star_zone("{topo["name"]}");\n""")
             f.write(f"""const sg4::Link* backbone = cluster->{"create_split_duplex_link" if topo["sharing_policy"] == "SPLITDUPLEX" else "create_link"}""" +
                     f"""("backbone", {topo["bandwidth"]})->set_latency({topo["latency"]})""")
@@ -0,0 +1,57 @@
+/* Prints the route between pairs of hosts of a platform, one JSON object per line:
+ *
+ *   {"src": "node-0-cpu-0", "dst": "node-18-cpu-0", "latency": 5e-08, "links": [[bandwidth, latency, sharing_policy], ...]}
+ *
+ * Used to compare the routes of a trimmed platform with the routes of the full one (see
+ * SMPISimulator.check_routes). Hosts missing from the platform get an "error" instead of links.
+ */
+#include <simgrid/s4u.hpp>
+#include <fstream>
+#include <iostream>
+#include <sstream>
+#include <string>
+#include <vector>
+
+namespace sg4 = simgrid::s4u;
+
+int main(int argc, char **argv) {
+  sg4::Engine e(&argc, argv);
+
+  if (argc < 3) {
+    std::cerr << "Usage: " << argv[0] << " <platform_file> <pairs_file>" << std::endl;
+    std::cerr << "       <pairs_file> holds one \"<src_host> <dst_host>\" pair per line" << std::endl;
+    return 1;
+  }
+
+  e.load_platform(argv[1]);
+
+  std::ifstream pairs(argv[2]);
+  std::string src_name;
+  std::string dst_name;
+  while (pairs >> src_name >> dst_name) {
+    const sg4::Host *src = sg4::Host::by_name_or_null(src_name);
+    const sg4::Host *dst = sg4::Host::by_name_or_null(dst_name);
+
+    std::cout << "{\"src\": \"" << src_name << "\", \"dst\": \"" << dst_name << "\", ";
+    if (src == nullptr || dst == nullptr) {
+      std::cout << "\"error\": \"unknown host\"}" << std::endl;
+      continue;
+    }
+
+    std::vector<sg4::Link *> links;
+    double latency = 0;
+    src->route_to(dst, links, &latency);
+
+    std::ostringstream route;
+    route.precision(17);
+    route << "\"latency\": " << latency << ", \"links\": [";
+    for (size_t i = 0; i < links.size(); i++) {
+      route << (i ? ", " : "") << "[" << links[i]->get_bandwidth() << ", " << links[i]->get_latency() << ", "
+            << static_cast<int>(links[i]->get_sharing_policy()) << "]";
+    }
+    route << "]}";
+    std::cout << route.str() << std::endl;
+  }
+
+  return 0;
+}
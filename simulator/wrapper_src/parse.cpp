@@ -7,10 +7,14 @@ std::vector<BenchmarkData> parse_file(std::string &filename) {
         return {};
     }
 
+    return parse_stream(infile);
+}
+
+std::vector<BenchmarkData> parse_stream(std::istream &input) {
     std::vector<BenchmarkData> benchmarkMap;
 
     std::string line;
-    while (std::getline(infile, line)) {
+    while (std::getline(input, line)) {
         std::regex pattern("\t*\\s*#");
         std::smatch matches;
 
@@ -20,5 +20,6 @@ struct BenchmarkData {
 };
 
 std::vector<BenchmarkData> parse_file(std::string &filename);
+std::vector<BenchmarkData> parse_stream(std::istream &input);
 
 #endif /* PARSE_HEADER_INCLUDED */
\ No newline at end of file
@@ -1,5 +1,7 @@
 #include <boost/format.hpp>
+#include <algorithm>
 #include <cassert>
+#include <chrono>
 #include <cmath>
 #include <fstream>
 #include <iostream>
@@ -7,6 +9,10 @@
 #include "parse.hpp"
 #include <boost/algorithm/string.hpp>
 #include <unistd.h>
+#include <fcntl.h>
+#include <spawn.h>
+#include <sys/stat.h>
+#include <sys/wait.h>
 #include <omp.h>
 #include <sched.h>    
     
@@ -58,11 +64,201 @@ bool LocalData::need_more_benchs() const {
   return res;
 }
 
+// Full-precision number for the JSON-lines output (JSON has no nan/inf literals)
+std::string json_number(double value) {
+  if (!std::isfinite(value)) {
+    return "null";
+  }
+  return boost::str(boost::format("%.17g") % value);
+}
+
+// Cost of the smpirun runs of a byte size, summed over its iterations
+class RunStats {
+public:
+  double wall_time = 0.0;        /* wall time of smpirun, including platform parsing */
+  double simulated_time = 0.0;   /* simulated time at the end of the simulation */
+  double simulation_time = 0.0;  /* wall time of the simulation, after parsing and platform setup */
+  double application_time = 0.0; /* part of it spent computing in the application */
+  int timed_runs = 0;            /* runs whose SimGrid timing could be parsed */
+
+  void parse_timing(const std::string &log);
+  std::string json() const;
+};
+
+// Reads the smpi/display-timing report of SimGrid:
+//   ... Simulated time: <t> seconds.
+//   The simulation took <t> seconds (after parsing and platform setup)
+//   <t> seconds were actual computation of the application
+void RunStats::parse_timing(const std::string &log) {
+  std::istringstream lines(log);
+  std::string line;
+  bool found = false;
+  while (std::getline(lines, line)) {
+    size_t pos;
+    if ((pos = line.find("Simulated time: ")) != std::string::npos) {
+      simulated_time += std::atof(line.c_str() + pos + 16);
+      found = true;
+    } else if ((pos = line.find("The simulation took ")) != std::string::npos) {
+      simulation_time += std::atof(line.c_str() + pos + 20);
+    } else if (line.find(" seconds were actual computation of the application") != std::string::npos) {
+      application_time += std::atof(line.c_str());
+    }
+  }
+  if (found) {
+    timed_runs++;
+  }
+}
+
+std::string RunStats::json() const {
+  return boost::str(boost::format("{\"wall_time\": %s, \"simulated_time\": %s, \"simulation_time\": %s, "
+                                  "\"application_time\": %s, \"timed_runs\": %d}") %
+                    json_number(wall_time) % json_number(simulated_time) % json_number(simulation_time) %
+                    json_number(application_time) % timed_runs);
+}
+
+// Records the arguments and environment smpirun starts smpimain with, then runs it (see Launch::capture)
+static const char *capture_script =
+    "#!/bin/sh\n"
+    "out=\"$1\"\n"
+    "shift\n"
+    "env -0 > \"$out.env\"\n"
+    "printf '%s\\0' \"$@\" > \"$out.args\"\n"
+    "exec \"$@\"\n";
+
+std::vector<std::string> read_null_separated(const std::string &filename) {
+  std::ifstream file(filename, std::ios::binary);
+  std::vector<std::string> items;
+  std::string item;
+  while (std::getline(file, item, '\0')) {
+    items.push_back(item);
+  }
+  return items;
+}
+
+std::string read_file(const std::string &filename) {
+  std::ifstream file(filename);
+  std::stringstream content;
+  content << file.rdbuf();
+  return content.str();
+}
+
+// The smpimain command line of an smpirun invocation. smpirun is a shell script that parses its
+// arguments and generates the deployment of every rank from the hostfile before starting
+// smpimain; the repetitions of a byte size run the same command, so that work is done
+// once and smpimain is spawned directly, its output read from a pipe.
+class Launch {
+public:
+  std::vector<std::string> args;
+  std::vector<std::string> env;
+
+  bool capture(const std::string &smpirun_args, const std::string &redirections, const std::string &script,
+               const std::string &prefix);
+  int run(std::string &output, const std::string &err_filename) const;
+  void cleanup(const std::string &prefix) const;
+};
+
+bool Launch::capture(const std::string &smpirun_args, const std::string &redirections, const std::string &script,
+                     const std::string &prefix) {
+  // a regular smpirun run, except that smpimain is started through the capture script and the
+  // files smpirun generates are kept (in the working directory, through TMPDIR) for the spawns
+  char cwd[PATH_MAX];
+  if (getcwd(cwd, sizeof(cwd)) == nullptr) {
+    std::system(("smpirun " + smpirun_args + redirections).c_str());
+    return false;
+  }
+  std::string command = "TMPDIR=" + std::string(cwd) + " smpirun -keep-temps -wrapper \"" + script + " " + prefix +
+                        "\" " + smpirun_args + redirections;
+  if (std::system(command.c_str()) != 0) {
+    return false;
+  }
+
+  args = read_null_separated(prefix + ".args");
+  env = read_null_separated(prefix + ".env");
+  return !args.empty() && !env.empty();
+}
+
+int Launch::run(std::string &output, const std::string &err_filename) const {
+  int pipe_fds[2];
+  // close-on-exec, so the processes spawned by the other threads do not hold the pipe open
+  if (pipe2(pipe_fds, O_CLOEXEC) != 0) {
+    return -1;
+  }
+
+  posix_spawn_file_actions_t actions;
+  posix_spawn_file_actions_init(&actions);
+  posix_spawn_file_actions_adddup2(&actions, pipe_fds[1], STDOUT_FILENO);
+  posix_spawn_file_actions_addopen(&actions, STDERR_FILENO, err_filename.c_str(), O_WRONLY | O_CREAT | O_TRUNC, 0644);
+
+  std::vector<char *> argv;
+  for (const std::string &arg : args) {
+    argv.push_back(const_cast<char *>(arg.c_str()));
+  }
+  argv.push_back(nullptr);
+  std::vector<char *> envp;
+  for (const std::string &var : env) {
+    envp.push_back(const_cast<char *>(var.c_str()));
+  }
+  envp.push_back(nullptr);
+
+  pid_t pid;
+  int res = posix_spawnp(&pid, argv[0], &actions, nullptr, argv.data(), envp.data());
+  posix_spawn_file_actions_destroy(&actions);
+  close(pipe_fds[1]);
+  if (res != 0) {
+    close(pipe_fds[0]);
+    return -1;
+  }
+
+  char buffer[4096];
+  ssize_t n;
+  while ((n = read(pipe_fds[0], buffer, sizeof(buffer))) > 0) {
+    output.append(buffer, n);
+  }
+  close(pipe_fds[0]);
+
+  int status;
+  waitpid(pid, &status, 0);
+  return WIFEXITED(status) ? WEXITSTATUS(status) : -1;
+}
+
+void Launch::cleanup(const std::string &prefix) const {
+  std::remove((prefix + ".args").c_str());
+  std::remove((prefix + ".env").c_str());
+  // files generated by smpirun (deployment, hostfile copies)
+  for (const std::string &arg : args) {
+    if (arg.find("smpitmp-") != std::string::npos) {
+      std::remove(arg.c_str());
+    }
+  }
+}
+
 int main(int argc, char **argv) {
+  // --jsonl: print one JSON object per byte size (full-precision mean, count, relstderr
+  // and samples) instead of the space-separated %.2f means
+  // --stats: time every smpirun and collect the SimGrid timing report (with --jsonl)
+  // --launcher: go through smpirun once per byte size and spawn smpimain directly for the
+  // other repetitions (see Launch)
+  bool jsonl = false;
+  bool stats = false;
+  bool launcher = false;
+  while (argc > 1 && (std::string(argv[1]) == "--jsonl" || std::string(argv[1]) == "--stats" ||
+                      std::string(argv[1]) == "--launcher")) {
+    if (std::string(argv[1]) == "--jsonl") {
+      jsonl = true;
+    } else if (std::string(argv[1]) == "--stats") {
+      stats = true;
+    } else {
+      launcher = true;
+    }
+    argv[1] = argv[0];
+    argv++;
+    argc--;
+  }
+
   if (argc < 8) {
     std::cerr << "Usage: " << argv[0]
-              << " <platform_file> <hostfile> <executable> <benchmark> <thresholds> "
-                 "<max_iters> <byte_sizes>"
+              << " [--jsonl] [--stats] [--launcher] <platform_file> <hostfile> <executable> <benchmark> <thresholds> "
+                 "<max_iters[,...]> <byte_sizes>"
               << std::endl;
     return 1;
   }
@@ -72,7 +268,10 @@ int main(int argc, char **argv) {
   const std::string hostfile = argv[2];
   const std::string executable = argv[3];
   std::string benchmark = argv[4];       // grab from cmdline
-  int max_iters = std::stoi(argv[6]);    // grab from cmdline
+  // grab from cmdline: one maximum for every byte size, or one per byte size
+  std::string iters_string = argv[6];
+  std::vector<std::string> iters;
+  boost::split(iters, iters_string, boost::is_any_of(","));
 
   std::string byte_string = argv[7];
   std::vector<std::string> byte_sizes;
@@ -83,25 +282,46 @@ int main(int argc, char **argv) {
   boost::split(byte_sizes, byte_string, boost::is_any_of(","));
 
   std::vector<std::string> final_benchmarks(24, "");
+  std::vector<LocalData> final_data(byte_sizes.size());
+  std::vector<std::vector<double>> samples(byte_sizes.size());
+  std::vector<RunStats> run_stats(byte_sizes.size());
   
   std::vector<int> cpus = get_available_cpus();
 
   fprintf(stderr, "Available CPUs: %d\n", (int) cpus.size());
 
-  // Setting num_procs to run
-  omp_set_num_threads(byte_sizes.size());
+  // Setting num_procs to run: one thread per byte size, but never more than the
+  // CPUs in our affinity mask (OMP_THREAD_LIMIT caps it further)
+  int nb_threads = byte_sizes.size();
+  if (!cpus.empty() && (int) cpus.size() < nb_threads) {
+    nb_threads = cpus.size();
+  }
+  omp_set_num_threads(nb_threads);
 
 
   FILE *original_stdout = fdopen(dup(fileno(stdout)), "w");
 
-  #pragma omp parallel 
-  {
-    int rank = omp_get_thread_num();
+  const std::string script = "./launch_capture.sh";
+  if (launcher) {
+    std::ofstream script_file(script);
+    script_file << capture_script;
+    script_file.close();
+    chmod(script.c_str(), 0755);
+  }
+
+  // byte sizes are handed out one at a time, so fewer threads still cover all of them
+  #pragma omp parallel for schedule(dynamic, 1)
+  for (int rank = 0; rank < (int) byte_sizes.size(); rank++) {
 
     std::string filename = "p2p_" + std::to_string(rank) + ".log";
+    std::string err_filename = "p2p_" + std::to_string(rank) + ".err";
+    std::string launch_prefix = "launch_" + std::to_string(rank);
 
     std::string byte = byte_sizes[rank];
 
+    // at least one run, so every byte size has a mean
+    int max_iters = std::max(1, std::stoi(iters.size() == 1 ? iters[0] : iters[rank]));
+
     LocalData data = LocalData{
         std::stod(thresholds[rank]), // threshold
         0.0,       // relstderr
@@ -122,15 +342,31 @@ int main(int argc, char **argv) {
 
     // command = "taskset -c " + std::to_string(cpus[rank % cpus.size()]) + " ";
 
-    command += "smpirun -platform " + platform_file + " -hostfile " + hostfile + " " + executable + " " + benchmark+ " -iter " + iterations + " -msgsz " + byte ;
+    std::string smpirun_args = "-platform " + platform_file + " -hostfile " + hostfile + " " + executable + " " + benchmark+ " -iter " + iterations + " -msgsz " + byte ;
 
     for (int j = 8; j < argc; j++) {
-      command += " ";
-      command += argv[j];
+      smpirun_args += " ";
+      smpirun_args += argv[j];
+    }
+
+    if (stats) {
+      // after the --log=root.threshold:error of the caller, so the timing report is printed
+      smpirun_args += " --cfg=smpi/display-timing:yes --log=smpi_kernel.threshold:info";
     }
 
-    command += " > ";
-    command += filename;
+    std::string redirections = " > " + filename;
+
+    // the stderr of each run is read back (stats) or comes from a spawned smpimain (launcher)
+    bool capture_err = stats || launcher;
+    if (capture_err) {
+      redirections += " 2> ";
+      redirections += err_filename;
+    }
+
+    command += "smpirun " + smpirun_args + redirections;
+
+    Launch launch;
+    bool launched = false;
 
     #pragma omp critical
     {
@@ -145,23 +381,57 @@ int main(int argc, char **argv) {
   
   
     for (int k = 0; k < max_iters; k++) {
-      std::system(command.c_str());
-    
-      std::vector<BenchmarkData> benchmarkMap = parse_file(filename);
+      auto start = std::chrono::steady_clock::now();
+      std::string output;
+      bool spawned = launched && launch.run(output, err_filename) == 0;
+      if (launched && !spawned) {
+        // e.g. smpimain could not be spawned: this and the next repetitions go through smpirun
+        #pragma omp critical
+        std::cerr << "[" << rank << "] Spawning smpimain failed, falling back to smpirun" << std::endl;
+        launched = false;
+        output.clear();
+      }
+      if (!spawned) {
+        if (launcher && k == 0) {
+          // the first repetition goes through smpirun and records its smpimain command, the
+          // next ones run smpirun again if that failed
+          launched = launch.capture(smpirun_args, redirections, script, launch_prefix);
+        } else {
+          std::system(command.c_str());
+        }
+        output = read_file(filename);
+        std::remove(filename.c_str());
+      }
 
-      std::string rm_command = "rm " + filename;
+      if (stats) {
+        run_stats[rank].wall_time +=
+            std::chrono::duration<double>(std::chrono::steady_clock::now() - start).count();
+      }
+
+      if (capture_err) {
+        std::string err_log = read_file(err_filename);
+        std::remove(err_filename.c_str());
+        if (stats) {
+          run_stats[rank].parse_timing(err_log);
+        }
+
+        // the stderr of smpirun still ends up in the stderr of the wrapper
+        #pragma omp critical
+        std::cerr << err_log;
+      }
+
+      std::istringstream output_stream(output);
+      std::vector<BenchmarkData> benchmarkMap = parse_stream(output_stream);
 
-    
       if (benchmarkMap.size() != 1) {
   std::cerr << "Rank [" << rank << "]: assertion failed! BenchmarkMap's size: " << benchmarkMap.size() << std::endl;
   abort();
       }
 
-      std::system(rm_command.c_str());
-
       // update the stats
       data.count++;
       double mb_per_sec = benchmarkMap[0].mb_per_sec;
+      samples[rank].push_back(mb_per_sec);
       data.sum         += mb_per_sec;
       data.sum_pow2    += mb_per_sec * mb_per_sec;
       double n          = data.count;
@@ -170,11 +440,22 @@ int main(int argc, char **argv) {
 
       fprintf(stderr, "[%d] Iteration %d: %.2f relstderr %.2f MBps\n", rank, k, data.relstderr, mb_per_sec);
       if (!data.need_more_benchs()) {
-        final_benchmarks[rank] = boost::str(boost::format("%.2f") % data.mean);
-        fprintf(stderr, "[%d] Iterations: %d\n", rank, data.count);
         break;
       }
     }
+
+    // whether the loop stopped on the threshold or ran out of iterations
+    final_benchmarks[rank] = boost::str(boost::format("%.2f") % data.mean);
+    final_data[rank] = data;
+    fprintf(stderr, "[%d] Iterations: %d\n", rank, data.count);
+
+    if (launcher) {
+      launch.cleanup(launch_prefix);
+    }
+  }
+
+  if (launcher) {
+    std::remove(script.c_str());
   }
 
 
@@ -182,7 +463,23 @@ int main(int argc, char **argv) {
 
   stdout = original_stdout;
 
-  fprintf(stdout, "%s\n", result.c_str());
+  if (jsonl) {
+    for (size_t i = 0; i < byte_sizes.size(); i++) {
+      std::vector<std::string> sample_strings;
+      for (double sample : samples[i]) {
+        sample_strings.push_back(json_number(sample));
+      }
+
+      std::string stats_field = stats ? ", \"stats\": " + run_stats[i].json() : "";
+
+      fprintf(stdout, "{\"index\": %d, \"bytes\": %s, \"mean\": %s, \"count\": %d, \"relstderr\": %s, \"samples\": [%s]%s}\n",
+              (int) i, byte_sizes[i].c_str(), json_number(final_data[i].mean).c_str(), final_data[i].count,
+              json_number(final_data[i].relstderr).c_str(), boost::algorithm::join(sample_strings, ", ").c_str(),
+              stats_field.c_str());
+    }
+  } else {
+    fprintf(stdout, "%s\n", result.c_str());
+  }
   fprintf(stderr, "Result: %s\n\n", result.c_str());
 
   return 0;